@@ -0,0 +1,298 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+import models
+
+# Respawn delays after the daemon dies; the last one repeats until it stays up.
+RESPAWN_DELAYS_MS = (500, 1000, 2000, 5000, 10000, 30000)
+# A daemon that ran this long is considered healthy and resets the backoff.
+STABLE_UPTIME_S = 30
+# How long a metrics dump waits for the daemon's STATS reply
+STATS_TIMEOUT_S = 0.5
+
+# Commands issued within one frame go to the daemon as a single message.
+COMMAND_BATCH_MS = 16
+# Window commands whose consecutive ids merge into one line, e.g. "CLOSE 3 7 9"
+MERGEABLE_COMMANDS = ("CLOSE", "MINIMIZE", "UNMINIMIZE")
+
+class CommandQueue:
+    """
+    Coalesces daemon commands for one frame. An ACTIVATE right after another
+    supersedes it, so sweeping the pointer over a window list only activates the
+    last target, and repeated CLOSE/MINIMIZE/UNMINIMIZE lines merge their ids.
+    Nothing is reordered: an ACTIVATE followed by another command is kept.
+    """
+    def __init__(self, send):
+        self._send = send
+        self._pending = []  # [verb, [args...]] in issue order
+        self._flush_source_id = None
+        self.stats = {"queued": 0, "lines": 0, "batches": 0, "superseded": 0, "merged": 0}
+
+    def push(self, command):
+        self.stats["queued"] += 1
+        verb, _, args = command.partition(" ")
+        if verb == "ACTIVATE" and self._pending and self._pending[-1][0] == verb:
+            self._pending[-1] = [verb, args.split()]
+            self.stats["superseded"] += 1
+            return
+        if verb in MERGEABLE_COMMANDS and self._pending and self._pending[-1][0] == verb:
+            ids = self._pending[-1][1]
+            for window_id in args.split():
+                if window_id not in ids:
+                    ids.append(window_id)
+            self.stats["merged"] += 1
+            return
+        self._pending.append([verb, args.split()])
+        if not self._flush_source_id:
+            self._flush_source_id = GLib.timeout_add(COMMAND_BATCH_MS, self.flush)
+
+    def flush(self):
+        if self._flush_source_id:
+            GLib.source_remove(self._flush_source_id)
+            self._flush_source_id = None
+        if self._pending:
+            lines = [" ".join([verb] + args) for verb, args in self._pending]
+            self._pending = []
+            self.stats["lines"] += len(lines)
+            self.stats["batches"] += 1
+            self._send("\n".join(lines) + "\n")
+        return False
+
+    def clear(self):
+        """Drops pending commands, e.g. when the daemon's window ids are no longer valid."""
+        self._pending = []
+        if self._flush_source_id:
+            GLib.source_remove(self._flush_source_id)
+            self._flush_source_id = None
+
+def parse_counts(text):
+    """A STATS field like "title:12,done:30" as an ordered dict of ints."""
+    counts = {}
+    for part in (text or "").split(","):
+        key, _, value = part.partition(":")
+        if value.isdigit(): counts[key] = int(value)
+    return counts
+
+def parse_histogram(text):
+    """A STATS histogram, "10:0,25:3,...,inf:1,max:130", as a metrics.Histogram."""
+    counts = parse_counts(text)
+    bounds = [int(key) for key in counts if key.isdigit()]
+    if not bounds: return None
+    return metrics.Histogram.from_counts(bounds, [counts[str(bound)] for bound in bounds] + [counts.get("inf", 0)],
+                                         counts.get("max", 0))
+
+class ToplevelMonitor:
+    """
+    Owns and supervises the toplevel_monitor process. The daemon connects to the
+    event bus (its stderr is inherited); a bus reader thread decodes its lines
+    into DaemonEvents, and every batch decoded since the main loop last looked
+    is handed to the AppService at once. If the daemon dies it is respawned
+    with backoff and the AppService resyncs from a SNAPSHOT. The daemon's own
+    counters are fetched with STATS when the metrics are dumped; the reader
+    thread hands the reply straight to the waiting dump.
+    """
+    def __init__(self, app_service, event_bus, executable="./bin/toplevel_monitor"):
+        self.app_service = app_service
+        self.event_bus = event_bus
+        self.executable = executable
+        self.process = None
+        self.peer = None
+        self._child_watch_id = None
+        self._started_at = 0.0
+        self._respawn_attempt = 0
+        self._respawn_source_id = None
+        self._stopping = False
+        self.stats = {"events": 0, "batches": 0, "dropped": 0, "restarts": 0}
+        self.commands = CommandQueue(self._send_batch)
+        # Params of the last STATS reply, when it came, and the event counts of the one before
+        self.daemon_stats = None
+        self._daemon_stats_at = None
+        self._previous_events = None
+        # Signalled by the reader thread when a STATS reply arrives
+        self._stats_reply = threading.Condition()
+        self._stats_replies = 0
+        event_bus.set_role_handler("daemon", self._on_messages, self._on_connect, self._on_disconnect)
+        metrics.register("monitor", self.format_stats)
+        metrics.register("daemon", self.format_daemon_stats)
+
+    def start(self):
+        self._started_at = time.monotonic()
+        self.app_service.begin_resync()
+        env = dict(os.environ, TIXBAR_SOCKET=self.event_bus.path)
+        self.process = subprocess.Popen([self.executable], stdin=subprocess.DEVNULL, env=env)
+        self._child_watch_id = GLib.child_watch_add(GLib.PRIORITY_DEFAULT, self.process.pid, self._on_child_exit)
+
+    def send_command(self, command: str):
+        """Queues a command; everything queued within a frame is sent together."""
+        if not self.peer:
+            self.stats["dropped"] += 1
+            return
+        self.commands.push(command)
+
+    def _send_batch(self, message):
+        if self.peer:
+            self.event_bus.send(self.peer, message)
+
+    def _on_connect(self, peer):
+        # Only the process we spawned may speak for the compositor
+        if not self.process or peer.pid != self.process.pid:
+            print(f"Rejecting daemon connection from pid {peer.pid}", file=sys.stderr)
+            self.event_bus.disconnect(peer)
+            return
+        self.peer = peer
+        self.event_bus.read_in_thread(peer, self._decode, self._on_events)
+
+    def _on_messages(self, peer, lines):
+        # Only what arrived together with the HELLO is read on the main loop
+        self._on_events(peer, self._decode(lines))
+
+    def _decode(self, lines):
+        # Runs on the reader thread: STATS replies go to a waiting dump, not through the main loop
+        events = models.decode_daemon_lines(lines)
+        for event in events:
+            if event.command == "STATS": self._on_daemon_stats(event.params)
+        return [event for event in events if event.command != "STATS"]
+
+    def _on_events(self, peer, events):
+        if peer is not self.peer: return
+        self.stats["events"] += len(events)
+        self.stats["batches"] += 1
+        if events: self.app_service.apply_daemon_events(events)
+
+    def _on_daemon_stats(self, params):
+        with self._stats_reply:
+            if self.daemon_stats is not None:
+                self._previous_events = (self._daemon_stats_at, parse_counts(self.daemon_stats.get("events")))
+            self.daemon_stats = params
+            self._daemon_stats_at = time.monotonic()
+            self._stats_replies += 1
+            self._stats_reply.notify_all()
+
+    def fetch_stats(self, timeout=STATS_TIMEOUT_S):
+        """Asks the daemon for STATS and waits for the reply; False if none came in time."""
+        if not self.peer: return False
+        # Pending commands go first, so the reply reflects them
+        self.commands.flush()
+        with self._stats_reply:
+            replies = self._stats_replies
+        self._send_batch("STATS\n")
+        with self._stats_reply:
+            return self._stats_reply.wait_for(lambda: self._stats_replies != replies, timeout)
+
+    def format_daemon_stats(self):
+        connected = bool(self.peer)
+        fresh = self.fetch_stats()
+        with self._stats_reply:
+            stats, stats_at, previous_events = self.daemon_stats, self._daemon_stats_at, self._previous_events
+        if stats is None: return "no reply" if connected else "not connected"
+        # Older numbers are still shown, but say so
+        age_text = "" if fresh else f"; {'no reply, ' if connected else ''}as of {time.monotonic() - stats_at:.0f} s ago"
+        events = parse_counts(stats.get("events"))
+        rates = {}
+        if previous_events:
+            previous_at, previous = previous_events
+            minutes = max(stats_at - previous_at, 1.0) / 60.0
+            # A restarted daemon counts from zero again; skip rates that would be negative
+            rates = {name: (count - previous.get(name, 0)) / minutes for name, count in events.items()
+                     if count >= previous.get(name, 0)}
+        event_text = ", ".join(f"{name} {count}" + (f" ({rates[name]:.1f}/min)" if name in rates else "")
+                               for name, count in events.items())
+        matches = parse_counts(stats.get("matches"))
+        def histogram_text(key, unit):
+            histogram = parse_histogram(stats.get(key))
+            return histogram.format(unit) if histogram else "none"
+        return (f"{stats.get('toplevels')} toplevels, {stats.get('outputs')} outputs, {stats.get('apps')} desktop entries; "
+                f"{stats.get('queries')} queries, last {stats.get('last_query_ms')} ms, durations {histogram_text('query_ms', ' ms')}; "
+                f"events: {event_text}; app_id matched directly {matches.get('app_id', 0)}, by title {matches.get('title', 0)}, "
+                f"not at all {matches.get('none', 0)}; {stats.get('lines_out')} lines, {stats.get('bytes_out')} bytes "
+                f"in {stats.get('write_calls')} writes; dispatch {histogram_text('dispatch_us', ' us')}; "
+                f"command batches {histogram_text('command_us', ' us')}" + age_text)
+
+    def _on_disconnect(self, peer):
+        if peer is not self.peer: return
+        self.peer = None
+        self.commands.clear()
+        # A daemon that dropped the bus is of no use to us; the child watch respawns it.
+        # The watch owns reaping, so signal the pid directly rather than through Popen
+        # (poll/kill would waitpid and steal the exit status from GLib).
+        if self.process and self._child_watch_id:
+            try:
+                os.kill(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _on_child_exit(self, pid, status):
+        self._child_watch_id = None
+        process, self.process = self.process, None
+        if process is None or process.pid != pid:
+            return
+        self.commands.clear()
+        if self.peer:
+            peer, self.peer = self.peer, None
+            self.event_bus.disconnect(peer)
+        exit_code = os.waitstatus_to_exitcode(status)
+        # GLib reaped the child; keep Popen from waiting on it again
+        process.returncode = exit_code
+        if not self._stopping:
+            print(f"toplevel_monitor exited with status {exit_code}", file=sys.stderr)
+            self._schedule_respawn()
+
+    def _schedule_respawn(self):
+        if time.monotonic() - self._started_at >= STABLE_UPTIME_S:
+            self._respawn_attempt = 0
+        delay = RESPAWN_DELAYS_MS[min(self._respawn_attempt, len(RESPAWN_DELAYS_MS) - 1)]
+        self._respawn_attempt += 1
+        print(f"Restarting toplevel_monitor in {delay} ms", file=sys.stderr)
+        self._respawn_source_id = GLib.timeout_add(delay, self._respawn)
+
+    def _respawn(self):
+        self._respawn_source_id = None
+        self.stats["restarts"] += 1
+        try:
+            self.start()
+        except OSError as e:
+            print(f"Failed to restart toplevel_monitor: {e}", file=sys.stderr)
+            self._schedule_respawn()
+        return False
+
+    def format_stats(self):
+        events = self.stats["events"]
+        commands = self.commands.stats
+        return (f"{events} events in {self.stats['batches']} batches "
+                f"({metrics.per_thousand(self.stats['batches'], events):.1f} per 1000 events); "
+                f"{commands['queued']} commands sent as {commands['lines']} lines in {commands['batches']} batches "
+                f"({commands['superseded']} activations superseded, {commands['merged']} merged), "
+                f"{self.stats['dropped']} dropped while disconnected; {self.stats['restarts']} restarts; "
+                f"{models.decode_errors} undecodable lines skipped")
+
+    def stop(self):
+        """Disconnects the daemon so it exits cleanly and reports its own counters."""
+        self._stopping = True
+        # The exit dump runs after the daemon is gone; it shows these final counters
+        self.fetch_stats()
+        self.commands.flush()
+        if self._respawn_source_id:
+            GLib.source_remove(self._respawn_source_id)
+            self._respawn_source_id = None
+        if self._child_watch_id:
+            GLib.source_remove(self._child_watch_id)
+            self._child_watch_id = None
+        if self.peer:
+            peer, self.peer = self.peer, None
+            self.event_bus.disconnect(peer)
+        if not self.process:
+            return
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
@@ -0,0 +1,338 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+import collections
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+import metrics
+
+SOCKET_NAME = "tixbar.sock"
+# Peers keep each message below 64 KiB; the slack catches a single oversized line.
+MAX_MESSAGE_SIZE = 256 * 1024
+ROLES = ("daemon", "click", "client")
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/tixbar-{os.getuid()}"
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+class Peer:
+    """One connection on the bus. The role is unknown until its HELLO arrives."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.role = None
+        self.pid = struct.unpack("3i", sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))[0]
+        self.outbox = collections.deque()
+        # Set by read_in_thread: the peer is then only in the epoll set while its outbox is not empty
+        self.reader = None
+        self.in_epoll = True
+        self._inbox = []  # decoded batches not yet handed to the main loop, None once closed
+        self._inbox_lock = threading.Lock()
+        self._handoff_pending = False
+
+class EventBus:
+    """
+    A SOCK_SEQPACKET socket multiplexing the toplevel daemon, the click listener
+    and external clients. Every connection lives in one epoll set behind a single
+    GLib watch, and every read returns exactly one message of newline-separated
+    lines. Clients send requests and get one OK/ERR reply message each.
+    A busy peer can instead be read and decoded by a thread of its own, see
+    read_in_thread.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("TIXBAR_SOCKET") or default_socket_path()
+        self.listener = None
+        self.epoll = None
+        self.peers = {}
+        self._watch_id = None
+        # role -> (on_message(peer, lines), on_connect(peer), on_disconnect(peer))
+        self._roles = {}
+        self._requests = {}
+        self.stats = {"wakeups": 0, "messages": 0, "bytes": 0, "requests": 0, "truncated": 0, "handoffs": 0}
+        self.register_request("PING", lambda args: "PONG")
+        self.register_request("STATS", lambda args: metrics.dump())
+        metrics.register("bus", self.format_stats)
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC)
+        self.listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.listener.listen(8)
+        self.epoll = select.epoll()
+        self.epoll.register(self.listener.fileno(), select.EPOLLIN)
+        self._watch_id = GLib.io_add_watch(self.epoll.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._on_ready)
+
+    def set_role_handler(self, role, on_message, on_connect=None, on_disconnect=None):
+        self._roles[role] = (on_message, on_connect, on_disconnect)
+
+    def register_request(self, name, handler):
+        """handler(args) returns the reply body (or None); raising ValueError replies ERR."""
+        self._requests[name] = handler
+
+    def peers_with_role(self, role):
+        return [peer for peer in self.peers.values() if peer.role == role]
+
+    def read_in_thread(self, peer, decode, on_batch):
+        """
+        Moves reading peer off the main loop: a thread receives its messages and
+        runs decode(lines) on them, and on_batch(peer, items) gets everything
+        decoded since the last hand-off from a single idle callback, so the main
+        loop neither splits nor parses. Sending is unchanged.
+        """
+        peer.reader = threading.Thread(target=self._reader_thread, args=(peer, decode, on_batch),
+                                       name=f"bus-{peer.role}-reader", daemon=True)
+        self._set_epoll_events(peer, select.EPOLLOUT if peer.outbox else 0)
+        peer.reader.start()
+
+    def _reader_thread(self, peer, decode, on_batch):
+        # Only the socket and the inbox are touched here; everything else happens in the hand-off
+        poller = select.poll()
+        poller.register(peer.fd, select.POLLIN)
+        try:
+            while True:
+                poller.poll()
+                try:
+                    data, _, flags, _ = peer.sock.recvmsg(MAX_MESSAGE_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data, flags = b"", 0
+                if not data:
+                    break
+                lines = [line for line in data.decode("utf-8", "replace").split("\n") if line]
+                self._post(peer, on_batch, (decode(lines), len(data), bool(flags & socket.MSG_TRUNC)))
+        except Exception:
+            # A reader that dies silently would leave the peer connected but deaf
+            print(f"Error in {peer.role} reader thread:\n{traceback.format_exc()}", file=sys.stderr)
+        # Hangs up the peer on the main loop, so its owner can replace it
+        self._post(peer, on_batch, None)
+
+    def _post(self, peer, on_batch, batch):
+        with peer._inbox_lock:
+            peer._inbox.append(batch)
+            if peer._handoff_pending: return
+            peer._handoff_pending = True
+        GLib.idle_add(self._hand_off, peer, on_batch)
+
+    def _hand_off(self, peer, on_batch):
+        with peer._inbox_lock:
+            batches, peer._inbox = peer._inbox, []
+            peer._handoff_pending = False
+        if self.peers.get(peer.fd) is not peer: return False
+        self.stats["handoffs"] += 1
+        items = []
+        closed = False
+        for batch in batches:
+            if batch is None:
+                closed = True
+                break
+            decoded, size, truncated = batch
+            items.extend(decoded)
+            self.stats["messages"] += 1
+            self.stats["bytes"] += size
+            if truncated:
+                self.stats["truncated"] += 1
+                print(f"Truncated message from {peer.role} peer {peer.pid}", file=sys.stderr)
+        if items:
+            self._call_handler(f"{peer.role} batch", on_batch, peer, items)
+        if closed:
+            self.disconnect(peer)
+        return False
+
+    def _set_epoll_events(self, peer, events):
+        """Threaded peers leave the epoll set instead of waiting on nothing but hangups there."""
+        if peer.reader is not None:
+            wanted = events & select.EPOLLOUT
+            if wanted and not peer.in_epoll:
+                self.epoll.register(peer.fd, wanted)
+            elif wanted:
+                self.epoll.modify(peer.fd, wanted)
+            elif peer.in_epoll:
+                self.epoll.unregister(peer.fd)
+            peer.in_epoll = bool(wanted)
+            return
+        self.epoll.modify(peer.fd, events)
+
+    def send(self, peer, text):
+        """Queues one message to a peer; messages are never merged or split."""
+        data = text.encode("utf-8")
+        if peer.outbox:
+            peer.outbox.append(data)
+            return
+        try:
+            peer.sock.send(data)
+        except BlockingIOError:
+            peer.outbox.append(data)
+            self._set_epoll_events(peer, select.EPOLLIN | select.EPOLLOUT)
+        except OSError as e:
+            print(f"Dropping {peer.role or 'new'} peer {peer.pid}: {e}", file=sys.stderr)
+            self.disconnect(peer)
+
+    def broadcast(self, role, text):
+        for peer in self.peers_with_role(role):
+            self.send(peer, text)
+
+    def disconnect(self, peer):
+        if self.peers.pop(peer.fd, None) is None:
+            return
+        if peer.in_epoll:
+            self.epoll.unregister(peer.fd)
+        if peer.reader is not None:
+            # Wakes the reader's poll; it exits without touching the socket again
+            try:
+                peer.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            peer.reader.join()
+        peer.sock.close()
+        handlers = self._roles.get(peer.role)
+        if handlers and handlers[2]:
+            self._call_handler(f"{peer.role} disconnect", handlers[2], peer)
+
+    def _on_ready(self, fd, condition):
+        self.stats["wakeups"] += 1
+        for ready_fd, events in self.epoll.poll(0):
+            if ready_fd == self.listener.fileno():
+                self._accept()
+                continue
+            peer = self.peers.get(ready_fd)
+            if peer is None:
+                continue
+            if events & select.EPOLLOUT:
+                self._flush_outbox(peer)
+            if peer.reader is not None:
+                # Its thread reads and reports the hangup itself; stop polling a dead socket meanwhile
+                if events & (select.EPOLLHUP | select.EPOLLERR) and peer.fd in self.peers:
+                    self._set_epoll_events(peer, 0)
+                continue
+            if events & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+                self._read_peer(peer)
+        return True
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            peer = Peer(sock)
+            self.peers[peer.fd] = peer
+            self.epoll.register(peer.fd, select.EPOLLIN)
+
+    def _read_peer(self, peer):
+        # A role handler may hand the peer to a reader thread from _hello on
+        while peer.fd in self.peers and peer.reader is None:
+            try:
+                data, _, flags, _ = peer.sock.recvmsg(MAX_MESSAGE_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                data, flags = b"", 0
+            if not data:
+                self.disconnect(peer)
+                return
+            self.stats["messages"] += 1
+            self.stats["bytes"] += len(data)
+            if flags & socket.MSG_TRUNC:
+                self.stats["truncated"] += 1
+                print(f"Truncated message from {peer.role} peer {peer.pid}", file=sys.stderr)
+            lines = [line for line in data.decode("utf-8", "replace").split("\n") if line]
+            if peer.role is None:
+                if not lines or not self._hello(peer, lines.pop(0)):
+                    return
+            if lines:
+                self._dispatch(peer, lines)
+
+    def _hello(self, peer, line):
+        parts = line.split()
+        role = parts[1].partition("=")[2].lower() if len(parts) == 2 and parts[0] == "HELLO" else None
+        if role not in ROLES:
+            self.send(peer, f"ERR expected HELLO ROLE=<{'|'.join(ROLES)}>\n")
+            self.disconnect(peer)
+            return False
+        peer.role = role
+        self.send(peer, "WELCOME\n")
+        handlers = self._roles.get(role)
+        if handlers and handlers[1]:
+            self._call_handler(f"{role} connect", handlers[1], peer)
+        return peer.fd in self.peers
+
+    def _dispatch(self, peer, lines):
+        if peer.role == "client":
+            for line in lines:
+                self._handle_request(peer, line)
+            return
+        handlers = self._roles.get(peer.role)
+        if handlers:
+            self._call_handler(f"{peer.role} message", handlers[0], peer, lines)
+
+    def _call_handler(self, name, handler, *args):
+        # Everything runs under the bus's single GLib watch, which an escaping exception would remove
+        try:
+            handler(*args)
+        except Exception:
+            print(f"Error in {name} handler:\n{traceback.format_exc()}", file=sys.stderr)
+
+    def _handle_request(self, peer, line):
+        self.stats["requests"] += 1
+        name, _, args = line.partition(" ")
+        handler = self._requests.get(name)
+        if handler is None:
+            self.send(peer, f"ERR unknown request {name}\n")
+            return
+        try:
+            body = handler(args.strip())
+        except ValueError as e:
+            self.send(peer, f"ERR {e}\n")
+            return
+        except Exception as e:
+            print(f"Error in request {name}:\n{traceback.format_exc()}", file=sys.stderr)
+            self.send(peer, f"ERR {e}\n")
+            return
+        self.send(peer, f"OK\n{body}\n" if body else "OK\n")
+
+    def _flush_outbox(self, peer):
+        while peer.outbox:
+            try:
+                peer.sock.send(peer.outbox[0])
+            except BlockingIOError:
+                return
+            except OSError:
+                self.disconnect(peer)
+                return
+            peer.outbox.popleft()
+        self._set_epoll_events(peer, select.EPOLLIN)
+
+    def format_stats(self):
+        roles = collections.Counter(peer.role or "pending" for peer in self.peers.values())
+        peers = ", ".join(f"{count} {role}" for role, count in sorted(roles.items())) or "no peers"
+        return (f"{self.stats['messages']} messages ({self.stats['bytes']} bytes) in {self.stats['wakeups']} wakeups "
+                f"and {self.stats['handoffs']} reader thread hand-offs; "
+                f"{self.stats['requests']} requests; {self.stats['truncated']} truncated; {peers}")
+
+    def stop(self):
+        for peer in list(self.peers.values()):
+            self.disconnect(peer)
+        if self._watch_id:
+            GLib.source_remove(self._watch_id)
+            self._watch_id = None
+        if self.epoll:
+            self.epoll.close()
+        if self.listener:
+            self.listener.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
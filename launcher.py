@@ -0,0 +1,124 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib, Gio
+import collections
+import queue
+import sys
+import threading
+import time
+
+import metrics
+
+SPAWN_FLAGS = GLib.SpawnFlags.SEARCH_PATH | GLib.SpawnFlags.DO_NOT_REAP_CHILD
+DBUS_ACTIVATE_TIMEOUT_MS = 5000
+# Click-to-spawn latencies kept for the percentiles in the metrics dump
+LATENCY_SAMPLES = 256
+
+def dbus_object_path(app_id):
+    """Object path of a D-Bus activatable application, per the desktop entry spec."""
+    return "/" + app_id.replace(".", "/").replace("-", "_")
+
+class Launcher:
+    """
+    Starts applications without blocking the main loop. A single worker thread
+    does the D-Bus activation or spawn; results come back through idle_add,
+    where every spawned child gets a child watch so none is left a zombie.
+    """
+    def __init__(self, on_failed=None):
+        # Called on the main loop with the app_id of a launch that could not start
+        self.on_failed = on_failed
+        self._jobs = queue.Queue()
+        self._worker = None
+        self._session_bus = None
+        self.running = {}  # pid -> app_id, until the child is reaped
+        self.latencies_ms = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.stats = {"launches": 0, "spawned": 0, "activated": 0, "failed": 0, "reaped": 0}
+        metrics.register("launcher", self.format_stats)
+
+    def launch(self, entry, prefer_exec=False, clicked_at=None):
+        """
+        Queues a launch of entry and returns at once; False if there is nothing to run.
+        prefer_exec skips D-Bus activation, which would only raise a running instance.
+        """
+        use_dbus = entry.dbus_activatable and not (prefer_exec and entry.argv)
+        if not use_dbus and not entry.argv:
+            return False
+        dbus_call = ("Activate", GLib.Variant("(a{sv})", ({},))) if use_dbus else None
+        self._submit(entry.app_id, entry.argv, dbus_call, clicked_at)
+        return True
+
+    def launch_action(self, entry, action, clicked_at=None):
+        """Queues one of entry's desktop actions, via ActivateAction for D-Bus activatable apps."""
+        if not entry.dbus_activatable and not action.argv:
+            return False
+        dbus_call = ("ActivateAction", GLib.Variant("(sava{sv})", (action.id, [], {}))) if entry.dbus_activatable else None
+        self._submit(entry.app_id, action.argv, dbus_call, clicked_at)
+        return True
+
+    def _submit(self, app_id, argv, dbus_call, clicked_at):
+        self.stats["launches"] += 1
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run_worker, name="launcher", daemon=True)
+            self._worker.start()
+        self._jobs.put((app_id, argv, dbus_call, clicked_at or time.monotonic()))
+
+    def _run_worker(self):
+        while True:
+            app_id, argv, dbus_call, clicked_at = self._jobs.get()
+            if dbus_call:
+                error = self._activate(app_id, *dbus_call)
+                if error is None:
+                    GLib.idle_add(self._on_launched, app_id, None, time.monotonic() - clicked_at, None)
+                    continue
+                if not argv:
+                    GLib.idle_add(self._on_launched, app_id, None, 0.0, error)
+                    continue
+                print(f"D-Bus activation of {app_id} failed ({error}); running Exec instead", file=sys.stderr)
+            try:
+                pid, _, _, _ = GLib.spawn_async(list(argv), flags=SPAWN_FLAGS)
+                GLib.idle_add(self._on_launched, app_id, int(pid), time.monotonic() - clicked_at, None)
+            except GLib.Error as e:
+                GLib.idle_add(self._on_launched, app_id, None, 0.0, e.message)
+
+    def _activate(self, app_id, method, parameters):
+        """Calls a method of org.freedesktop.Application; returns an error message or None."""
+        try:
+            if self._session_bus is None:
+                self._session_bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+            self._session_bus.call_sync(
+                app_id, dbus_object_path(app_id), "org.freedesktop.Application", method,
+                parameters, None, Gio.DBusCallFlags.NONE, DBUS_ACTIVATE_TIMEOUT_MS, None)
+            return None
+        except GLib.Error as e:
+            return e.message
+
+    def _on_launched(self, app_id, pid, latency_s, error):
+        if error:
+            self.stats["failed"] += 1
+            print(f"Failed to launch {app_id}: {error}", file=sys.stderr)
+            if self.on_failed: self.on_failed(app_id)
+            return False
+        self.latencies_ms.append(latency_s * 1000.0)
+        if pid is None:
+            self.stats["activated"] += 1
+            return False
+        self.stats["spawned"] += 1
+        self.running[pid] = app_id
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid, self._on_child_exit)
+        return False
+
+    def _on_child_exit(self, pid, status):
+        self.running.pop(pid, None)
+        self.stats["reaped"] += 1
+        GLib.spawn_close_pid(pid)
+
+    def format_stats(self):
+        latencies = sorted(self.latencies_ms)
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            latency = f"click-to-spawn p50 {p50:.1f} ms, p95 {p95:.1f} ms, max {latencies[-1]:.1f} ms"
+        else:
+            latency = "no launches timed"
+        return (f"{self.stats['launches']} launches ({self.stats['spawned']} spawned, {self.stats['activated']} via D-Bus, "
+                f"{self.stats['failed']} failed); {len(self.running)} running, {self.stats['reaped']} reaped; {latency}")
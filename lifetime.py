@@ -0,0 +1,107 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+import collections
+import weakref
+
+import metrics
+
+# Owners not yet destroyed, per kind ("popup", "widget"), and what they hold
+_live = collections.Counter()
+# Destroyed owners whose Python wrapper is still referenced somewhere: leaks
+_destroyed = weakref.WeakSet()
+
+class Lifetime:
+    """
+    Signal handlers and GLib sources owned by a widget. Everything connected or
+    scheduled through it is disconnected or removed when the owner is destroyed,
+    so a closure never outlives its widget and keeps it reachable.
+    """
+    def __init__(self, owner, kind="widget"):
+        self.kind = kind
+        self._connections = []  # (object, handler_id) on objects other than the owner
+        self._sources = set()
+        self._timers = []  # scheduler.Timer subscriptions
+        self._alive = True
+        _live[kind] += 1
+        # Handlers on the owner itself die with it; only the destroy hook is needed
+        owner.connect("destroy", self._on_owner_destroyed)
+
+    def connect(self, obj, signal, handler, *args):
+        handler_id = obj.connect(signal, handler, *args)
+        self._connections.append((obj, handler_id))
+        _live["connections"] += 1
+        return handler_id
+
+    def disconnect(self, obj, handler_id):
+        if (obj, handler_id) in self._connections:
+            self._connections.remove((obj, handler_id))
+            obj.disconnect(handler_id)
+            _live["connections"] -= 1
+
+    def add_timer(self, timer):
+        """Cancels a scheduler timer with the owner; returns it."""
+        self._timers.append(timer)
+        return timer
+
+    def timeout_add(self, interval_ms, callback, *args):
+        return self._add_source(lambda run: GLib.timeout_add(interval_ms, run), callback, args)
+
+    def timeout_add_seconds(self, interval_s, callback, *args):
+        return self._add_source(lambda run: GLib.timeout_add_seconds(interval_s, run), callback, args)
+
+    def idle_add(self, callback, *args):
+        return self._add_source(GLib.idle_add, callback, args)
+
+    def _add_source(self, add, callback, args):
+        source_id = None
+        def run():
+            if callback(*args): return True
+            # A source that ends by returning False must not be removed again
+            self._forget_source(source_id)
+            return False
+        source_id = add(run)
+        self._sources.add(source_id)
+        _live["sources"] += 1
+        return source_id
+
+    def remove_source(self, source_id):
+        if source_id in self._sources:
+            GLib.source_remove(source_id)
+            self._forget_source(source_id)
+
+    def _forget_source(self, source_id):
+        if source_id in self._sources:
+            self._sources.discard(source_id)
+            _live["sources"] -= 1
+
+    def _on_owner_destroyed(self, owner):
+        if not self._alive: return
+        self._alive = False
+        for obj, handler_id in self._connections:
+            if obj.handler_is_connected(handler_id):
+                obj.disconnect(handler_id)
+        _live["connections"] -= len(self._connections)
+        self._connections = []
+        for source_id in self._sources:
+            GLib.source_remove(source_id)
+        _live["sources"] -= len(self._sources)
+        self._sources = set()
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        _live[self.kind] -= 1
+        _destroyed.add(owner)
+
+def live_counts():
+    counts = dict(_live)
+    counts["leaked"] = len(_destroyed)
+    return counts
+
+def format_stats():
+    counts = live_counts()
+    return (f"{counts.get('popup', 0)} popups, {counts.get('widget', 0)} widgets, "
+            f"{counts.get('connections', 0)} connections, {counts.get('sources', 0)} sources live; "
+            f"{counts['leaked']} destroyed but still referenced")
+
+metrics.register("lifetimes", format_stats)
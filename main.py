@@ -1,20 +1,28 @@
 import gi
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, Gdk, GLib, GObject, Gio
-import subprocess
+import locale
 import sys
-import shlex
 import signal
-import os
-import json
+import time
 
 from popup_manager import PopupManager
+from daemon import ToplevelMonitor
+from event_bus import EventBus
+from launcher import Launcher
+from state_store import StateStore
+from watchdog import Watchdog
+from profiling import Profiler
+from lifetime import Lifetime
+from soak import SoakTest
+import scheduler
+from models import AppIndex, DesktopEntry, DesktopAction, Window as WindowRecord, FIELD_APP_ID, FIELD_TITLE
+import metrics
 
 from fabric import Application
 from fabric.widgets.box import Box
 from fabric.widgets.button import Button
 from fabric.widgets.centerbox import CenterBox
-from fabric.widgets.datetime import DateTime
 from fabric.widgets.entry import Entry
 from fabric.widgets.eventbox import EventBox
 from fabric.widgets.label import Label
@@ -28,36 +36,17 @@ from fabric.utils import get_relative_path
 from network import NetworkService, NetworkWidget
 from widgets import FakeEntry
 
-toplevel_monitor_process = None
-PINNED_APPS_FILE = "pinned_apps.json"
-
-def parse_parameters(param_string):
-    params = {}
-    parts = shlex.split(param_string)
-    for part in parts:
-        if '=' in part:
-            key, value = part.split('=', 1)
-            params[key.lower()] = value
-    return params
-
-def parse_actions(data):
-    actions_list = []
-    if "actions" in data and data["actions"]:
-        action_strings = data["actions"].split(';')
-        for action_str in action_strings:
-            if not action_str: continue
-            parts = action_str.split('|')
-            if len(parts) == 2:
-                actions_list.append({"name": parts[0], "value": parts[1]})
-    return actions_list
+toplevel_monitor = None
+# A window's title is republished at most this often; nothing on the bar itself shows titles.
+TITLE_THROTTLE_MS = 250
+# Start menu rows bound at a time while scrolling the full app listing
+LISTING_PAGE_SIZE = 40
+# A launch shows as "starting" on the task list until its first window maps or this runs out.
+LAUNCH_TIMEOUT_S = 20
 
 def send_command(command: str):
-    if toplevel_monitor_process and toplevel_monitor_process.stdin:
-        try:
-            toplevel_monitor_process.stdin.write(command + "\n")
-            toplevel_monitor_process.stdin.flush()
-        except (BrokenPipeError, OSError) as e:
-            print(f"Error sending command: {e}", file=sys.stderr)
+    if toplevel_monitor:
+        toplevel_monitor.send_command(command)
 
 
 # ===================================================================
@@ -67,40 +56,183 @@ def send_command(command: str):
 class AppService(GObject.GObject):
     __gsignals__ = {
         'data-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        # Title-only changes, throttled per window, for widgets that render titles
+        'title-changed': (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+        # The daemon's outputs were added, removed or moved
+        'outputs-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
     }
 
-    def __init__(self):
+    def __init__(self, state_store):
         super().__init__()
+        self.state_store = state_store
         self.db = {}
+        # The DB sorted for the start menu, kept in step with every DB change
+        self.app_index = AppIndex()
         self.windows = []
+        self.outputs = {}  # daemon output id -> Output
         self.pinned_app_ids = []
         self.real_active_window_id = None
         self._idle_update_source_id = None
-        self.load_pinned_apps()
-
-    def load_pinned_apps(self):
-        if os.path.exists(PINNED_APPS_FILE):
-            try:
-                with open(PINNED_APPS_FILE, 'r') as f:
-                    self.pinned_app_ids = json.load(f)
-            except (json.JSONDecodeError, IOError):
-                self.pinned_app_ids = []
-
-    def save_pinned_apps(self):
-        try:
-            with open(PINNED_APPS_FILE, 'w') as f:
-                json.dump(self.pinned_app_ids, f, indent=4)
-        except IOError as e:
-            print(f"Error saving pinned apps: {e}", file=sys.stderr)
+        # Generation of the desktop DB we hold, as reported by the daemon's QUERY_DONE
+        self.db_generation = None
+        # While resyncing, per-window events are dropped until a SNAPSHOT replaces the list
+        self._resyncing = True
+        self._snapshot = None
+        self._query_seen_app_ids = None
+        # Set when a DB_SNAPSHOT could not be read, so QUERY_DONE does not mark the DB current
+        self._db_incomplete = False
+        # Window id -> throttle timer, and ids whose title changed again while it ran
+        self._title_timers = {}
+        self._title_dirty = set()
+        self.title_stats = {"updates": 0, "emitted": 0}
+        self.launcher = Launcher(on_failed=self._on_launch_failed)
+        # app_id -> timeout source of a launch whose window has not appeared yet
+        self.pending_launches = {}
+        self.launch_stats = {"placeholders": 0, "taken_over": 0, "timed_out": 0, "repeat_clicks": 0}
+        metrics.register("launches", self.format_launch_stats)
+        # Desktop actions, fetched per app on first use: app_id -> tuple of DesktopAction
+        self.actions_cache = {}
+        self._actions_partial = {}
+        self._actions_waiters = {}
+        # app_id -> Gio.FileMonitor on the .desktop file the cached actions came from
+        self._actions_monitors = {}
+        metrics.register("titles", self.format_title_stats)
+        # The store owns this list; its order is the order of the pinned buttons
+        self.pinned_app_ids = state_store.setdefault("pinned", [])
 
     def toggle_pin(self, app_id):
         if app_id in self.pinned_app_ids:
             self.pinned_app_ids.remove(app_id)
         else:
             self.pinned_app_ids.append(app_id)
-        self.save_pinned_apps()
+        self.state_store.changed()
         self.emit('data-changed')
     
+    def launch(self, app_id, prefer_exec=False):
+        """
+        Starts app_id off the main loop and shows it as starting right away;
+        returns False if it has no Exec or D-Bus activation.
+        """
+        if app_id in self.pending_launches and not prefer_exec:
+            # Still starting; a second click must not start a second instance
+            self.launch_stats["repeat_clicks"] += 1
+            return True
+        entry = self.db.get(app_id)
+        if not entry or not self.launcher.launch(entry, prefer_exec):
+            return False
+        self.state_store.record_launch(app_id, time.time())
+        if app_id not in self.pending_launches:
+            self.launch_stats["placeholders"] += 1
+            self.pending_launches[app_id] = GLib.timeout_add_seconds(LAUNCH_TIMEOUT_S, self._on_launch_timeout, app_id)
+            self.emit('data-changed')
+        return True
+
+    def _resolve_pending_launch(self, app_id):
+        """A window for app_id arrived; the caller's redraw replaces the placeholder."""
+        source_id = self.pending_launches.pop(app_id, None)
+        if source_id is None: return
+        GLib.source_remove(source_id)
+        self.launch_stats["taken_over"] += 1
+
+    def _on_launch_timeout(self, app_id):
+        self.pending_launches.pop(app_id, None)
+        self.launch_stats["timed_out"] += 1
+        self.emit('data-changed')
+        return False
+
+    def _on_launch_failed(self, app_id):
+        source_id = self.pending_launches.pop(app_id, None)
+        if source_id is None: return
+        GLib.source_remove(source_id)
+        self.emit('data-changed')
+
+    def format_launch_stats(self):
+        return (f"{self.launch_stats['placeholders']} placeholders, {self.launch_stats['taken_over']} taken over by windows, "
+                f"{self.launch_stats['timed_out']} timed out, {self.launch_stats['repeat_clicks']} repeat clicks ignored")
+
+    def launch_action(self, app_id, action):
+        entry = self.db.get(app_id)
+        return bool(entry) and self.launcher.launch_action(entry, action)
+
+    def request_actions(self, app_id, callback=None):
+        """Calls callback(actions) once the actions of app_id are known, at once if cached."""
+        if app_id in self.actions_cache:
+            if callback: callback(self.actions_cache[app_id])
+            return
+        waiters = self._actions_waiters.get(app_id)
+        if waiters is None:
+            waiters = self._actions_waiters[app_id] = []
+            send_command(f"ACTIONS {app_id}")
+        if callback: waiters.append(callback)
+
+    def _finish_actions(self, app_id, path):
+        entry = self.db.get(app_id) or DesktopEntry(app_id)
+        actions = tuple(DesktopAction(p.get("id"), p.get("name"), p.get("exec"), entry)
+                        for p in self._actions_partial.pop(app_id, ()))
+        self.actions_cache[app_id] = actions
+        if path and app_id not in self._actions_monitors:
+            monitor = Gio.File.new_for_path(path).monitor_file(Gio.FileMonitorFlags.NONE, None)
+            monitor.connect("changed", self._on_desktop_file_changed, app_id)
+            self._actions_monitors[app_id] = monitor
+        for callback in self._actions_waiters.pop(app_id, ()):
+            callback(actions)
+
+    def _on_desktop_file_changed(self, monitor, file, other_file, event_type, app_id):
+        if event_type == Gio.FileMonitorEvent.CHANGED: return  # CHANGES_DONE_HINT follows
+        # Refetched on the next right-click
+        self.actions_cache.pop(app_id, None)
+        monitor.cancel()
+        self._actions_monitors.pop(app_id, None)
+
+    def output_for_monitor(self, monitor):
+        """The daemon's id for a Gdk.Monitor, matched by position, then by model; None if unknown."""
+        geometry = monitor.get_geometry()
+        for output in self.outputs.values():
+            if (output.x, output.y) == (geometry.x, geometry.y):
+                return output.id
+        model = monitor.get_model()
+        return next((output.id for output in self.outputs.values() if model and output.model == model), None)
+
+    def get_priority_app_ids(self):
+        """App ids whose desktop entries are needed first: pinned apps, then open windows."""
+        priority_ids = list(self.pinned_app_ids)
+        for w in self.windows:
+            app_id = w.app_id
+            if app_id and app_id not in priority_ids:
+                priority_ids.append(app_id)
+        return priority_ids
+
+    def begin_resync(self):
+        """Called when a (re)started daemon connects; its window ids are not ours."""
+        self._resyncing = True
+        self._snapshot = None
+
+    def _request_query(self, generation):
+        if self.db and generation == self.db_generation:
+            # Our DB is current: the daemon only needs its own copy for app_id matching.
+            send_command("QUERY QUIET")
+            return
+        self._query_seen_app_ids = set()
+        self._db_incomplete = False
+        send_command(" ".join(["QUERY"] + self.get_priority_app_ids()))
+
+    def _load_db_snapshot(self, path, entries):
+        """Replaces the DB with the entries the reader thread loaded from the daemon's snapshot file."""
+        if isinstance(entries, Exception):
+            # Keep what we have and query again on the next resync
+            print(f"Warning: cannot load the desktop DB snapshot {path}: {entries}", file=sys.stderr)
+            self._query_seen_app_ids = None
+            self._db_incomplete = True
+            return
+        # The snapshot holds every entry, the priority ones included, so it replaces the DB whole
+        self.db = {entry.app_id: entry for entry in entries}
+        self.app_index.replace(entries)
+        self._query_seen_app_ids = None
+        if self._idle_update_source_id:
+            GLib.source_remove(self._idle_update_source_id)
+            self._idle_update_source_id = None
+        self.emit('data-changed')
+
     def _emit_data_changed_idle(self):
         self.emit('data-changed')
         # Reset the source ID so a new update can be scheduled in the future.
@@ -108,44 +240,163 @@ class AppService(GObject.GObject):
         # Return False to tell GLib not to run this function again automatically.
         return False
 
-    def update_from_daemon_line(self, line):
-        line = line.strip()
-        parts = line.split(" ", 1)
-        command = parts[0]
-        if command == "DAEMON_READY": return
+    def _queue_title_changed(self, window_id):
+        """Publishes a title change at once, then at most once per TITLE_THROTTLE_MS."""
+        self.title_stats["updates"] += 1
+        if window_id in self._title_timers:
+            self._title_dirty.add(window_id)
+            return
+        # With no title consumer (no window list open) there is nothing to throttle.
+        if not self.has_title_consumers(): return
+        self.title_stats["emitted"] += 1
+        self.emit('title-changed', window_id)
+        self._title_timers[window_id] = GLib.timeout_add(TITLE_THROTTLE_MS, self._on_title_throttle_done, window_id)
+
+    def _on_title_throttle_done(self, window_id):
+        if window_id in self._title_dirty and self.has_title_consumers():
+            self._title_dirty.discard(window_id)
+            self.title_stats["emitted"] += 1
+            self.emit('title-changed', window_id)
+            return True
+        self._title_dirty.discard(window_id)
+        del self._title_timers[window_id]
+        return False
 
-        data = parts[1] if len(parts) > 1 else ""
-        params = parse_parameters(data)
+    def _cancel_title_timer(self, window_id):
+        source_id = self._title_timers.pop(window_id, None)
+        if source_id: GLib.source_remove(source_id)
+        self._title_dirty.discard(window_id)
+
+    def has_title_consumers(self):
+        signal_id = GObject.signal_lookup('title-changed', AppService)
+        return GObject.signal_has_handler_pending(self, signal_id, 0, False)
+
+    def format_title_stats(self):
+        return f"{self.title_stats['updates']} title updates, {self.title_stats['emitted']} published"
+
+    def apply_daemon_events(self, events):
+        """Applies a batch of decoded daemon events, emitting 'data-changed' at most once for window changes."""
+        windows_changed = False
+        for event in events:
+            windows_changed |= self._apply_daemon_event(event)
+        if windows_changed:
+            self.emit('data-changed')
+
+    def _apply_daemon_event(self, event):
+        """Applies a single daemon event. Returns True if the window list changed."""
+        command = event.command
+        if command == "DAEMON_READY":
+            # Ask for every current window in one frame instead of replaying events.
+            send_command("SNAPSHOT")
+            # A restarted daemon lost any ACTIONS request still waiting for an answer.
+            for app_id in self._actions_waiters:
+                self._actions_partial.pop(app_id, None)
+                send_command(f"ACTIONS {app_id}")
+            return False
+        if command == "PRIORITY_DONE":
+            # Pinned and running apps are loaded; show their icons without waiting for idle.
+            if self._idle_update_source_id:
+                GLib.source_remove(self._idle_update_source_id)
+                self._idle_update_source_id = None
+            self.emit('data-changed')
+            return False
+
+        params = event.params
         appid = params.get("appid")
 
+        if command == "DB_SNAPSHOT":
+            self._load_db_snapshot(params.get("path"), event.record)
+            return False
+        if command == "QUERY_DONE":
+            self.db_generation = None if self._db_incomplete else params.get("gen")
+            if self._query_seen_app_ids is not None:
+                # Drop entries whose .desktop files disappeared while we were away.
+                for stale_app_id in set(self.db) - self._query_seen_app_ids:
+                    del self.db[stale_app_id]
+                    self.app_index.remove(stale_app_id)
+                self._query_seen_app_ids = None
+            return False
+
+        if command == "SNAPSHOT_BEGIN":
+            self._snapshot = {"generation": params.get("gen"), "windows": [], "outputs": {}}
+            return False
+        if command in ("OUTPUT_ADDED", "OUTPUT_CHANGED", "OUTPUT_REMOVED"):
+            output = event.record
+            if output is None: return False
+            if self._snapshot is not None:
+                self._snapshot["outputs"][output.id] = output
+            elif not self._resyncing:
+                # Ids are the daemon's own; a restarted daemon's snapshot replaces them all
+                if command == "OUTPUT_REMOVED": self.outputs.pop(output.id, None)
+                else: self.outputs[output.id] = output
+                self.emit('outputs-changed')
+            return False
+        if command == "WINDOW":
+            if self._snapshot is not None and event.record is not None:
+                self._snapshot["windows"].append(event.record)
+            return False
+        if command == "SNAPSHOT_END":
+            if self._snapshot is None: return False
+            # Window ids were reassigned by the new daemon, so replace everything in one pass.
+            self.windows = self._snapshot["windows"]
+            self.outputs = self._snapshot["outputs"]
+            self.emit('outputs-changed')
+            for window in self.windows:
+                self._resolve_pending_launch(window.app_id)
+            for window_id in list(self._title_timers):
+                self._cancel_title_timer(window_id)
+            self.real_active_window_id = None
+            generation = self._snapshot["generation"]
+            self._snapshot = None
+            self._resyncing = False
+            # The open windows are known now, so their entries can be requested first.
+            self._request_query(generation)
+            return True
+
+        if command == "ACTION":
+            if appid: self._actions_partial.setdefault(appid, []).append(params)
+            return False
+        if command == "ACTIONS_DONE":
+            if appid: self._finish_actions(appid, params.get("path"))
+            return False
+
         if command == "DB":
-            if not appid: return
-            params["actions"] = parse_actions(params)
-            self.db[appid] = params
+            entry = event.record
+            if entry is None: return False
+            self.db[entry.app_id] = entry
+            self.app_index.put(entry)
+            if self._query_seen_app_ids is not None:
+                self._query_seen_app_ids.add(entry.app_id)
             # Instead of emitting directly, schedule an idle update.
             # If one is already scheduled, this does nothing.
             if not self._idle_update_source_id:
                 self._idle_update_source_id = GLib.idle_add(self._emit_data_changed_idle)
-            return
+            return False
 
-        id_str = params.get("id")
-        if id_str is None: return
-        try:
-            id = int(id_str)
-        except ValueError:
-            return
+        if self._resyncing: return False
+        id = event.id
+        if id is None: return False
 
         if command == "NEW":
-            self.windows.append({"id": id})
+            self.windows.append(WindowRecord(id))
         elif command == "CLOSED":
-            self.windows[:] = [w for w in self.windows if w.get("id") != id]
+            self.windows[:] = [w for w in self.windows if w.id != id]
+            self._cancel_title_timer(id)
         elif command == "UPDATE":
-            for w in self.windows:
-                if w.get("id") == id:
-                    w.update(appid=appid, icon=params.get("icon"), state=params.get("state"), title=params.get("title"), bin=self.db.get(appid, {}).get("bin"))
-                    break
-
-        self.emit('data-changed')
+            window = next((w for w in self.windows if w.id == id), None)
+            if window is None: return False
+            mask = event.mask
+            window.apply_update(mask, appid, params.get("state"), params.get("title"), params.get("outputs"))
+            if mask & FIELD_APP_ID and window.app_id in self.pending_launches:
+                # Same batch as the window's data-changed, so the takeover costs no extra redraw
+                self._resolve_pending_launch(window.app_id)
+            if mask & FIELD_TITLE:
+                self._queue_title_changed(id)
+            # The bar only draws app ids and states; a title alone does not redraw it.
+            return bool(mask & ~FIELD_TITLE)
+        else:
+            return False
+        return True
 
 
 # ===================================================================
@@ -160,12 +411,16 @@ class LeftClickMenuPopup(Box):
         self.popup_manager = popup_manager
         self.real_active_window_id = real_active_window_id
         self.window_was_clicked_in_popup = False
+        self._title_buttons = {}
 
+        self.lifetime = Lifetime(self)
         self.connect("destroy", self.on_popup_destroy)
+        self.lifetime.connect(self.app_service, 'title-changed', self.on_title_changed)
 
         for window in app_windows:
-            title = window.get("title") or f"Untitled Window ({window['id']})"
+            title = window.title or f"Untitled Window ({window.id})"
             win_button = Button(label=title, h_expand=True)
+            self._title_buttons[window.id] = win_button
             close_button = Button(label="X")
             close_button.get_style_context().add_class("destructive-action")
             row_box = Box(h_expand=True, spacing=4)
@@ -173,13 +428,19 @@ class LeftClickMenuPopup(Box):
             row_box.pack_start(close_button, False, False, 0)
             box = EventBox()
             box.add(row_box)
-            win_button.connect("clicked", self.on_click, window['id'])
-            close_button.connect("clicked", self.on_close, window['id'], box)
-            box.connect("enter-notify-event", self.on_hover, window['id'])
+            win_button.connect("clicked", self.on_click, window.id)
+            close_button.connect("clicked", self.on_close, window.id, box)
+            box.connect("enter-notify-event", self.on_hover, window.id)
             box.connect("leave-notify-event", self.on_hover_lost)
             self.pack_start(box, False, False, 0)
         self.show_all()
 
+    def on_title_changed(self, app_service, window_id):
+        button = self._title_buttons.get(window_id)
+        if button is None: return
+        window = next((w for w in app_service.windows if w.id == window_id), None)
+        if window: button.set_label(window.title or f"Untitled Window ({window.id})")
+
     def on_hover(self, widget, event, window_id):
         if event.detail != Gdk.NotifyType.INFERIOR:
             send_command(f"ACTIVATE {window_id}")
@@ -196,24 +457,25 @@ class LeftClickMenuPopup(Box):
 
     def on_close(self, button, window_id, box):
         send_command(f"CLOSE {window_id}")
+        self._title_buttons.pop(window_id, None)
         toplevel = self.get_toplevel()
         if not isinstance(toplevel, Gtk.Window): return
         old_width, old_height = toplevel.get_size()
         old_x, old_y = toplevel.get_position()
         self.remove(box)
         self.show_all()
-        toplevel.resize(1, 1)
 
-        def do_adjust_position():
+        # Keep the popup's bottom center in place once the shrunk size is allocated
+        def on_size_allocate(window, allocation):
             new_width, new_height = toplevel.get_size()
-            if (new_width, new_height) == (old_width, old_height): return True
-            dx = old_width - new_width
-            dy = old_height - new_height
-            toplevel.move(old_x + dx // 2, old_y + dy)
-            return False
-        GLib.timeout_add(30, lambda: not do_adjust_position())
+            if (new_width, new_height) == (old_width, old_height): return
+            self.lifetime.disconnect(toplevel, handler_id)
+            toplevel.move(old_x + (old_width - new_width) // 2, old_y + old_height - new_height)
+        handler_id = self.lifetime.connect(toplevel, "size-allocate", on_size_allocate)
+        toplevel.resize(1, 1)
 
     def on_popup_destroy(self, widget):
+        self._title_buttons.clear()
         if not self.window_was_clicked_in_popup and self.real_active_window_id:
             send_command(f"ACTIVATE {self.real_active_window_id}")
         self.app_service.real_active_window_id = None
@@ -227,8 +489,15 @@ class RightClickMenuPopup(Box):
         self.app_id = app_id
         self.app_info = app_info
         self.app_windows = app_windows
+        self._destroyed = False
+        self.connect("destroy", self._on_destroy)
+
+        # Jump list: filled in at once when cached, otherwise when the daemon answers
+        self.actions_box = Box(orientation='v', spacing=4)
+        self.add(self.actions_box)
+        self.app_service.request_actions(app_id, self._on_actions)
 
-        if "bin" in self.app_info:
+        if self.app_info.argv:
             new_window_button = Button(label="New Window", on_clicked=self.on_new_window)
             self.add(new_window_button)
 
@@ -242,8 +511,26 @@ class RightClickMenuPopup(Box):
 
         self.show_all()
 
+    def _on_destroy(self, widget):
+        self._destroyed = True
+
+    def _on_actions(self, actions):
+        if self._destroyed or not actions: return
+        for action in actions:
+            self.actions_box.add(Button(label=action.name, on_clicked=lambda _, a=action: self.on_action(a)))
+        self.actions_box.add(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL))
+        self.actions_box.show_all()
+        # A cache hit lands here while the popup is still being built; show_popup sizes it then.
+        active = self.popup_manager.active_popup
+        if active and active.get_child() is self:
+            self.popup_manager.refit_active_popup()
+
+    def on_action(self, action):
+        self.app_service.launch_action(self.app_id, action)
+        self.popup_manager.close_active_popup()
+
     def on_new_window(self, button):
-        subprocess.Popen(shlex.split(self.app_info["bin"]))
+        self.app_service.launch(self.app_id, prefer_exec=True)
         self.popup_manager.close_active_popup()
 
     def on_toggle_pin(self, button):
@@ -251,8 +538,7 @@ class RightClickMenuPopup(Box):
         self.popup_manager.close_active_popup()
 
     def on_close_all(self, button):
-        for w in self.app_windows:
-            send_command(f"CLOSE {w['id']}")
+        send_command("CLOSE " + " ".join(str(w.id) for w in self.app_windows))
         self.popup_manager.close_active_popup()
 
 class StartMenuPopup(Box):
@@ -264,8 +550,9 @@ class StartMenuPopup(Box):
         self.set_size_request(500, 550)
         self.set_can_focus(True)
 
-        # --- NEW: Keep track of our background loading task ---
-        self._idle_load_source_id = None
+        # With an empty query, how many rows of app_service.app_index are bound; None while searching
+        self._listing_rendered = None
+        self._section_starts = {}
 
         search_box_container = Box(orientation='v', spacing=4, name="search-box")
         self.fake_entry = FakeEntry(placeholder="Search for apps...", on_text_changed=self.on_search_text_changed)
@@ -274,6 +561,7 @@ class StartMenuPopup(Box):
         self.search_results_box = Box(orientation='v', spacing=4, name="search-results-box")
         self.scrolled_window = ScrolledWindow(h_policy="never", v_policy="automatic")
         self.scrolled_window.add(self.search_results_box)
+        self.scrolled_window.get_vadjustment().connect("value-changed", self._on_results_scrolled)
 
         power_box = Box(orientation='h', spacing=4, name="power-box", h_align="end")
         power_box.add(Button(label="Restart"))
@@ -287,71 +575,51 @@ class StartMenuPopup(Box):
         self.show_all()
         self._update_search_results("")
 
-    # --- NEW: A generator to load apps in chunks ---
-    def _load_remaining_apps_incrementally(self, apps_to_load):
-        chunk_size = 20
-        for i in range(0, len(apps_to_load), chunk_size):
-            chunk = apps_to_load[i:i + chunk_size]
-            for appid, info in chunk:
-                self._add_app_button(info, appid)
-            # Yield control back to the UI thread to keep it responsive
-            yield True
-        
-        # All done
-        self._idle_load_source_id = None
-        yield False
-
-    # --- NEW: A helper to cancel any existing background loading ---
-    def _cancel_idle_load(self):
-        if self._idle_load_source_id:
-            GLib.source_remove(self._idle_load_source_id)
-            self._idle_load_source_id = None
+    def _render_listing_page(self):
+        """Binds the next rows of the empty-query listing with their headers; False if all are bound."""
+        index = self.app_service.app_index
+        start = self._listing_rendered
+        if start is None or start >= len(index): return False
+        stop = min(len(index), start + LISTING_PAGE_SIZE)
+        for position, appid in enumerate(index.app_ids(start, stop), start):
+            letter = self._section_starts.get(position)
+            if letter is not None:
+                if position > 0:
+                    separator = Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL, name="letter-separator")
+                    self.search_results_box.pack_start(separator, False, False, 0)
+                header_label = Label(label=letter, h_align="start", name="letter-header", h_expand=True)
+                self.search_results_box.pack_start(header_label, False, False, 5)
+            info = self.app_service.db.get(appid)
+            if info: self._add_app_button(info, appid)
+        self._listing_rendered = stop
+        self.search_results_box.show_all()
+        return True
+
+    def _on_results_scrolled(self, adjustment):
+        # Bind the next page once the view is within a page of the end
+        if adjustment.get_value() + 2 * adjustment.get_page_size() >= adjustment.get_upper():
+            self._render_listing_page()
 
     def _update_search_results(self, search_text):
-        # --- NEW: Cancel any pending background loads before redrawing ---
-        self._cancel_idle_load()
-        
         for child in self.search_results_box.get_children():
-            self.search_results_box.remove(child)
+            child.destroy()
 
         search_text_lower = search_text.strip().lower()
 
         if not search_text_lower:
-            # --- MODIFIED: Load a small batch now, schedule the rest ---
-            sorted_apps = sorted(self.app_service.db.items(), key=lambda item: item[1].get("name", item[0]).lower())
-            
-            initial_load_size = 40
-            initial_apps = sorted_apps[:initial_load_size]
-            remaining_apps = sorted_apps[initial_load_size:]
-            
-            current_letter = None
-            for appid, info in initial_apps:
-                # This logic remains the same, but only runs for the initial batch
-                app_name = info.get("name", appid)
-                if not app_name: continue
-                first_letter = app_name[0].upper()
-                if first_letter != current_letter:
-                    if current_letter is not None:
-                        separator = Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL, name="letter-separator")
-                        self.search_results_box.pack_start(separator, False, False, 0)
-                    current_letter = first_letter
-                    header_label = Label(label=current_letter, h_align="start", name="letter-header", h_expand=True)
-                    self.search_results_box.pack_start(header_label, False, False, 5)
-                self._add_app_button(info, appid)
-            
+            # The index is sorted and sectioned already; only the first page is bound now
+            self._section_starts = {start: letter for letter, start in self.app_service.app_index.sections()}
+            self._listing_rendered = 0
+            self._render_listing_page()
             self.selected_widget = None
 
-            # Schedule the rest of the apps to be loaded when idle
-            if remaining_apps:
-                generator = self._load_remaining_apps_incrementally(remaining_apps)
-                self._idle_load_source_id = GLib.idle_add(lambda: next(generator, False))
-
         else:
             # Search logic remains the same, as it's filtered and should be fast
+            self._listing_rendered = None
             scored_matches = []
             for appid, info in self.app_service.db.items():
-                name_lower = info.get("name", appid).lower()
-                generic_name_lower = info.get("generic_name", "").lower()
+                name_lower = (info.name or appid).lower()
+                generic_name_lower = info.generic_name.lower()
                 best_score = float('inf')
                 if search_text_lower in name_lower:
                     if name_lower == search_text_lower: best_score = min(best_score, 0)
@@ -390,6 +658,8 @@ class StartMenuPopup(Box):
                 current_idx = buttons.index(self.selected_widget)
             except ValueError:
                 current_idx = -1
+            if key_name in ("Down", "Tab") and current_idx == len(buttons) - 1 and self._render_listing_page():
+                buttons = [child for child in self.search_results_box.get_children() if isinstance(child, Gtk.Button)]
 
             num_buttons = len(buttons)
             if key_name == "Down" or key_name == "Tab":
@@ -417,11 +687,11 @@ class StartMenuPopup(Box):
                 context.remove_class("selected")
 
     def _add_app_button(self, info, appid):
-        icon = Image(icon_name=info.get("icon", "dialog-question"), icon_size=16, v_align="center")
+        icon = Image(icon_name=info.icon or "dialog-question", icon_size=16, v_align="center")
         text_vbox = Box(orientation='v')
-        name_label = Label(label=info.get("name", appid), h_align="start")
+        name_label = Label(label=info.name or appid, h_align="start")
         text_vbox.pack_start(name_label, False, False, 0)
-        generic_name = info.get("generic_name")
+        generic_name = info.generic_name
         if generic_name:
             generic_name_label = Label(label=generic_name, h_align="start")
             generic_name_label.get_style_context().add_class("dim-label")
@@ -429,10 +699,9 @@ class StartMenuPopup(Box):
         button_content = Box(orientation='h', spacing=10)
         button_content.pack_start(icon, False, False, 0)
         button_content.pack_start(text_vbox, True, True, 0)
-        launch_command = shlex.split(info["bin"]) if "bin" in info else None
         button = Button(child=button_content, name="search-result-button")
-        if launch_command:
-            button.connect("clicked", lambda _, cmd=launch_command: (subprocess.Popen(cmd), self.popup_manager.close_active_popup()))
+        if info.launchable:
+            button.connect("clicked", lambda _, app_id=appid: (self.app_service.launch(app_id), self.popup_manager.close_active_popup()))
         self.search_results_box.pack_start(button, False, False, 0)
         return button
 
@@ -440,9 +709,16 @@ class StartMenuPopup(Box):
 # === WIDGETS =======================================================
 # ===================================================================
 
-class ClockWidget(DateTime):
+class ClockWidget(Button):
+    """Shows %H:%M, redrawn once a minute on the minute boundary."""
     def __init__(self):
-        super().__init__(name="date-time-label", formatters=["%H:%M"])
+        super().__init__(name="date-time-label")
+        self.lifetime = Lifetime(self)
+        self.lifetime.add_timer(scheduler.every_minute(self._update))
+        self._update()
+
+    def _update(self):
+        self.set_label(time.strftime("%H:%M"))
 
 class StartWidget(Box):
     def __init__(self, app_service, popup_manager):
@@ -466,49 +742,57 @@ class StartWidget(Box):
         return StartMenuPopup(self.app_service, self.popup_manager)
 
 class TaskListWidget(Box):
-    def __init__(self, app_service, popup_manager):
+    """The pinned and running apps; only windows on this bar's monitor count as running here."""
+    def __init__(self, app_service, popup_manager, monitor=None):
         super().__init__(name="center-container", v_align="center", h_align="center", spacing=4, orientation="h")
         self.app_service = app_service
         self.popup_manager = popup_manager
-        self.app_service.connect('data-changed', self._redraw_widget)
+        self.monitor = monitor
+        # The service outlives bars of unplugged monitors
+        self.lifetime = Lifetime(self)
+        self.lifetime.connect(self.app_service, 'data-changed', self._redraw_widget)
+        self.lifetime.connect(self.app_service, 'outputs-changed', self._redraw_widget)
         self._redraw_widget()
 
+    def _windows_here(self):
+        output_id = self.app_service.output_for_monitor(self.monitor) if self.monitor else None
+        return [w for w in self.app_service.windows if w.is_on_output(output_id)]
+
     def _on_task_button_clicked(self, button, app_id):
-        app_windows = [w for w in self.app_service.windows if w.get("appid") == app_id]
+        app_windows = [w for w in self._windows_here() if w.app_id == app_id]
 
         if not app_windows:
-            if app_id in self.app_service.db and "bin" in self.app_service.db[app_id]:
-                subprocess.Popen(shlex.split(self.app_service.db[app_id]["bin"]))
+            self.app_service.launch(app_id)
             return
 
         window_to_toggle = app_windows[0]
-        is_active = window_to_toggle.get("state", "").startswith("Active")
-
-        if is_active:
-            send_command(f"MINIMIZE {window_to_toggle['id']}")
+        if window_to_toggle.is_active:
+            send_command(f"MINIMIZE {window_to_toggle.id}")
         else:
-            send_command(f"ACTIVATE {window_to_toggle['id']}")
+            send_command(f"ACTIVATE {window_to_toggle.id}")
 
     def _create_left_click_menu_popup(self, bar, app_windows):
-        active_window = next((w for w in self.app_service.windows if w.get("state", "").startswith("Active")), None)
-        self.app_service.real_active_window_id = active_window['id'] if active_window else None
+        active_window = next((w for w in self.app_service.windows if w.is_active), None)
+        self.app_service.real_active_window_id = active_window.id if active_window else None
         return LeftClickMenuPopup(bar, self.app_service, self.popup_manager, app_windows, self.app_service.real_active_window_id)
 
     def _create_right_click_menu_popup(self, app_id, app_info, app_windows):
         return RightClickMenuPopup(self.app_service, self.popup_manager, app_id, app_info, app_windows)
 
     def _redraw_widget(self, *args):
+        # Destroying, not just removing, drops each button's handlers and popup closures
         for child in self.get_children():
-            self.remove(child)
+            child.destroy()
 
         grouped_windows = {}
-        for window in self.app_service.windows:
-            app_id = window.get("appid")
+        for window in self._windows_here():
+            app_id = window.app_id
             if not app_id: continue
             if app_id not in grouped_windows: grouped_windows[app_id] = []
             grouped_windows[app_id].append(window)
 
-        open_unpinned_apps = sorted([app_id for app_id in grouped_windows.keys() if app_id not in self.app_service.pinned_app_ids])
+        pending_launches = self.app_service.pending_launches
+        open_unpinned_apps = sorted({app_id for app_id in list(grouped_windows) + list(pending_launches) if app_id not in self.app_service.pinned_app_ids})
         all_app_ids = self.app_service.pinned_app_ids + open_unpinned_apps
 
         DEFAULT_ICON_NAME = "dialog-question"
@@ -517,7 +801,7 @@ class TaskListWidget(Box):
             # Use a default app_info if missing instead of skipping
             if app_id not in self.app_service.db:
                 print(f"Missing app {app_id}, using default info")
-                app_info = {"icon": DEFAULT_ICON_NAME, "name": f"App {app_id}"}
+                app_info = DesktopEntry(app_id, name=f"App {app_id}", icon=DEFAULT_ICON_NAME)
             else:
                 app_info = self.app_service.db[app_id]
 
@@ -525,8 +809,8 @@ class TaskListWidget(Box):
             is_open = len(app_windows) > 0
             has_multiple_windows = len(app_windows) > 1
 
-            # Always use app_info["icon"], falling back to default if empty
-            icon_name = app_info.get("icon") or DEFAULT_ICON_NAME
+            # Always use app_info.icon, falling back to default if empty
+            icon_name = app_info.icon or DEFAULT_ICON_NAME
             icon = Image(icon_name=icon_name, icon_size=24)
 
             inner = Box(name="task-button-inner", children=[icon])
@@ -537,11 +821,13 @@ class TaskListWidget(Box):
                 style_context.add_class("open")
             if has_multiple_windows:
                 style_context.add_class("multiple")
+            if app_id in pending_launches:
+                style_context.add_class("starting")
 
             if self.app_service.real_active_window_id:
-                if any(w.get("id", -1) == self.app_service.real_active_window_id for w in app_windows):
+                if any(w.id == self.app_service.real_active_window_id for w in app_windows):
                     style_context.add_class("active")
-            elif any(w.get("state", "").startswith("Active") for w in app_windows):
+            elif any(w.is_active for w in app_windows):
                 style_context.add_class("active")
 
             bar = self.get_ancestor(Bar)
@@ -571,17 +857,18 @@ class TaskListWidget(Box):
 # ===================================================================
 
 class Bar(Window):
-    def __init__(self, app_service, network_service):
-        super().__init__(name="bar", layer="top", anchor="left bottom right", margin="0px", v_align="end", exclusivity="auto")
+    def __init__(self, app_service, network_service, popup_manager, monitor=None):
+        super().__init__(name="bar", layer="top", anchor="left bottom right", margin="0px", v_align="end", exclusivity="auto",
+                         monitor=monitor)
         self.app_service = app_service
         self.network_service = network_service
-        self.popup_manager = PopupManager(self)
+        self.popup_manager = popup_manager
         self.connect("destroy", self._on_destroy)
         self.set_keyboard_mode("on_demand")
         self.connect("key-press-event", self.popup_manager._on_global_key_press)
 
-        start_widget = StartWidget(app_service, self.popup_manager)
-        tasklist_widget = TaskListWidget(app_service, self.popup_manager)
+        self.start_widget = start_widget = StartWidget(app_service, self.popup_manager)
+        self.tasklist_widget = tasklist_widget = TaskListWidget(app_service, self.popup_manager, monitor)
         network_widget = NetworkWidget(network_service, self.popup_manager)
         clock_widget = ClockWidget()
         minimize_widget = Button(name="minimize-button", label="", on_clicked=lambda _: send_command("MINIMIZEALL"))
@@ -594,7 +881,51 @@ class Bar(Window):
         self.show_all()
 
     def _on_destroy(self, widget):
-        self.popup_manager.cleanup()
+        self.popup_manager.close_popups_of(self)
+
+class BarSet:
+    """One Bar per monitor, all sharing the services; bars follow monitor hotplug."""
+    def __init__(self, app_service, network_service, popup_manager):
+        self.app_service = app_service
+        self.network_service = network_service
+        self.popup_manager = popup_manager
+        self.app = None  # Set once the Application exists; bars added later are registered with it
+        self.bars = {}  # Gdk.Monitor -> Bar
+        display = Gdk.Display.get_default()
+        display.connect("monitor-added", self._on_monitor_added)
+        display.connect("monitor-removed", self._on_monitor_removed)
+        for index in range(display.get_n_monitors()):
+            self._add_bar(display.get_monitor(index))
+
+    def _add_bar(self, monitor):
+        bar = Bar(self.app_service, self.network_service, self.popup_manager, monitor)
+        self.bars[monitor] = bar
+        if self.app: self.app.add_window(bar)
+
+    def _on_monitor_added(self, display, monitor):
+        if monitor not in self.bars: self._add_bar(monitor)
+
+    def _on_monitor_removed(self, display, monitor):
+        bar = self.bars.pop(monitor, None)
+        if bar: bar.destroy()
+
+
+def soak_cycle(bar_set, app_service, popup_manager):
+    """One SOAK cycle: redraw every task list, then open and close each kind of popup on every bar."""
+    app_service.emit('data-changed')
+    app_id = next(iter(app_service.pinned_app_ids or app_service.db), None)
+    for bar in list(bar_set.bars.values()):
+        tasklist = bar.tasklist_widget
+        anchor = next(iter(tasklist.get_children()), bar.start_widget)
+        popups = [bar.start_widget._create_start_menu_popup()]
+        if app_id:
+            app_info = app_service.db.get(app_id) or DesktopEntry(app_id)
+            app_windows = [w for w in app_service.windows if w.app_id == app_id]
+            # The left-click popup is left out: closing it re-activates windows
+            popups.append(tasklist._create_right_click_menu_popup(app_id, app_info, app_windows))
+        for content in popups:
+            popup_manager.show_popup(anchor, content)
+            popup_manager.close_active_popup()
 
 
 # ===================================================================
@@ -602,48 +933,55 @@ class Bar(Window):
 # ===================================================================
 
 if __name__ == "__main__":
-    app_service = AppService()
-    network_service = NetworkService()
-    bar = Bar(app_service, network_service)
-    app = Application("taskbar", bar)
-    app.set_stylesheet_from_file(get_relative_path("style.css"))
+    # The start menu sorts by the user's collation rules
+    try:
+        locale.setlocale(locale.LC_COLLATE, "")
+    except locale.Error as e:
+        print(f"Warning: {e}; sorting apps by code point", file=sys.stderr)
 
+    # Started first so the handlers connected below are attributed on a stall
+    watchdog = Watchdog.from_environment()
+    if watchdog: watchdog.start()
+
+    event_bus = EventBus()
     try:
-        toplevel_monitor_process = subprocess.Popen(["./bin/toplevel_monitor"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+        event_bus.start()
+    except OSError as e:
+        print(f"Error: cannot listen on {event_bus.path}: {e}", file=sys.stderr)
+        sys.exit(1)
 
-        def on_monitor_error(channel, cond):
-            if cond & (GLib.IO_HUP | GLib.IO_ERR): return False
-            status, line, _, _ = channel.read_line()
-            if status == GLib.IOStatus.NORMAL and line: print(f"[MONITOR-ERROR] {line.strip()}", file=sys.stderr)
-            return True
-        
-        def on_monitor_output(channel, condition):
-            if condition & (GLib.IO_HUP | GLib.IO_ERR): return False
-            while True:
-                status, line, _, _ = channel.read_line()
-                if status != GLib.IOStatus.NORMAL: break
-                if not line: continue
-                bar.app_service.update_from_daemon_line(line)
-            return True
+    if watchdog: event_bus.register_request("WATCHDOG", watchdog.report)
+    profiler = Profiler(event_bus)
+    wakeup_counter = scheduler.WakeupCounter(event_bus)
 
-        stdout_channel = GLib.IOChannel(toplevel_monitor_process.stdout.fileno())
-        stdout_channel.set_flags(stdout_channel.get_flags() | GLib.IO_FLAG_NONBLOCK)
-        GLib.io_add_watch(stdout_channel, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, on_monitor_output)
-        stderr_channel = GLib.IOChannel(toplevel_monitor_process.stderr.fileno())
-        stderr_channel.set_flags(stderr_channel.get_flags() | GLib.IO_FLAG_NONBLOCK)
-        GLib.io_add_watch(stderr_channel, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, on_monitor_error)
+    state_store = StateStore()
+    state_store.load()
+    app_service = AppService(state_store)
+    network_service = NetworkService()
+    popup_manager = PopupManager(event_bus)
+    bar_set = BarSet(app_service, network_service, popup_manager)
+    app = Application("taskbar", *bar_set.bars.values())
+    bar_set.app = app
+    # Keep running while no monitor is connected; bars come back with the monitors
+    app.hold()
+    soak_test = SoakTest(event_bus, lambda: soak_cycle(bar_set, app_service, popup_manager))
+    app.set_stylesheet_from_file(get_relative_path("style.css"))
+
+    toplevel_monitor = ToplevelMonitor(app_service, event_bus)
+    try:
+        toplevel_monitor.start()
     except FileNotFoundError:
         print("Error: 'toplevel_monitor' executable not found.", file=sys.stderr)
         sys.exit(1)
 
-    send_command("QUERY")
-
+    # SIGUSR1 prints the collected metrics without stopping the bar
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, metrics.print_dump)
     signal.signal(signal.SIGINT, lambda s, f: app.quit())
     app.run()
 
-    if toplevel_monitor_process:
-        toplevel_monitor_process.terminate()
-        try:
-            toplevel_monitor_process.wait(timeout=2)
-        except subprocess.TimeoutExpired:
-            toplevel_monitor_process.kill()
\ No newline at end of file
+    popup_manager.cleanup()
+    toplevel_monitor.stop()
+    state_store.flush()
+    metrics.print_dump()
+    if watchdog: watchdog.stop()
+    event_bus.stop()
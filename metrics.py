@@ -0,0 +1,65 @@
+import sys
+
+# ===================================================================
+# === METRICS REGISTRY ==============================================
+# ===================================================================
+
+# Each provider is a zero-argument callable returning a one-line summary.
+_providers = {}
+
+def register(name, provider):
+    _providers[name] = provider
+
+def unregister(name):
+    _providers.pop(name, None)
+
+def dump():
+    """Collects every registered provider into one printable report."""
+    lines = []
+    for name, provider in list(_providers.items()):
+        try:
+            lines.append(f"[{name}] {provider()}")
+        except Exception as e:
+            lines.append(f"[{name}] error: {e}")
+    return "\n".join(lines)
+
+def print_dump(*args):
+    print(dump(), file=sys.stderr)
+    return True
+
+def per_thousand(count, events):
+    return 1000.0 * count / events if events else 0.0
+
+# ===================================================================
+# === HISTOGRAMS ====================================================
+# ===================================================================
+
+class Histogram:
+    """Counts of values per bucket; bounds are the inclusive upper edges, the last bucket is open."""
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.maximum = 0
+
+    @classmethod
+    def from_counts(cls, bounds, counts, maximum):
+        """A histogram filled in elsewhere, e.g. by the toplevel daemon; counts has one more entry than bounds."""
+        histogram = cls(bounds)
+        histogram.counts = list(counts)
+        histogram.total = sum(histogram.counts)
+        histogram.maximum = maximum
+        return histogram
+
+    def add(self, value):
+        index = next((i for i, bound in enumerate(self.bounds) if value <= bound), len(self.bounds))
+        self.counts[index] += 1
+        self.total += 1
+        self.maximum = max(self.maximum, value)
+
+    def format(self, unit=""):
+        if not self.total:
+            return "none"
+        labels = [f"<={bound}{unit}" for bound in self.bounds] + [f">{self.bounds[-1]}{unit}"]
+        buckets = " ".join(f"{label}:{count}" for label, count in zip(labels, self.counts) if count)
+        return f"{self.total} total, max {self.maximum:.0f}{unit} ({buckets})"
@@ -0,0 +1,346 @@
+import bisect
+import json
+import locale
+import os
+import shlex
+import sys
+import unicodedata
+
+# ===================================================================
+# === EXEC LINES ====================================================
+# ===================================================================
+
+# Escapes of the desktop entry "string" type, undone before the Exec line is split
+_STRING_ESCAPES = {"s": " ", "n": "\n", "t": "\t", "r": "\r", "\\": "\\"}
+# Field codes that stand for files/URLs or are deprecated; we never pass any
+_DROPPED_FIELD_CODES = frozenset(("%f", "%F", "%u", "%U", "%d", "%D", "%n", "%N", "%v", "%m", "%k"))
+
+def _unescape_string(value):
+    out = []
+    i = 0
+    while i < len(value):
+        if value[i] == "\\" and i + 1 < len(value) and value[i + 1] in _STRING_ESCAPES:
+            out.append(_STRING_ESCAPES[value[i + 1]])
+            i += 2
+            continue
+        out.append(value[i])
+        i += 1
+    return "".join(out)
+
+def _split_exec(value):
+    """Splits on blanks; double-quoted arguments may contain backslash-escaped characters."""
+    args, current = [], []
+    in_quotes = escaped = quoted = False
+    for c in value:
+        if escaped:
+            current.append(c)
+            escaped = False
+        elif in_quotes:
+            if c == "\\": escaped = True
+            elif c == '"': in_quotes = False
+            else: current.append(c)
+        elif c == '"':
+            in_quotes = quoted = True
+        elif c in " \t":
+            if current or quoted:
+                args.append("".join(current))
+            current, quoted = [], False
+        else:
+            current.append(c)
+    if current or quoted:
+        args.append("".join(current))
+    return args
+
+def _expand_field_codes(arg, name, icon):
+    if arg in _DROPPED_FIELD_CODES: return []
+    if arg == "%i": return ["--icon", icon] if icon else []
+    if "%" not in arg: return [arg]
+    out = []
+    i = 0
+    while i < len(arg):
+        if arg[i] == "%" and i + 1 < len(arg):
+            code = arg[i + 1]
+            if code == "%": out.append("%")
+            elif code == "c": out.append(name)
+            i += 2
+            continue
+        out.append(arg[i])
+        i += 1
+    expanded = "".join(out)
+    return [expanded] if expanded else []
+
+def parse_exec(exec_line, name="", icon=""):
+    """Turns a raw Exec value into an argv tuple with field codes expanded for a launch without files."""
+    if not exec_line: return ()
+    if "\\" in exec_line: exec_line = _unescape_string(exec_line)
+    args = _split_exec(exec_line) if '"' in exec_line or "\\" in exec_line else exec_line.split()
+    argv = []
+    for arg in args:
+        argv.extend(_expand_field_codes(arg, name, icon))
+    return tuple(argv)
+
+# ===================================================================
+# === RECORDS =======================================================
+# ===================================================================
+
+# App ids, icon names and window states repeat across thousands of entries and
+# every UPDATE; interning makes each distinct value a single shared string.
+def intern(value):
+    return sys.intern(value) if value else ""
+
+class DesktopEntry:
+    """One application from the desktop DB. bin is the raw Exec line, argv its parsed form."""
+    __slots__ = ("app_id", "name", "generic_name", "icon", "bin", "argv", "dbus_activatable")
+
+    def __init__(self, app_id, name="", generic_name="", icon="", bin="", dbus_activatable=False):
+        self.app_id = intern(app_id)
+        self.name = name or ""
+        self.generic_name = generic_name or ""
+        self.icon = intern(icon)
+        self.bin = bin or ""
+        # Parsed once when the DB loads so a click only has to spawn
+        self.argv = parse_exec(self.bin, self.name, self.icon)
+        self.dbus_activatable = dbus_activatable
+
+    @property
+    def launchable(self):
+        return bool(self.argv) or self.dbus_activatable
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(params.get("appid"), params.get("name"), params.get("generic_name"),
+                   params.get("icon"), params.get("bin"), params.get("dbus") == "1")
+
+    # Column order of the rows in the daemon's DB_SNAPSHOT file
+    SNAPSHOT_FIELDS = ["appid", "name", "generic_name", "icon", "bin", "dbus"]
+
+    @classmethod
+    def from_row(cls, row):
+        app_id, name, generic_name, icon, bin, dbus = row
+        return cls(app_id, name, generic_name, icon, bin, bool(dbus))
+
+class DesktopAction:
+    """A [Desktop Action] of an entry, fetched on demand with the daemon's ACTIONS command."""
+    __slots__ = ("id", "name", "argv")
+
+    def __init__(self, id, name, exec_line, entry):
+        self.id = id
+        self.name = name or id
+        # Field codes in an action refer to the owning entry's name and icon
+        self.argv = parse_exec(exec_line, entry.name, entry.icon)
+
+# Field bits of an UPDATE's MASK; must match FIELD_* in toplevel_monitor.c
+FIELD_APP_ID = 1
+FIELD_STATE = 2
+FIELD_TITLE = 4
+FIELD_OUTPUTS = 8
+FIELD_ALL = FIELD_APP_ID | FIELD_STATE | FIELD_TITLE | FIELD_OUTPUTS
+
+def parse_output_ids(text):
+    """The daemon's comma-separated OUTPUTS field, e.g. "0,2"."""
+    return frozenset(int(part) for part in (text or "").split(",") if part.isdigit())
+
+class Output:
+    """A wl_output as reported by the daemon's OUTPUT_ADDED/OUTPUT_CHANGED lines."""
+    __slots__ = ("id", "name", "make", "model", "x", "y")
+
+    def __init__(self, id, name="", make="", model="", x=0, y=0):
+        self.id = id
+        self.name = name or ""
+        self.make = make or ""
+        self.model = model or ""
+        self.x = x
+        self.y = y
+
+    @classmethod
+    def from_params(cls, id, params):
+        def coordinate(key):
+            try:
+                return int(params.get(key, 0))
+            except ValueError:
+                return 0
+        return cls(id, params.get("name"), params.get("make"), params.get("model"), coordinate("x"), coordinate("y"))
+
+class Window:
+    """One toplevel reported by the daemon. The launch command lives on its DesktopEntry."""
+    __slots__ = ("id", "app_id", "state", "title", "outputs")
+
+    def __init__(self, id, app_id="", state="", title="", outputs=frozenset()):
+        self.id = id
+        self.app_id = intern(app_id)
+        self.state = intern(state)
+        self.title = title or ""
+        # Ids of the outputs the window is on; empty until the compositor says
+        self.outputs = outputs
+
+    def apply_update(self, mask, app_id, state, title, outputs=None):
+        """Applies only the fields named in mask; the others were not sent."""
+        if mask & FIELD_APP_ID: self.app_id = intern(app_id)
+        if mask & FIELD_STATE: self.state = intern(state)
+        if mask & FIELD_TITLE: self.title = title or ""
+        if mask & FIELD_OUTPUTS: self.outputs = parse_output_ids(outputs)
+
+    def is_on_output(self, output_id):
+        # A window on no known output is shown everywhere rather than nowhere
+        return output_id is None or not self.outputs or output_id in self.outputs
+
+    @property
+    def is_active(self):
+        # States are space-separated flags, e.g. "Maximized Active"
+        return "Active" in self.state.split()
+
+# ===================================================================
+# === APP INDEX =====================================================
+# ===================================================================
+
+def collation_key(name):
+    """Sort key in the user's locale (LC_COLLATE), ignoring case."""
+    return locale.strxfrm(name.casefold())
+
+def section_letter(name):
+    """The start menu heading for name: its first letter without accents, or "#"."""
+    base = unicodedata.normalize("NFKD", name[:1])[:1].upper()
+    return base if base.isalpha() else "#"
+
+def index_row(entry):
+    """An AppIndex row: sorted by heading first ("#" leading), so every section stays contiguous."""
+    name = entry.name or entry.app_id
+    letter = section_letter(name)
+    return (letter != "#", collation_key(letter), collation_key(name), entry.app_id, letter)
+
+class AppIndex:
+    """
+    The DB in start menu order: entries grouped by section_letter and sorted by
+    collation_key of their name within it, and where each letter section starts. Entries are inserted and removed in
+    place as DB lines arrive, or rebuilt at once from a DB snapshot; sections
+    are recomputed at most once per change batch, when the menu next asks for them.
+    """
+    def __init__(self):
+        self._rows = []    # sorted index_row tuples
+        self._row_of = {}  # app_id -> its row
+        self._sections = None
+        # Bumped on every change, so views can tell whether they are current
+        self.version = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def put(self, entry):
+        row = index_row(entry)
+        old = self._row_of.get(entry.app_id)
+        if old == row: return
+        if old is not None: del self._rows[bisect.bisect_left(self._rows, old)]
+        bisect.insort(self._rows, row)
+        self._row_of[entry.app_id] = row
+        self._changed()
+
+    def replace(self, entries):
+        """Rebuilds the index from entries with one sort, for a whole new DB."""
+        self._row_of = {}
+        for entry in entries:
+            self._row_of[entry.app_id] = index_row(entry)
+        self._rows = sorted(self._row_of.values())
+        self._changed()
+
+    def remove(self, app_id):
+        old = self._row_of.pop(app_id, None)
+        if old is None: return
+        del self._rows[bisect.bisect_left(self._rows, old)]
+        self._changed()
+
+    def _changed(self):
+        self._sections = None
+        self.version += 1
+
+    def app_ids(self, start, stop):
+        return [row[3] for row in self._rows[start:stop]]
+
+    def sections(self):
+        """[(letter, index of its first entry)] in order."""
+        if self._sections is None:
+            self._sections = []
+            for i, row in enumerate(self._rows):
+                letter = row[4]
+                if not self._sections or self._sections[-1][0] != letter:
+                    self._sections.append((letter, i))
+        return self._sections
+
+# ===================================================================
+# === DAEMON EVENTS =================================================
+# ===================================================================
+
+def parse_parameters(param_string):
+    params = {}
+    parts = shlex.split(param_string)
+    for part in parts:
+        if '=' in part:
+            key, value = part.split('=', 1)
+            params[key.lower()] = value
+    return params
+
+def read_db_snapshot(path):
+    """The DesktopEntry list in a DB_SNAPSHOT file, which is removed once read."""
+    with open(path, "rb") as f:
+        snapshot = json.loads(f.read())
+    # Only ever read once; the next QUERY writes a new one
+    os.unlink(path)
+    if snapshot.get("fields") != DesktopEntry.SNAPSHOT_FIELDS:
+        raise ValueError(f"unexpected fields {snapshot.get('fields')}")
+    return [DesktopEntry.from_row(row) for row in snapshot["apps"]]
+
+class DaemonEvent:
+    """
+    One daemon line, decoded by the bus reader thread so the main loop only
+    applies it. id is the window or output id, mask an UPDATE's field bits,
+    and record what the line describes: a DesktopEntry for DB, an Output for
+    OUTPUT_*, a Window for WINDOW, and for DB_SNAPSHOT the list of entries or
+    the error that kept it from loading.
+    """
+    __slots__ = ("command", "params", "id", "mask", "record")
+
+    def __init__(self, command, params, id=None, mask=FIELD_ALL, record=None):
+        self.command = command
+        self.params = params
+        self.id = id
+        self.mask = mask
+        self.record = record
+
+def decode_daemon_line(line):
+    command, _, data = line.strip().partition(" ")
+    params = parse_parameters(data) if data else {}
+    event = DaemonEvent(command, params)
+    if params.get("id", "").isdigit():
+        event.id = int(params["id"])
+    if command == "UPDATE":
+        # Older daemons send every field and no MASK
+        mask = params.get("mask")
+        event.mask = int(mask) if mask and mask.isdigit() else FIELD_ALL
+    elif command == "DB":
+        if params.get("appid"): event.record = DesktopEntry.from_params(params)
+    elif command in ("OUTPUT_ADDED", "OUTPUT_CHANGED", "OUTPUT_REMOVED"):
+        if event.id is not None: event.record = Output.from_params(event.id, params)
+    elif command == "WINDOW":
+        if event.id is not None:
+            event.record = Window(event.id, params.get("appid"), params.get("state"), params.get("title"),
+                                  parse_output_ids(params.get("outputs")))
+    elif command == "DB_SNAPSHOT":
+        try:
+            event.record = read_db_snapshot(params.get("path"))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            event.record = e
+    return event
+
+# Lines decode_daemon_lines could not parse, e.g. cut off by a truncated message
+decode_errors = 0
+
+def decode_daemon_lines(lines):
+    """Decodes what it can; a malformed line is reported and skipped, not fatal to the batch."""
+    global decode_errors
+    events = []
+    for line in lines:
+        try:
+            events.append(decode_daemon_line(line))
+        except ValueError as e:
+            decode_errors += 1
+            print(f"Skipping undecodable daemon line ({e}): {line[:200]!r}", file=sys.stderr)
+    return events
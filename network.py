@@ -4,6 +4,7 @@ gi.require_version('NM', '1.0')
 from gi.repository import Gtk, Gdk, GLib, GObject, Gio, NM
 import uuid
 import subprocess
+import time
 
 from fabric.widgets.box import Box
 from fabric.widgets.button import Button
@@ -14,15 +15,56 @@ from fabric.widgets.scrolledwindow import ScrolledWindow
 from fabric.widgets.stack import Stack
 
 from widgets import FakeEntry
+from lifetime import Lifetime
+import metrics
+import scheduler
 
 def log(tag, message):
     print(f"[{tag}] {message}")
 
+# Strength (0-100) above each bound moves the icon up a bucket: none, weak, ok, good
+SIGNAL_BUCKET_BOUNDS = (30, 55, 80)
+SIGNAL_BUCKET_NAMES = ('none', 'weak', 'ok', 'good')
+# How far past a bound strength must go before a bucket is left, so a reading
+# hovering around a bound does not flip the icon back and forth
+SIGNAL_HYSTERESIS = 5
+
+def strength_bucket(strength, current=None):
+    """Index into SIGNAL_BUCKET_NAMES for strength, sticking to current unless clearly outside it."""
+    if current is not None:
+        lower = SIGNAL_BUCKET_BOUNDS[current - 1] if current > 0 else -1
+        upper = SIGNAL_BUCKET_BOUNDS[current] if current < len(SIGNAL_BUCKET_BOUNDS) else 100
+        if lower - SIGNAL_HYSTERESIS < strength <= upper + SIGNAL_HYSTERESIS: return current
+    return sum(strength > bound for bound in SIGNAL_BUCKET_BOUNDS)
+
+# A scan younger than this is fresh enough to show without scanning again
+SCAN_FRESH_S = 20
+# While the network popup is open, rescan after this long, doubling up to the maximum
+BACKGROUND_SCAN_FIRST_S = 20
+BACKGROUND_SCAN_MAX_S = 160
+# Give up on a scan whose LastScan never changed, so later requests are not coalesced into it forever
+SCAN_TIMEOUT_S = 30
+
+def boottime_ms():
+    # LastScan is in CLOCK_BOOTTIME milliseconds
+    return int(time.clock_gettime(time.CLOCK_BOOTTIME) * 1000)
+
+def format_age(seconds):
+    if seconds < 10: return "just now"
+    if seconds < 60: return f"{seconds} s ago"
+    if seconds < 3600: return f"{seconds // 60} min ago"
+    return f"{seconds // 3600} h ago"
+
+def strength_icon(bucket):
+    return f'network-wireless-signal-{SIGNAL_BUCKET_NAMES[bucket]}-symbolic'
+
 class NetworkService(GObject.Object):
     __gsignals__ = {
         'state-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
         'ap-list-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
         'connection-failed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        # The active AP's strength moved to another bucket
+        'signal-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
     }
 
     NM_STATE_MAP = { 0: 'UNKNOWN', 10: 'ASLEEP', 20: 'DISCONNECTED', 30: 'DISCONNECTING', 40: 'CONNECTING', 50: 'CONNECTED_LOCAL', 60: 'CONNECTED_SITE', 70: 'CONNECTED_GLOBAL', }
@@ -40,6 +82,22 @@ class NetworkService(GObject.Object):
         self.is_activating = False
         self.is_scanning = False
         self.access_points = []
+        self.wifi_device_wireless_proxy = None
+        # LastScan of the device, and of the scan the cached AP list was built from
+        self.last_scan_ms = None
+        self.ap_list_scan_ms = None
+        # Results of scans that finished while no popup was open are only read when one opens
+        self._ap_list_stale = False
+        self._scan_timeout_id = None
+        self._scan_watchers = 0
+        self._background_scan_id = None
+        self._background_interval_s = BACKGROUND_SCAN_FIRST_S
+        self.scan_stats = {"requests": 0, "started": 0, "fresh": 0, "coalesced": 0, "background": 0, "failed": 0}
+        metrics.register("scans", self.format_scan_stats)
+        # Only the active AP is watched between scans, through its own Properties proxy
+        self.signal_bucket = None
+        self._active_ap_proxy = None
+        self._active_ap_handler = None
 
         try:
             self.properties_proxy = Gio.DBusProxy.new_for_bus_sync(bus_type=Gio.BusType.SYSTEM, flags=Gio.DBusProxyFlags.NONE, info=None, name='org.freedesktop.NetworkManager', object_path='/org/freedesktop/NetworkManager', interface_name='org.freedesktop.DBus.Properties', cancellable=None)
@@ -92,6 +150,7 @@ class NetworkService(GObject.Object):
             if self.active_ap_path != new_active_ap_path:
                 self.active_ap_path = new_active_ap_path
                 self._update_device_type(primary_conn_path)
+                self._watch_active_ap(new_active_ap_path)
                 state_was_updated = True
         if 'ActivatingConnection' in props:
             activating_conn_path = props['ActivatingConnection']
@@ -106,15 +165,51 @@ class NetworkService(GObject.Object):
             log("SVC:EMIT", "State has changed. Emitting 'state-changed'.")
             self.emit('state-changed')
             
+    def _watch_active_ap(self, ap_path):
+        """Moves the Strength subscription to ap_path, dropping the previous AP's."""
+        if self._active_ap_proxy:
+            self._active_ap_proxy.disconnect(self._active_ap_handler)
+            self._active_ap_proxy = self._active_ap_handler = None
+        self.signal_bucket = None
+        # Wired connections have no AP; their SpecificObject is '/'
+        if not ap_path or ap_path == '/': return
+        try:
+            proxy = Gio.DBusProxy.new_for_bus_sync(bus_type=Gio.BusType.SYSTEM, flags=Gio.DBusProxyFlags.DO_NOT_LOAD_PROPERTIES, info=None, name='org.freedesktop.NetworkManager', object_path=ap_path, interface_name='org.freedesktop.DBus.Properties', cancellable=None)
+            strength = proxy.Get('(ss)', 'org.freedesktop.NetworkManager.AccessPoint', 'Strength')
+        except GLib.Error as e:
+            log("SVC:ERROR", f"Could not watch the active AP: {e}")
+            return
+        self._active_ap_proxy = proxy
+        self._active_ap_handler = proxy.connect('g-signal', self._on_active_ap_signal)
+        self.signal_bucket = strength_bucket(strength)
+
+    def _on_active_ap_signal(self, proxy, sender_name, signal_name, parameters):
+        if signal_name != 'PropertiesChanged': return
+        interface_name, changed_properties, invalidated = parameters.unpack()
+        if 'Strength' not in changed_properties: return
+        strength = changed_properties['Strength']
+        # Keep the cached row current without refreshing the whole list
+        for ap in self.access_points:
+            if ap['path'] == self.active_ap_path: ap['strength'] = strength
+        bucket = strength_bucket(strength, self.signal_bucket)
+        if bucket != self.signal_bucket:
+            self.signal_bucket = bucket
+            self.emit('signal-changed')
+
     def _on_wifi_device_signal(self, proxy, sender_name, signal_name, parameters):
         if signal_name != 'PropertiesChanged': return
         try:
             interface_name, changed_properties, invalidated = parameters.unpack()
             if interface_name == 'org.freedesktop.NetworkManager.Device.Wireless':
-                if 'LastScan' in changed_properties and self.is_scanning:
-                    self.is_scanning = False
-                    self._update_ap_list_cache()
-                    self.emit('ap-list-changed')
+                if 'LastScan' in changed_properties:
+                    self.last_scan_ms = changed_properties['LastScan']
+                    self._end_scan()
+                    if self._scan_watchers:
+                        self._update_ap_list_cache()
+                        self.emit('ap-list-changed')
+                    else:
+                        # NetworkManager also scans on its own; nobody is looking now
+                        self._ap_list_stale = True
             elif interface_name == 'org.freedesktop.NetworkManager.Device':
                 if 'State' in changed_properties:
                     new_state_value = changed_properties['State']
@@ -146,6 +241,8 @@ class NetworkService(GObject.Object):
         except GLib.Error as e:
             log("SVC:ERROR", f"Error building AP cache: {e}")
         self.access_points = sorted(new_ap_list, key=lambda ap: ap['strength'], reverse=True)
+        self.ap_list_scan_ms = self.last_scan_ms
+        self._ap_list_stale = False
 
     def get_wifi_access_points(self): return self.access_points
 
@@ -175,6 +272,12 @@ class NetworkService(GObject.Object):
             self.wifi_device_properties_proxy.connect('g-signal', self._on_wifi_device_signal)
         except GLib.Error as e:
             log("SVC:ERROR", f"Could not create wifi device proxies: {e}")
+            return
+        try:
+            self.last_scan_ms = self.wifi_device_properties_proxy.Get('(ss)', 'org.freedesktop.NetworkManager.Device.Wireless', 'LastScan')
+        except GLib.Error:
+            # Before NetworkManager 1.12 there is no LastScan; every scan then counts as stale
+            self.last_scan_ms = None
 
     def get_state(self): return self.nm_state
     def get_active_connection_type(self): return self.active_connection_type
@@ -281,16 +384,91 @@ class NetworkService(GObject.Object):
         except GLib.Error: return None
         return None
 
-    def request_scan(self):
-        if not self.wifi_device_wireless_proxy: return
+    def last_scan_age(self):
+        """Seconds since the device last finished a scan, or None if unknown."""
+        if self.last_scan_ms is None or self.last_scan_ms < 0: return None
+        return max(0, (boottime_ms() - self.last_scan_ms) // 1000)
+
+    def ap_list_age(self):
+        """Seconds since the scan the cached AP list shows, or None if unknown."""
+        if self.ap_list_scan_ms is None or self.ap_list_scan_ms < 0: return None
+        return max(0, (boottime_ms() - self.ap_list_scan_ms) // 1000)
+
+    def request_scan(self, force=False):
+        """
+        Starts a scan unless one is already running, or the last one is younger
+        than SCAN_FRESH_S and force is not set. Returns True if a scan started.
+        """
+        self.scan_stats["requests"] += 1
+        if not self.wifi_device_wireless_proxy: return False
+        if self.is_scanning:
+            self.scan_stats["coalesced"] += 1
+            return False
+        age = self.last_scan_age()
+        if not force and age is not None and age < SCAN_FRESH_S:
+            self.scan_stats["fresh"] += 1
+            if self._ap_list_stale:
+                self._update_ap_list_cache()
+                self.emit('ap-list-changed')
+            return False
         try:
             self.is_scanning = True
             self.emit('state-changed')
             self.wifi_device_wireless_proxy.RequestScan('(a{sv})', {})
         except GLib.Error as e:
+            # NetworkManager refuses scans right after another; the cached list stays
             self.is_scanning = False
+            self.scan_stats["failed"] += 1
             self.emit('state-changed')
             log("SVC:ERROR", f"Failed to request scan: {e}")
+            return False
+        self.scan_stats["started"] += 1
+        self._scan_timeout_id = GLib.timeout_add_seconds(SCAN_TIMEOUT_S, self._on_scan_timeout)
+        return True
+
+    def _end_scan(self):
+        self.is_scanning = False
+        if self._scan_timeout_id:
+            GLib.source_remove(self._scan_timeout_id)
+            self._scan_timeout_id = None
+
+    def _on_scan_timeout(self):
+        self._scan_timeout_id = None
+        self.is_scanning = False
+        self.emit('state-changed')
+        return False
+
+    def watch_scans(self):
+        """
+        Called when a network popup opens: brings the AP list up to date, scans
+        if it is not fresh, and rescans with backoff until unwatch_scans().
+        """
+        self._scan_watchers += 1
+        if self._ap_list_stale: self._update_ap_list_cache()
+        self.request_scan()
+        if self._scan_watchers == 1:
+            self._background_interval_s = BACKGROUND_SCAN_FIRST_S
+            self._background_scan_id = GLib.timeout_add_seconds(self._background_interval_s, self._on_background_scan)
+
+    def unwatch_scans(self):
+        self._scan_watchers -= 1
+        if not self._scan_watchers and self._background_scan_id:
+            GLib.source_remove(self._background_scan_id)
+            self._background_scan_id = None
+
+    def _on_background_scan(self):
+        self.scan_stats["background"] += 1
+        self.request_scan()
+        self._background_interval_s = min(self._background_interval_s * 2, BACKGROUND_SCAN_MAX_S)
+        self._background_scan_id = GLib.timeout_add_seconds(self._background_interval_s, self._on_background_scan)
+        return False
+
+    def format_scan_stats(self):
+        age = self.last_scan_age()
+        return (f"{self.scan_stats['requests']} scan requests: {self.scan_stats['started']} started, "
+                f"{self.scan_stats['fresh']} answered from a fresh scan, {self.scan_stats['coalesced']} coalesced, "
+                f"{self.scan_stats['failed']} refused, {self.scan_stats['background']} background; "
+                f"last scan {'unknown' if age is None else format_age(age)}")
 
     def deactivate_current_connection(self):
         try:
@@ -369,10 +547,7 @@ class AccessPointRow(Box):
         self.network_service.deactivate_current_connection()
 
     def get_strength_icon(self, strength):
-        if strength > 80: return 'network-wireless-signal-good-symbolic'
-        if strength > 55: return 'network-wireless-signal-ok-symbolic'
-        if strength > 30: return 'network-wireless-signal-weak-symbolic'
-        return 'network-wireless-signal-none-symbolic'
+        return strength_icon(strength_bucket(strength))
 
 class NetworkPopup(Box):
     def __init__(self, network_service, popup_manager):
@@ -397,28 +572,35 @@ class NetworkPopup(Box):
         header.pack_end(self.rescan_stack, False, False, 0)
         header.pack_end(edit_button, False, False, 0)
         self.pack_start(header, False, False, 5)
+        self.age_label = Label(h_align="start")
+        self.age_label.get_style_context().add_class("dim-label")
+        self.pack_start(self.age_label, False, False, 0)
         scrolled_window = ScrolledWindow(h_policy="never", v_policy="automatic")
         self.results_box = Box(orientation='v', spacing=4)
         scrolled_window.add(self.results_box)
         self.pack_start(scrolled_window, True, True, 0)
         
+        log("UI:INIT", "Requesting a scan if the cached list is not fresh.")
+        # Before connecting, so the cached list is built once below rather than per signal
+        self.network_service.watch_scans()
+        self.connect('destroy', lambda *_: self.network_service.unwatch_scans())
+
         log("UI:INIT", "Connecting to service signals...")
-        rescan_button.connect('clicked', lambda b: self.network_service.request_scan())
-        self.ap_list_changed_handler_id = self.network_service.connect('ap-list-changed', self.build_network_list)
-        self.state_changed_handler_id = self.network_service.connect('state-changed', self.build_network_list)
-        self.connection_failed_handler_id = self.network_service.connect('connection-failed', self.on_connection_failed)
-        self.connect('destroy', self._on_destroy)
-
-        log("UI:INIT", "Performing initial build and requesting background scan.")
-        # self.build_network_list()
-        self.network_service.request_scan()
-        
+        # An explicit click always scans, unless a scan is already running
+        rescan_button.connect('clicked', lambda b: self.network_service.request_scan(force=True))
+        self.lifetime = Lifetime(self)
+        self.lifetime.connect(self.network_service, 'ap-list-changed', self.build_network_list)
+        self.lifetime.connect(self.network_service, 'state-changed', self.build_network_list)
+        self.lifetime.connect(self.network_service, 'connection-failed', self.on_connection_failed)
+        self.lifetime.add_timer(scheduler.every(1000, self._update_age_label))
+
+        self.build_network_list()
         self.show_all()
     
     def build_network_list(self, *args):
         log("UI:BUILD", "Rebuilding network list.")
         self.row_widgets = []
-        for child in self.results_box.get_children(): self.results_box.remove(child)
+        for child in self.results_box.get_children(): child.destroy()
         
         active_ap_path = self.network_service.get_active_ap_path()
         access_points = self.network_service.get_wifi_access_points()
@@ -429,6 +611,7 @@ class NetworkPopup(Box):
         log("UI:BUILD", f"  -> Building with state: active='{active_ap_path}', activating='{activating_ap_path}', scanning={is_scanning}, num_aps={len(access_points)}, aps={access_points}")
 
         self.rescan_stack.set_visible_child_name("spinner" if is_scanning else "button")
+        self._update_age_label()
         if active_ap_path == self.needs_password_ap:
             self.needs_password_ap = None
 
@@ -450,6 +633,13 @@ class NetworkPopup(Box):
             self.row_widgets.append(row_widget)
         self.results_box.show_all()
     
+    def _update_age_label(self):
+        age = self.network_service.ap_list_age()
+        if self.network_service.is_scanning: text = "Scanning..."
+        elif age is None: text = "Not scanned yet"
+        else: text = f"Updated {format_age(age)}"
+        if self.age_label.get_label() != text: self.age_label.set_label(text)
+
     def on_connection_failed(self):
         self.needs_password_ap = self.network_service.get_activating_ap_path()
         print(f"FAIL {self.needs_password_ap}")
@@ -466,11 +656,6 @@ class NetworkPopup(Box):
         self.password_entry.handle_key_press(event_key)
         return Gdk.EVENT_STOP
     
-    def _on_destroy(self, *args):
-        if self.ap_list_changed_handler_id: self.network_service.disconnect(self.ap_list_changed_handler_id)
-        if self.state_changed_handler_id: self.network_service.disconnect(self.state_changed_handler_id)
-        if self.connection_failed_handler_id: self.network_service.disconnect(self.connection_failed_handler_id)
-
     def _on_row_toggled(self, toggled_row, emitting_row):
         for row in self.row_widgets:
             if row != emitting_row:
@@ -484,10 +669,14 @@ class NetworkWidget(Box):
         self.icon = Image(icon_size=24)
         button = Button(name="task-button", child=Box(name="task-button-inner", children=[self.icon]))
         self.add(button)
-        self.network_service.connect('state-changed', self._update_icon)
+        # One service drives the widgets of every bar
+        self.lifetime = Lifetime(self)
+        self.lifetime.connect(self.network_service, 'state-changed', self._update_icon)
+        self.lifetime.connect(self.network_service, 'signal-changed', self._update_icon)
         self._update_icon()
         self.popup_manager.attach(button, self._create_network_popup, 'left-click')
 
+
     def _create_network_popup(self):
         return NetworkPopup(self.network_service, self.popup_manager)
 
@@ -497,7 +686,8 @@ class NetworkWidget(Box):
         if state >= 70: # CONNECTED_GLOBAL
             conn_type = self.network_service.get_active_connection_type()
             if conn_type == self.network_service.NM_DEVICE_TYPE_WIFI:
-                icon_name = 'network-wireless-signal-good-symbolic'
+                bucket = self.network_service.signal_bucket
+                icon_name = strength_icon(len(SIGNAL_BUCKET_NAMES) - 1 if bucket is None else bucket)
             elif conn_type == self.network_service.NM_DEVICE_TYPE_ETHERNET:
                 icon_name = 'network-wired-symbolic'
         elif self.network_service.is_activating:
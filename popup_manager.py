@@ -1,6 +1,7 @@
 import gi
-import os
-import sys
+
+import metrics
+from lifetime import Lifetime
 
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, GLib
@@ -9,6 +10,7 @@ class Popup(Gtk.Window):
     """A simple, undecorated popup window for holding content."""
     def __init__(self, parent, content_widget):
         super().__init__(type=Gtk.WindowType.POPUP, transient_for=parent)
+        self.lifetime = Lifetime(self, "popup")
         self.set_decorated(False)
         self.set_skip_taskbar_hint(True)
         self.set_keep_above(True)
@@ -17,67 +19,70 @@ class Popup(Gtk.Window):
 
 class PopupManager:
     """
-    Manages all popups for a parent window using a single, robust named pipe (FIFO).
-    It can use a pre-existing FIFO or create its own.
+    Manages the popups of every bar; at most one is open across all of them.
+    Outside clicks come from the click listener over the event bus, which is
+    armed only while a popup is open; external clients toggle popups with
+    "CMD <name>" requests.
     """
-    def __init__(self, parent_window):
-        self.parent_window = parent_window
+    def __init__(self, event_bus):
+        self.event_bus = event_bus
         self.active_popup = None
         self.active_parent = None
+        # The bar that owns active_parent; popups are transient for it
+        self.active_bar = None
         self.is_mouse_inside_popup = False
+
+        self.clicks_armed = False
+        self._disarm_source_id = None
+        self.stats = {"clicks": 0, "commands": 0, "arms": 0}
+        metrics.register("clicks", self.format_stats)
         
-        self.fifo_path = "/tmp/taskbar-commands.fifo" # Changed from taskbar.fifo for clarity
-        self.fifo_fd = None
-        
-        # --- MODIFICATION: Add a flag to track ownership of the FIFO ---
-        self.created_fifo = False
-        
+        # command -> [(widget, content_factory)], one per bar, oldest bar first
         self.command_map = {}
-        self._setup_fifo()
-
-    def _setup_fifo(self):
-        """
-        Connects to the FIFO. If it doesn't exist, it creates it and takes ownership.
-        """
-        # --- MODIFICATION: Only create the FIFO if it doesn't already exist ---
-        if not os.path.exists(self.fifo_path):
-            print(f"FIFO not found at {self.fifo_path}. Creating it.", file=sys.stderr)
-            os.mkfifo(self.fifo_path)
-            self.created_fifo = True # Mark that we are the owner
-        
-        try:
-            self.fifo_fd = os.open(self.fifo_path, os.O_RDWR | os.O_NONBLOCK)
-            GLib.io_add_watch(self.fifo_fd, GLib.IO_IN | GLib.IO_HUP, self._on_fifo_ready)
-            print(f"Unified FIFO manager listening on {self.fifo_path}.", file=sys.stderr)
-        except Exception as e:
-            print(f"Failed to open unified FIFO: {e}", file=sys.stderr)
-
-    def _on_fifo_ready(self, fd, condition):
-        # ... (This method is unchanged from the previous version) ...
-        if condition & GLib.IO_HUP:
-            return False
-
-        line_bytes = os.read(fd, 1024)
-        if not line_bytes:
-            return True
-
-        line = line_bytes.decode('utf-8').strip()
+        event_bus.set_role_handler("click", self._on_click_messages, self._on_click_listener_connected)
+        event_bus.register_request("CMD", self._on_command_request)
+
+    def _on_click_listener_connected(self, peer):
+        # Listeners start disarmed; bring a (re)connected one up to date
+        if self.clicks_armed:
+            self.event_bus.send(peer, "ARM\n")
+
+    def _set_clicks_armed(self, armed):
+        if armed == self.clicks_armed: return
+        self.clicks_armed = armed
+        self.event_bus.broadcast("click", "ARM\n" if armed else "DISARM\n")
+        if armed: self.stats["arms"] += 1
+
+    def _disarm_idle(self):
+        self._disarm_source_id = None
+        # Switching popups destroys one and shows the next in the same iteration
+        if not self.active_popup:
+            self._set_clicks_armed(False)
+        return False
+
+    def format_stats(self):
+        return f"{self.stats['clicks']} outside clicks, {self.stats['commands']} commands, armed {self.stats['arms']} times"
+
+    def _on_click_messages(self, peer, lines):
+        # Several presses in one wakeup still close the popup only once
+        if not any(line.startswith("CLICK") for line in lines): return
+        self.stats["clicks"] += 1
+        if not self.is_mouse_inside_popup:
+            if self.active_parent and self.active_parent.get_state_flags() & Gtk.StateFlags.PRELIGHT:
+                return
+            self.close_active_popup()
 
-        if line.startswith("CMD:"):
-            command = line.split(":", 1)[1]
-            if command in self.command_map:
-                widget, content_factory = self.command_map[command]
-                if self.active_parent == widget:
-                    self.close_active_popup()
-                else:
-                    self.show_popup(widget, content_factory())
+    def _on_command_request(self, command):
+        if command not in self.command_map:
+            raise ValueError(f"unknown popup command {command!r}")
+        self.stats["commands"] += 1
+        targets = self.command_map[command]
+        # Open on the first bar; close it wherever it is open
+        if any(widget == self.active_parent for widget, _ in targets):
+            self.close_active_popup()
         else:
-            if not self.is_mouse_inside_popup:
-                if self.active_parent and self.active_parent.get_state_flags() & Gtk.StateFlags.PRELIGHT:
-                    return True
-                self.close_active_popup()
-
-        return True
+            widget, content_factory = targets[0]
+            self.show_popup(widget, content_factory())
     
     def _on_global_key_press(self, widget, event_key):
         """Delegates key presses to the active popup handler if one exists."""
@@ -94,7 +99,13 @@ class PopupManager:
         widget.connect(event_name, self._on_widget_click, content_factory, button)
 
         if command:
-            self.command_map[command] = (widget, content_factory)
+            self.command_map.setdefault(command, []).append((widget, content_factory))
+            widget.connect("destroy", self._on_command_widget_destroyed, command)
+
+    def _on_command_widget_destroyed(self, widget, command):
+        targets = [target for target in self.command_map.get(command, []) if target[0] != widget]
+        if targets: self.command_map[command] = targets
+        else: self.command_map.pop(command, None)
 
     def _on_widget_click(self, widget, event, content_factory, button):
         # ... (This method is unchanged) ...
@@ -111,34 +122,48 @@ class PopupManager:
     def show_popup(self, clicked_widget, content_widget):
         # ... (This method is unchanged) ...
         self.close_active_popup()
-        parent_gdk_window = self.parent_window.get_window()
-        if not parent_gdk_window: return
+        bar = clicked_widget.get_toplevel()
+        if not bar.get_window(): return
+        content_widget.show_all()
+        popup = Popup(bar, content_widget)
+        popup.connect("enter-notify-event", self._on_popup_mouse_enter)
+        popup.connect("leave-notify-event", self._on_popup_mouse_leave)
+        popup.connect("destroy", self._on_popup_destroyed)
+        if hasattr(content_widget, 'handle_key_press'):
+            popup.handle_key_press = content_widget.handle_key_press
+        self.active_popup = popup
+        self.active_parent = clicked_widget
+        self.active_bar = bar
+        self._place_popup(popup, bar, clicked_widget, content_widget)
+        popup.show()
+        popup.grab_focus()
+        if self._disarm_source_id:
+            GLib.source_remove(self._disarm_source_id)
+            self._disarm_source_id = None
+        self._set_clicks_armed(True)
+        bar.set_keyboard_mode("exclusive")
+
+    def _place_popup(self, popup, bar, clicked_widget, content_widget):
+        """Sizes the popup to its content and centers it above clicked_widget, kept within the bar."""
         widget_alloc = clicked_widget.get_allocation()
-        taskbar_x, taskbar_y = self.parent_window.get_position()
+        taskbar_x, taskbar_y = bar.get_position()
         widget_screen_x = taskbar_x + widget_alloc.x
         widget_screen_y = taskbar_y + widget_alloc.y
-        content_widget.show_all()
         req_width, req_height = content_widget.get_size_request()
         popup_height = req_height if req_height != -1 else content_widget.get_preferred_height()[1]
         popup_width = req_width if req_width != -1 else content_widget.get_preferred_width()[1]
         widget_width = clicked_widget.get_allocated_width()
         ideal_x = widget_screen_x - (popup_width / 2) + (widget_width / 2)
-        screen_width = parent_gdk_window.get_screen().get_width()
-        popup_x = max(0, min(screen_width - popup_width, ideal_x))
+        bar_width = bar.get_allocated_width()
+        popup_x = max(taskbar_x, min(taskbar_x + bar_width - popup_width, ideal_x))
         popup_y = widget_screen_y - popup_height
-        popup = Popup(self.parent_window, content_widget)
         popup.resize(int(popup_width), int(popup_height))
-        popup.connect("enter-notify-event", self._on_popup_mouse_enter)
-        popup.connect("leave-notify-event", self._on_popup_mouse_leave)
-        popup.connect("destroy", self._on_popup_destroyed)
-        if hasattr(content_widget, 'handle_key_press'):
-            popup.handle_key_press = content_widget.handle_key_press
-        self.active_popup = popup
-        self.active_parent = clicked_widget
         popup.move(int(popup_x), int(popup_y))
-        popup.show()
-        popup.grab_focus()
-        self.parent_window.set_keyboard_mode("exclusive")
+
+    def refit_active_popup(self):
+        """Re-places the open popup after its content grew or shrank."""
+        if self.active_popup and self.active_parent:
+            self._place_popup(self.active_popup, self.active_bar, self.active_parent, self.active_popup.get_child())
 
     def _on_popup_mouse_enter(self, widget, event):
         if event.detail != Gdk.NotifyType.INFERIOR: self.is_mouse_inside_popup = True
@@ -147,23 +172,24 @@ class PopupManager:
         if event.detail != Gdk.NotifyType.INFERIOR: self.is_mouse_inside_popup = False
     
     def close_active_popup(self):
-        self.parent_window.set_keyboard_mode("on_demand")
         if self.active_popup:
             self.active_popup.destroy()
 
+    def close_popups_of(self, bar):
+        """Closes the open popup if it belongs to bar, e.g. before the bar is destroyed."""
+        if self.active_bar == bar:
+            self.close_active_popup()
+
     def _on_popup_destroyed(self, widget):
+        if self.active_bar:
+            self.active_bar.set_keyboard_mode("on_demand")
         self.is_mouse_inside_popup = False
         self.active_popup = None
         self.active_parent = None
+        self.active_bar = None
+        if not self._disarm_source_id:
+            self._disarm_source_id = GLib.idle_add(self._disarm_idle)
 
     def cleanup(self):
-        """Cleans up the FIFO file and descriptor on application exit."""
-        try:
-            if self.fifo_fd:
-                os.close(self.fifo_fd)
-            # --- MODIFICATION: Only remove the FIFO if we created it ---
-            if self.created_fifo and os.path.exists(self.fifo_path):
-                print(f"Removing FIFO {self.fifo_path} that this process created.", file=sys.stderr)
-                os.remove(self.fifo_path)
-        except Exception as e:
-            print(f"Error during FIFO cleanup: {e}", file=sys.stderr)
\ No newline at end of file
+        """Disarms the click listener on application exit."""
+        self._set_clicks_armed(False)
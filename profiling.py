@@ -0,0 +1,139 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+import collections
+import gc
+import io
+import os
+import sys
+import time
+
+import metrics
+
+# Lines of pstats and allocation sites written per dump
+TOP_ENTRIES = 60
+TRACEMALLOC_FRAMES = 10
+
+def dump_directory():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/tixbar-{os.getuid()}"
+    return os.path.join(runtime_dir, "tixbar")
+
+class Profiler:
+    """
+    On-demand profiling of the running bar through bus requests:
+
+        PROFILE start|stop         cProfile of the main loop, stats sorted two ways
+        TRACEMALLOC start|snapshot|stop
+                                   top allocation sites, and growth since the last snapshot
+        OBJECTS                    live widgets per class, and the change since last time
+
+    Reports go to files under $XDG_RUNTIME_DIR/tixbar and the reply names the
+    file. Nothing is imported or hooked until a request asks for it.
+    """
+    def __init__(self, event_bus):
+        self._profile = None
+        self._profile_started = None
+        self._last_snapshot = None
+        self._last_object_counts = None
+        self._dump_count = 0
+        self.stats = {"profiles": 0, "snapshots": 0, "object_dumps": 0}
+        event_bus.register_request("PROFILE", self._on_profile_request)
+        event_bus.register_request("TRACEMALLOC", self._on_tracemalloc_request)
+        event_bus.register_request("OBJECTS", self._on_objects_request)
+        metrics.register("profiling", self.format_stats)
+
+    def _write(self, kind, text):
+        directory = dump_directory()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # The sequence number keeps two dumps within one second apart
+        self._dump_count += 1
+        path = os.path.join(directory, f"{kind}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}-{self._dump_count}.txt")
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    # === CPROFILE ======================================================
+
+    def _on_profile_request(self, args):
+        if args == "start":
+            if self._profile: raise ValueError("profiler already running")
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile_started = time.monotonic()
+            # Requests run on the main loop, so this profiles the main thread
+            self._profile.enable()
+            return "profiling"
+        if args == "stop":
+            if not self._profile: raise ValueError("profiler not running")
+            import pstats
+            self._profile.disable()
+            elapsed = time.monotonic() - self._profile_started
+            out = io.StringIO()
+            out.write(f"Profile of {elapsed:.1f} s of the main loop\n\n")
+            stats = pstats.Stats(self._profile, stream=out)
+            for order in ("cumulative", "tottime"):
+                out.write(f"=== sorted by {order} ===\n")
+                stats.sort_stats(order).print_stats(TOP_ENTRIES)
+            self._profile = None
+            self.stats["profiles"] += 1
+            return self._write("profile", out.getvalue())
+        raise ValueError("expected PROFILE start|stop")
+
+    # === TRACEMALLOC ===================================================
+
+    def _on_tracemalloc_request(self, args):
+        import tracemalloc
+        if args == "start":
+            if tracemalloc.is_tracing(): raise ValueError("tracemalloc already running")
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._last_snapshot = None
+            return "tracing allocations"
+        if args == "stop":
+            if not tracemalloc.is_tracing(): raise ValueError("tracemalloc not running")
+            tracemalloc.stop()
+            self._last_snapshot = None
+            return "stopped"
+        if args == "snapshot":
+            if not tracemalloc.is_tracing(): raise ValueError("tracemalloc not running; send TRACEMALLOC start first")
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [f"Traced memory: {current / 1024:.0f} KiB now, {peak / 1024:.0f} KiB peak", "",
+                     "=== top allocation sites ==="]
+            lines += [str(stat) for stat in snapshot.statistics("lineno")[:TOP_ENTRIES]]
+            if self._last_snapshot:
+                lines += ["", "=== growth since the previous snapshot ==="]
+                lines += [str(stat) for stat in snapshot.compare_to(self._last_snapshot, "lineno")[:TOP_ENTRIES]]
+            lines += ["", "=== largest allocation tracebacks ==="]
+            for stat in snapshot.statistics("traceback")[:10]:
+                lines += [f"{stat.count} blocks, {stat.size / 1024:.1f} KiB"] + stat.traceback.format() + [""]
+            self._last_snapshot = snapshot
+            self.stats["snapshots"] += 1
+            return self._write("tracemalloc", "\n".join(lines))
+        raise ValueError("expected TRACEMALLOC start|snapshot|stop")
+
+    # === OBJECT COUNTS =================================================
+
+    def _on_objects_request(self, args):
+        counts = collections.Counter(type(obj).__name__ for obj in gc.get_objects() if isinstance(obj, Gtk.Widget))
+        previous, self._last_object_counts = self._last_object_counts, counts
+        lines = [f"{sum(counts.values())} live widgets", ""]
+        for name, count in counts.most_common():
+            change = f" ({count - previous.get(name, 0):+d})" if previous is not None else ""
+            lines.append(f"{count:8d}  {name}{change}")
+        if previous is not None:
+            lines += [f"       0  {name} (-{count})" for name, count in previous.items() if name not in counts]
+        self.stats["object_dumps"] += 1
+        return self._write("objects", "\n".join(lines))
+
+    def format_stats(self):
+        running = ", ".join(name for name, on in (("cProfile", self._profile), ("tracemalloc", self._tracemalloc_running())) if on)
+        return (f"{self.stats['profiles']} profiles, {self.stats['snapshots']} allocation snapshots, "
+                f"{self.stats['object_dumps']} object dumps; running: {running or 'nothing'}")
+
+    def _tracemalloc_running(self):
+        # Only loaded once a TRACEMALLOC request asked for it
+        module = sys.modules.get("tracemalloc")
+        return bool(module and module.is_tracing())
@@ -0,0 +1,136 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+import collections
+import threading
+import time
+
+import metrics
+
+# ===================================================================
+# === COALESCED TIMERS ==============================================
+# ===================================================================
+
+# Fire this long after the minute turns, so strftime already shows the new minute
+MINUTE_SLACK_MS = 20
+
+# period_ms -> [source_id, [callbacks]]: every timer of one period shares a source
+_slots = {}
+_minute_callbacks = []
+_minute_source_id = None
+_wakeups = collections.Counter()
+
+class Timer:
+    """A subscription returned by every() and every_minute(); cancel() is idempotent."""
+    def __init__(self, callbacks, callback, on_empty):
+        self._callbacks = callbacks
+        self._callback = callback
+        self._on_empty = on_empty
+
+    def cancel(self):
+        if self._callback in self._callbacks:
+            self._callbacks.remove(self._callback)
+            if not self._callbacks: self._on_empty()
+        self._callback = None
+
+def every(period_ms, callback):
+    """Calls callback() every period_ms until cancelled, sharing one wakeup with timers of the same period."""
+    slot = _slots.get(period_ms)
+    if slot is None:
+        slot = _slots[period_ms] = [GLib.timeout_add(period_ms, _run_slot, period_ms), []]
+    slot[1].append(callback)
+    return Timer(slot[1], callback, lambda: _remove_slot(period_ms))
+
+def _run_slot(period_ms):
+    _wakeups[f"{period_ms} ms"] += 1
+    for callback in list(_slots[period_ms][1]):
+        callback()
+    return True
+
+def _remove_slot(period_ms):
+    slot = _slots.pop(period_ms, None)
+    if slot: GLib.source_remove(slot[0])
+
+def every_minute(callback):
+    """Calls callback() just after each wall-clock minute boundary until cancelled."""
+    _minute_callbacks.append(callback)
+    if _minute_source_id is None: _schedule_minute()
+    return Timer(_minute_callbacks, callback, _cancel_minute)
+
+def _schedule_minute():
+    global _minute_source_id
+    # Recomputed every time, so neither drift nor a suspend leaves the clock behind
+    delay_ms = int((60.0 - time.time() % 60.0) * 1000) + MINUTE_SLACK_MS
+    _minute_source_id = GLib.timeout_add(delay_ms, _run_minute)
+
+def _run_minute():
+    global _minute_source_id
+    _minute_source_id = None
+    _wakeups["minute"] += 1
+    for callback in list(_minute_callbacks):
+        callback()
+    if _minute_callbacks: _schedule_minute()
+    return False
+
+def _cancel_minute():
+    global _minute_source_id
+    if _minute_source_id is not None:
+        GLib.source_remove(_minute_source_id)
+        _minute_source_id = None
+
+def format_stats():
+    timers = ", ".join(f"{len(slot[1])} x {period} ms" for period, slot in sorted(_slots.items()))
+    fired = ", ".join(f"{name} {count}" for name, count in sorted(_wakeups.items())) or "none"
+    return f"{len(_minute_callbacks)} minute timers, periodic: {timers or 'none'}; wakeups: {fired}"
+
+metrics.register("scheduler", format_stats)
+
+# ===================================================================
+# === WAKEUP COUNTER ================================================
+# ===================================================================
+
+def main_thread_context_switches():
+    """(voluntary, involuntary) switches of the main thread; each voluntary one is a sleep and a wakeup."""
+    counts = {}
+    with open(f"/proc/self/task/{threading.main_thread().native_id}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key.endswith("ctxt_switches"):
+                counts[key] = int(value)
+    return counts.get("voluntary_ctxt_switches", 0), counts.get("nonvoluntary_ctxt_switches", 0)
+
+class WakeupCounter:
+    """
+    "WAKEUPS <seconds>" counts how often the main thread woke up over that
+    window, normalized per minute; "WAKEUPS" reports progress or the result.
+    Leave the bar idle meanwhile. The end of the window costs one wakeup.
+    """
+    def __init__(self, event_bus):
+        self._source_id = None
+        self._started = None
+        self.result = "no measurement yet"
+        event_bus.register_request("WAKEUPS", self._on_request)
+
+    def _on_request(self, args):
+        if not args:
+            return "measuring" if self._source_id else self.result
+        if not args.isdigit() or int(args) < 1:
+            raise ValueError("expected WAKEUPS [seconds]")
+        if self._source_id:
+            raise ValueError("a measurement is already running")
+        self._started = (time.monotonic(), main_thread_context_switches(), collections.Counter(_wakeups))
+        self._source_id = GLib.timeout_add_seconds(int(args), self._on_done)
+        return f"measuring for {args} s"
+
+    def _on_done(self):
+        self._source_id = None
+        started_at, (voluntary, involuntary), fired_before = self._started
+        elapsed = time.monotonic() - started_at
+        now_voluntary, now_involuntary = main_thread_context_switches()
+        per_minute = (now_voluntary - voluntary) * 60.0 / elapsed
+        fired = collections.Counter(_wakeups)
+        fired.subtract(fired_before)
+        timers = ", ".join(f"{name} {count}" for name, count in sorted(fired.items()) if count) or "none"
+        self.result = (f"{now_voluntary - voluntary} main thread wakeups in {elapsed:.0f} s ({per_minute:.1f}/min), "
+                       f"{now_involuntary - involuntary} preemptions; scheduler timers fired: {timers}")
+        return False
@@ -0,0 +1,70 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+import gc
+import os
+import sys
+
+import lifetime
+
+# Cycles run per idle callback, so the main loop keeps drawing and finalizing in between
+CYCLES_PER_IDLE = 10
+# RSS may still settle after the warm-up; growth beyond this over the run counts as a leak
+RSS_SLACK_KIB = 2048
+
+def rss_kib():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+class SoakTest:
+    """
+    "SOAK <cycles>" runs cycle() that many times on the running bar; "SOAK"
+    reports progress or the result. After a warm-up of a tenth of the run, RSS
+    and the live counts from the lifetime registry are taken as the baseline
+    and must be the same at the end.
+    """
+    def __init__(self, event_bus, cycle):
+        self.cycle = cycle
+        self._source_id = None
+        self._total = 0
+        self._done = 0
+        self._baseline = None
+        self.result = "no soak run yet"
+        event_bus.register_request("SOAK", self._on_request)
+
+    def _on_request(self, args):
+        if not args:
+            return f"running, {self._done}/{self._total} cycles" if self._source_id else self.result
+        if not args.isdigit() or int(args) < 1:
+            raise ValueError("expected SOAK [cycles]")
+        if self._source_id:
+            raise ValueError("a soak is already running")
+        self._total, self._done, self._baseline = int(args), 0, None
+        self._source_id = GLib.idle_add(self._run_batch)
+        return f"soaking {self._total} cycles"
+
+    def _measure(self):
+        gc.collect()
+        return rss_kib(), lifetime.live_counts()
+
+    def _run_batch(self):
+        for _ in range(CYCLES_PER_IDLE):
+            self.cycle()
+            self._done += 1
+            if self._done == max(1, self._total // 10):
+                self._baseline = self._measure()
+            if self._done >= self._total:
+                self._source_id = None
+                self._finish()
+                return False
+        return True
+
+    def _finish(self):
+        (rss_before, counts_before), (rss_after, counts_after) = self._baseline, self._measure()
+        grown = {key: (counts_before.get(key, 0), value) for key, value in counts_after.items()
+                 if value > counts_before.get(key, 0)}
+        flat = not grown and rss_after - rss_before <= RSS_SLACK_KIB
+        details = ", ".join(f"{key} {before}->{after}" for key, (before, after) in sorted(grown.items()))
+        self.result = (f"{'PASS' if flat else 'FAIL'}: {self._total} cycles, RSS {rss_before} -> {rss_after} KiB"
+                       f"{'; grew: ' + details if details else ''}; now {lifetime.format_stats()}")
+        print(f"Soak test {self.result}", file=sys.stderr)
@@ -3,6 +3,18 @@
 #include <string.h>
 #include <poll.h>
 #include <stdbool.h>
+#include <stdint.h>
+#include <stdarg.h>
+#include <errno.h>
+#include <stdatomic.h>
+#include <time.h>
+#include <pthread.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/eventfd.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/un.h>
 #include <wayland-client.h>
 #include <ctype.h>
 #include <dirent.h> // Required for directory operations
@@ -11,31 +23,99 @@
 // --- Structs & Globals ---
 struct client_state; // Forward declaration
 
-// --- Struct for tracking processed apps during a QUERY ---
-struct processed_app_id {
-    char *app_id;
-    struct wl_list link;
-};
-
 // --- NEW: Struct to hold data from .desktop files ---
 struct desktop_app {
     char *app_id;
     char *name;
     char *generic_name;
     char *icon;
-    char *bin;
-    char *actions;
+    char *bin; // Raw Exec line; the bar expands field codes itself
+    char *path; // The .desktop file, re-read on demand for its actions
+    bool dbus_activatable;
     struct wl_list link;
 };
 
+// --- Open-addressing hash table keyed by strings (FNV-1a) ---
+struct str_table {
+    char **keys;
+    void **values;
+    size_t capacity; // Always a power of two
+    size_t count;
+};
+
+// --- A .desktop file queued for the scan workers ---
+struct scan_job {
+    char *app_id;
+    char *path;
+};
+
+#define MAX_SCAN_WORKERS 4
+
+// --- State of an in-progress QUERY. Worker threads parse the queued files in
+// --- parallel and hand the results back to the main loop through event_fd ---
+struct desktop_query {
+    bool active;
+    struct scan_job *jobs;
+    size_t job_count;
+    atomic_size_t next_job;
+    atomic_int workers_running;
+    atomic_bool cancelled;
+    bool quiet; // Build the in-memory list without printing DB lines
+    uint64_t started_us;
+    bool bulk; // Past the priority ids: entries go to the snapshot file, not DB lines
+    uint64_t generation;
+    pthread_t workers[MAX_SCAN_WORKERS];
+    int worker_count;
+    pthread_mutex_t lock;
+    struct wl_list results; // Parsed desktop_apps not yet printed, guarded by lock
+    int event_fd;
+};
+
+// --- Field bits of an UPDATE's MASK ---
+#define FIELD_APPID (1u << 0)
+#define FIELD_STATE (1u << 1)
+#define FIELD_TITLE (1u << 2)
+#define FIELD_OUTPUTS (1u << 3)
+#define FIELD_ALL (FIELD_APPID | FIELD_STATE | FIELD_TITLE | FIELD_OUTPUTS)
+
+// --- A bound wl_output. The bar matches these to its monitors by position and model ---
+struct output {
+    uint32_t id; // Our own id, used by OUTPUTS= and the OUTPUT_* lines
+    uint32_t global_name;
+    uint32_t version;
+    struct wl_output *wl_output;
+    char *name;
+    char *make;
+    char *model;
+    int32_t x, y;
+    bool announced;
+    struct wl_list link;
+};
+
+#define MAX_TOPLEVEL_OUTPUTS 16
+#define OUTPUTS_STRING_SIZE (MAX_TOPLEVEL_OUTPUTS * 11)
+
+// The protocol sends state enum values (0..3); window_state keeps one bit per value
+#define STATE_BIT(name) (1u << ZWLR_FOREIGN_TOPLEVEL_HANDLE_V1_STATE_##name)
+
 struct toplevel {
     uint32_t id;
     char *title;
     char *app_id;
     struct zwlr_foreign_toplevel_handle_v1 *handle;
     uint32_t window_state;
+    uint32_t outputs[MAX_TOPLEVEL_OUTPUTS]; // Ids of the outputs the window is on
+    int output_count;
     struct client_state *state;
     struct wl_list link;
+    // Changes since the last `done`; app_id matching only reruns when identity changed
+    bool identity_changed;
+    // What the bar was last told, so UPDATE only carries fields that differ
+    bool emitted;
+    char *last_app_id;
+    char *last_title;
+    uint32_t last_state;
+    char *last_outputs;
 };
 
 struct client_state {
@@ -43,288 +123,910 @@ struct client_state {
     struct zwlr_foreign_toplevel_manager_v1 *toplevel_manager;
     struct wl_seat *wl_seat; // Required for ACTIVATE command
     struct wl_list toplevels;
+    struct wl_list outputs;
     struct wl_list desktop_apps; // NEW: To store data from QUERY
+    struct str_table apps_by_id;   // app_id -> desktop_app, for direct matches
+    struct str_table apps_by_name; // Name -> desktop_app, for the title fallback
+    struct desktop_query query;
+    uint64_t db_generation; // Fingerprint of the app directories the desktop_apps came from, 0 if none
+    bool finished;
+};
+
+// --- Buffered stdout: lines accumulate here and are written once per loop iteration ---
+struct out_buffer {
+    char *data;
+    size_t len;
+    size_t capacity;
+};
+
+// --- Fixed-bucket histogram: bounds are inclusive upper edges, the last bucket is open ---
+#define HISTOGRAM_MAX_BUCKETS 8
+struct histogram {
+    const char *name;
+    const uint64_t *bounds;
+    int bound_count;
+    uint64_t counts[HISTOGRAM_MAX_BUCKETS];
+    uint64_t max;
+};
+
+static const uint64_t query_ms_bounds[] = { 10, 25, 50, 100, 250, 500, 1000 };
+static const uint64_t handler_us_bounds[] = { 50, 100, 250, 500, 1000, 5000, 20000 };
+#define HISTOGRAM(name, bounds) { name, bounds, sizeof(bounds) / sizeof(bounds[0]), { 0 }, 0 }
+
+// Toplevel events counted per type, named as the STATS reply reports them
+enum toplevel_event { EVENT_NEW, EVENT_TITLE, EVENT_APP_ID, EVENT_STATE, EVENT_OUTPUT_ENTER,
+                      EVENT_OUTPUT_LEAVE, EVENT_DONE, EVENT_CLOSED, EVENT_TYPE_COUNT };
+static const char *const toplevel_event_names[EVENT_TYPE_COUNT] = {
+    "new", "title", "app_id", "state", "output_enter", "output_leave", "done", "closed",
+};
+
+// --- Counters reported on stderr when the daemon exits, and on request by STATS ---
+struct daemon_stats {
+    uint64_t lines_out;
+    uint64_t bytes_out;
+    uint64_t write_calls;
+    uint64_t commands_in;
+    uint64_t command_batches;
+    uint64_t command_targets;
+    uint64_t updates_emitted;
+    uint64_t updates_suppressed;
+    uint64_t events[EVENT_TYPE_COUNT];
+    // How resolve_app_id matched: the compositor's app_id, the title fallback, or neither
+    uint64_t matched_app_id;
+    uint64_t matched_title;
+    uint64_t matched_none;
+    uint64_t queries;
+    uint64_t last_query_ms;
+    uint64_t started_us;
+    struct histogram query_ms;    // QUERY start to QUERY_DONE
+    struct histogram dispatch_us; // One read and dispatch of Wayland events
+    struct histogram command_us;  // One batch of commands from the bar
 };
 
 static uint32_t next_toplevel_id = 0;
+static uint32_t next_output_id = 0;
+static struct out_buffer out = { 0 };
+static struct daemon_stats stats = {
+    .query_ms = HISTOGRAM("QUERY_MS", query_ms_bounds),
+    .dispatch_us = HISTOGRAM("DISPATCH_US", handler_us_bounds),
+    .command_us = HISTOGRAM("COMMAND_US", handler_us_bounds),
+};
 
-// --- Helper Functions (No changes here) ---
-char *get_field_from_desktop_file(const char *app_id, const char *field_name) {
-    if (!app_id) return NULL;
-    char desktop_path[1024];
-    const char *home_dir = getenv("HOME");
-    char home_desktop_path_buffer[1024];
-    if (home_dir) {
-        snprintf(home_desktop_path_buffer, sizeof(home_desktop_path_buffer), "%s/.local/share/applications/%s.desktop", home_dir, app_id);
-    }
-    const char *possible_filenames[] = {
-        "/usr/share/applications/%s.desktop", "/var/lib/flatpak/exports/share/applications/%s.desktop",
-        home_dir ? home_desktop_path_buffer : NULL, NULL
-    };
-    FILE *f = NULL;
-    for (int i = 0; possible_filenames[i] != NULL && f == NULL; ++i) {
-        snprintf(desktop_path, sizeof(desktop_path), possible_filenames[i], app_id);
-        f = fopen(desktop_path, "r");
-    }
-    char *found_value = NULL;
-    if (f) {
-        char *line = NULL; size_t len = 0;
-        size_t field_len = strlen(field_name);
-        while (getline(&line, &len, f) != -1) {
-            if (strncmp(line, field_name, field_len) == 0 && line[field_len] == '=') {
-                char *value = line + field_len + 1;
-                value[strcspn(value, "\n")] = 0;
-                if (strcmp(field_name, "Exec") == 0) {
-                    char *percent = strchr(value, '%');
-                    if (percent) {
-                        char *temp = percent;
-                        while(temp > value && *(temp-1) == ' '){ temp--; }
-                        *temp = '\0';
-                    }
-                }
-                found_value = strdup(value);
-                break;
-            }
+static uint64_t monotonic_us(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000 + (uint64_t)ts.tv_nsec / 1000;
+}
+
+static void histogram_add(struct histogram *h, uint64_t value) {
+    int i = 0;
+    while (i < h->bound_count && value > h->bounds[i]) i++;
+    h->counts[i]++;
+    if (value > h->max) h->max = value;
+}
+
+// Commands arrive on in_fd and output goes to out_fd: stdin/stdout when run by hand,
+// or one SOCK_SEQPACKET connection to the bar's event bus when TIXBAR_SOCKET is set.
+static int in_fd = STDIN_FILENO;
+static int out_fd = STDOUT_FILENO;
+static bool out_is_message_socket = false;
+// Each bus message carries whole lines and stays below this size
+#define BUS_MESSAGE_MAX (64 * 1024)
+
+// A single QUERY chunk can be large; flush early rather than grow without bound
+#define OUT_FLUSH_THRESHOLD (64 * 1024)
+
+#define MAX_DESKTOP_ACTIONS 32
+
+// --- String Table ---
+static uint64_t hash_string(const char *s) {
+    uint64_t hash = 1469598103934665603ULL;
+    while (*s) {
+        hash ^= (unsigned char)*s++;
+        hash *= 1099511628211ULL;
+    }
+    return hash;
+}
+
+void str_table_init(struct str_table *table, size_t expected) {
+    size_t capacity = 16;
+    while (capacity < expected * 2) capacity <<= 1;
+    table->keys = calloc(capacity, sizeof(char *));
+    table->values = calloc(capacity, sizeof(void *));
+    table->capacity = capacity;
+    table->count = 0;
+}
+
+static size_t str_table_slot(const struct str_table *table, const char *key) {
+    size_t mask = table->capacity - 1;
+    size_t i = hash_string(key) & mask;
+    while (table->keys[i] && strcmp(table->keys[i], key) != 0) i = (i + 1) & mask;
+    return i;
+}
+
+static void str_table_grow(struct str_table *table) {
+    struct str_table grown;
+    str_table_init(&grown, table->capacity);
+    for (size_t i = 0; i < table->capacity; ++i) {
+        if (!table->keys[i]) continue;
+        size_t slot = str_table_slot(&grown, table->keys[i]);
+        grown.keys[slot] = table->keys[i];
+        grown.values[slot] = table->values[i];
+        grown.count++;
+    }
+    free(table->keys);
+    free(table->values);
+    *table = grown;
+}
+
+void *str_table_get(const struct str_table *table, const char *key) {
+    if (!table->capacity) return NULL;
+    size_t slot = str_table_slot(table, key);
+    return table->keys[slot] ? table->values[slot] : NULL;
+}
+
+bool str_table_contains(const struct str_table *table, const char *key) {
+    return table->capacity && table->keys[str_table_slot(table, key)] != NULL;
+}
+
+// Inserts key if absent; returns false (and keeps the old value) when it was already present
+bool str_table_insert(struct str_table *table, const char *key, void *value) {
+    if ((table->count + 1) * 2 > table->capacity) str_table_grow(table);
+    size_t slot = str_table_slot(table, key);
+    if (table->keys[slot]) return false;
+    table->keys[slot] = strdup(key);
+    table->values[slot] = value;
+    table->count++;
+    return true;
+}
+
+void str_table_free(struct str_table *table) {
+    for (size_t i = 0; i < table->capacity; ++i) free(table->keys[i]);
+    free(table->keys);
+    free(table->values);
+    memset(table, 0, sizeof(*table));
+}
+
+// --- Output Buffer ---
+static void out_reserve(size_t extra) {
+    if (out.len + extra + 1 <= out.capacity) return;
+    size_t capacity = out.capacity ? out.capacity : 4096;
+    while (out.len + extra + 1 > capacity) capacity *= 2;
+    out.data = realloc(out.data, capacity);
+    out.capacity = capacity;
+}
+
+// On the bus every write is one message, so cut at the last line that fits
+static size_t out_chunk_length(size_t offset) {
+    size_t len = out.len - offset;
+    if (!out_is_message_socket || len <= BUS_MESSAGE_MAX) return len;
+    for (size_t i = BUS_MESSAGE_MAX; i > 0; --i) {
+        if (out.data[offset + i - 1] == '\n') return i;
+    }
+    // A single line longer than a message; send it whole and let the reader report it
+    const char *end = memchr(out.data + offset, '\n', len);
+    return end ? (size_t)(end - (out.data + offset)) + 1 : len;
+}
+
+void out_flush(void) {
+    size_t written = 0;
+    while (written < out.len) {
+        size_t len = out_chunk_length(written);
+        // MSG_NOSIGNAL: a bar that went away must not kill us before the stats are printed
+        ssize_t n = out_is_message_socket ? send(out_fd, out.data + written, len, MSG_NOSIGNAL)
+                                          : write(out_fd, out.data + written, len);
+        if (n < 0) {
+            if (errno == EINTR) continue;
+            break; // Reader is gone; EOF on in_fd will end the main loop
         }
-        free(line);
-        fclose(f);
+        stats.write_calls++;
+        written += (size_t)n;
     }
-    return found_value;
+    stats.bytes_out += written;
+    out.len = 0;
+}
+
+void out_printf(const char *fmt, ...) {
+    va_list args;
+    va_start(args, fmt);
+    int needed = vsnprintf(NULL, 0, fmt, args);
+    va_end(args);
+    if (needed <= 0) return;
+    out_reserve((size_t)needed);
+    va_start(args, fmt);
+    vsnprintf(out.data + out.len, (size_t)needed + 1, fmt, args);
+    va_end(args);
+    out.len += (size_t)needed;
 }
 
-char *get_actions_from_desktop_file(const char *app_id) {
-    if (!app_id) return NULL;
-    char desktop_path[1024];
+// Appends ` KEY="value"`, escaping so Python's shlex can split it and newlines can't break framing
+void out_field(const char *key, const char *value) {
+    if (!value) value = "";
+    out_printf(" %s=\"", key);
+    out_reserve(strlen(value) * 2);
+    for (const char *c = value; *c; ++c) {
+        if (*c == '"' || *c == '\\') out.data[out.len++] = '\\';
+        out.data[out.len++] = (*c == '\n' || *c == '\r') ? ' ' : *c;
+    }
+    out.data[out.len++] = '"';
+}
+
+void out_end_line(void) {
+    out_printf("\n");
+    stats.lines_out++;
+    if (out.len >= OUT_FLUSH_THRESHOLD) out_flush();
+}
+
+// Appends ` NAME="10:0,25:3,...,inf:1,max:130"`: the count per bucket bound
+static void out_histogram(const struct histogram *h) {
+    out_printf(" %s=\"", h->name);
+    for (int i = 0; i < h->bound_count; i++) out_printf("%llu:%llu,", (unsigned long long)h->bounds[i], (unsigned long long)h->counts[i]);
+    out_printf("inf:%llu,max:%llu\"", (unsigned long long)h->counts[h->bound_count], (unsigned long long)h->max);
+}
+
+// --- Every counter as one STATS line, flushed at once so the reply is a single message ---
+static void emit_stats(struct client_state *state) {
+    out_printf("STATS TOPLEVELS=%d OUTPUTS=%d APPS=%d UPTIME_MS=%llu",
+               wl_list_length(&state->toplevels), wl_list_length(&state->outputs), wl_list_length(&state->desktop_apps),
+               (unsigned long long)((monotonic_us() - stats.started_us) / 1000));
+    out_printf(" LINES_OUT=%llu BYTES_OUT=%llu WRITE_CALLS=%llu COMMANDS_IN=%llu COMMAND_BATCHES=%llu",
+               (unsigned long long)stats.lines_out, (unsigned long long)stats.bytes_out, (unsigned long long)stats.write_calls,
+               (unsigned long long)stats.commands_in, (unsigned long long)stats.command_batches);
+    out_printf(" UPDATES_EMITTED=%llu UPDATES_SUPPRESSED=%llu",
+               (unsigned long long)stats.updates_emitted, (unsigned long long)stats.updates_suppressed);
+    out_printf(" EVENTS=\"");
+    for (int i = 0; i < EVENT_TYPE_COUNT; i++) {
+        out_printf("%s%s:%llu", i ? "," : "", toplevel_event_names[i], (unsigned long long)stats.events[i]);
+    }
+    out_printf("\" MATCHES=\"app_id:%llu,title:%llu,none:%llu\"", (unsigned long long)stats.matched_app_id,
+               (unsigned long long)stats.matched_title, (unsigned long long)stats.matched_none);
+    out_printf(" QUERIES=%llu LAST_QUERY_MS=%llu", (unsigned long long)stats.queries, (unsigned long long)stats.last_query_ms);
+    out_histogram(&stats.query_ms);
+    out_histogram(&stats.dispatch_us);
+    out_histogram(&stats.command_us);
+    out_end_line();
+    out_flush();
+}
+
+// --- Helper Functions ---
+void format_state_string(uint32_t state, char* buffer, size_t buffer_len) {
+    buffer[0] = '\0';
+    if (state & STATE_BIT(MAXIMIZED)) strncat(buffer, "Maximized ", buffer_len - strlen(buffer) - 1);
+    if (state & STATE_BIT(MINIMIZED)) strncat(buffer, "Minimized ", buffer_len - strlen(buffer) - 1);
+    if (state & STATE_BIT(ACTIVATED)) strncat(buffer, "Active ", buffer_len - strlen(buffer) - 1);
+    if (state & STATE_BIT(FULLSCREEN)) strncat(buffer, "Fullscreen ", buffer_len - strlen(buffer) - 1);
+    if (buffer[0] == '\0') strncat(buffer, "Normal", buffer_len - strlen(buffer) - 1);
+    else {
+        size_t len = strlen(buffer);
+        if (len > 0 && buffer[len - 1] == ' ') buffer[len - 1] = '\0';
+    }
+}
+
+// --- Application directories in precedence order (earlier ones win) ---
+static int get_app_dirs(const char **dirs, char *home_buffer, size_t home_buffer_len) {
+    int n = 0;
     const char *home_dir = getenv("HOME");
-    char home_desktop_path_buffer[1024];
     if (home_dir) {
-        snprintf(home_desktop_path_buffer, sizeof(home_desktop_path_buffer), "%s/.local/share/applications/%s.desktop", home_dir, app_id);
+        snprintf(home_buffer, home_buffer_len, "%s/.local/share/applications", home_dir);
+        dirs[n++] = home_buffer;
+    }
+    dirs[n++] = "/usr/share/applications";
+    dirs[n++] = "/var/lib/flatpak/exports/share/applications";
+    dirs[n] = NULL;
+    return n;
+}
+
+static bool find_desktop_file(const char *app_id, char *path, size_t path_len) {
+    const char *dirs[4];
+    char home_buffer[1024];
+    get_app_dirs(dirs, home_buffer, sizeof(home_buffer));
+    for (int i = 0; dirs[i] != NULL; ++i) {
+        snprintf(path, path_len, "%s/%s.desktop", dirs[i], app_id);
+        if (access(path, R_OK) == 0) return true;
+    }
+    return false;
+}
+
+static uint64_t fnv1a(uint64_t hash, const void *data, size_t len) {
+    const unsigned char *bytes = data;
+    for (size_t b = 0; b < len; ++b) {
+        hash ^= bytes[b];
+        hash *= 1099511628211ULL;
     }
-    const char *possible_filenames[] = {
-        "/usr/share/applications/%s.desktop", "/var/lib/flatpak/exports/share/applications/%s.desktop",
-        home_dir ? home_desktop_path_buffer : NULL, NULL
-    };
-    FILE *f = NULL;
-    for (int i = 0; possible_filenames[i] != NULL && f == NULL; ++i) {
-        snprintf(desktop_path, sizeof(desktop_path), possible_filenames[i], app_id);
-        f = fopen(desktop_path, "r");
+    return hash;
+}
+
+// --- Fingerprint of the app directories and every .desktop file in them: changes
+// --- whenever one is added, removed, replaced or edited in place, so the bar can
+// --- tell if its DB is stale. Costs one stat per file, no reads ---
+uint64_t compute_db_generation(void) {
+    const char *dirs[4];
+    char home_buffer[1024];
+    get_app_dirs(dirs, home_buffer, sizeof(home_buffer));
+    const char *desktop_suffix = ".desktop";
+    size_t suffix_len = strlen(desktop_suffix);
+    uint64_t hash = 1469598103934665603ULL;
+    for (int i = 0; dirs[i] != NULL; ++i) {
+        struct stat st;
+        if (stat(dirs[i], &st) != 0) continue;
+        uint64_t parts[4] = { (uint64_t)st.st_dev, (uint64_t)st.st_ino, (uint64_t)st.st_mtim.tv_sec, (uint64_t)st.st_mtim.tv_nsec };
+        hash = fnv1a(hash, parts, sizeof(parts));
+        DIR *d = opendir(dirs[i]);
+        if (!d) continue;
+        // Summed per file, so the order readdir happens to return does not matter
+        uint64_t files = 0;
+        struct dirent *dir;
+        while ((dir = readdir(d)) != NULL) {
+            const char *name = dir->d_name;
+            size_t name_len = strlen(name);
+            if (name_len <= suffix_len || strcmp(name + name_len - suffix_len, desktop_suffix) != 0) continue;
+            // Follows symlinks, so an edited link target counts too
+            if (fstatat(dirfd(d), name, &st, 0) != 0) continue;
+            uint64_t file[3] = { (uint64_t)st.st_mtim.tv_sec, (uint64_t)st.st_mtim.tv_nsec, (uint64_t)st.st_size };
+            files += fnv1a(fnv1a(1469598103934665603ULL, name, name_len), file, sizeof(file));
+        }
+        closedir(d);
+        hash = fnv1a(hash, &files, sizeof(files));
     }
+    return hash ? hash : 1;
+}
+
+static void take_field(char **dest, const char *line, const char *key) {
+    size_t key_len = strlen(key);
+    if (!*dest && strncmp(line, key, key_len) == 0) *dest = strdup(line + key_len);
+}
+
+// --- Parses the [Desktop Entry] section; actions are only read when the bar asks for them.
+// --- Only touches its own allocations, so it is safe to run on the scan workers ---
+struct desktop_app *parse_desktop_file(const char *app_id, const char *path) {
+    FILE *f = fopen(path, "r");
     if (!f) return NULL;
-    char *line = NULL, *actions_list_str = NULL, *final_output = NULL;
+
+    struct desktop_app *app = calloc(1, sizeof(struct desktop_app));
+    char *dbus_activatable = NULL;
+    bool in_entry = false;
+
+    char *line = NULL;
     size_t len = 0;
     while (getline(&line, &len, f) != -1) {
-        if (strncmp(line, "Actions=", 8) == 0) {
-            actions_list_str = strdup(line + 8);
-            actions_list_str[strcspn(actions_list_str, "\n")] = 0;
-            break;
+        char *trimmed = line;
+        while (isspace((unsigned char)*trimmed)) trimmed++;
+        trimmed[strcspn(trimmed, "\r\n")] = 0;
+
+        if (trimmed[0] == '[') {
+            // Everything we need precedes the first other group, usually [Desktop Action ...]
+            if (in_entry) break;
+            in_entry = strcmp(trimmed, "[Desktop Entry]") == 0;
+            continue;
+        }
+
+        if (in_entry) {
+            take_field(&app->name, trimmed, "Name=");
+            take_field(&app->generic_name, trimmed, "GenericName=");
+            take_field(&app->icon, trimmed, "Icon=");
+            take_field(&app->bin, trimmed, "Exec=");
+            take_field(&dbus_activatable, trimmed, "DBusActivatable=");
         }
     }
-    if (!actions_list_str || strlen(actions_list_str) == 0) {
-        fclose(f); free(line); return NULL;
-    }
-    size_t output_size = 4096;
-    final_output = malloc(output_size);
-    final_output[0] = '\0';
-    char *actions_copy = strdup(actions_list_str);
-    char *action_id = strtok(actions_copy, ";");
-    while(action_id && strlen(action_id) > 0) {
-        char section_header[256];
-        snprintf(section_header, sizeof(section_header), "[Desktop Action %s]", action_id);
-        rewind(f);
-        char *action_name = NULL, *action_exec = NULL;
-        int in_section = 0;
-        while(getline(&line, &len, f) != -1) {
-            char *trimmed_line = line;
-            while(isspace((unsigned char)*trimmed_line)) trimmed_line++;
-            trimmed_line[strcspn(trimmed_line, "\n")] = 0;
-            if (strcmp(trimmed_line, section_header) == 0) { in_section = 1; continue; }
-            if (in_section) {
-                if (trimmed_line[0] == '[') break;
-                if (strncmp(trimmed_line, "Name=", 5) == 0 && !action_name) action_name = strdup(trimmed_line + 5);
-                else if (strncmp(trimmed_line, "Exec=", 5) == 0 && !action_exec) action_exec = strdup(trimmed_line + 5);
+    free(line);
+    fclose(f);
+
+    app->dbus_activatable = dbus_activatable && strcmp(dbus_activatable, "true") == 0;
+    free(dbus_activatable);
+
+    app->app_id = strdup(app_id);
+    app->path = strdup(path);
+    if (!app->name) app->name = strdup("");
+    if (!app->generic_name) app->generic_name = strdup("");
+    if (!app->icon) app->icon = strdup("");
+    if (!app->bin) app->bin = strdup("");
+    return app;
+}
+
+// --- Prints the actions of one .desktop file in the order its Actions= key lists them,
+// --- one ACTION line each, always followed by ACTIONS_DONE so the bar can cache the result ---
+static void emit_desktop_actions(const char *app_id, const char *path) {
+    struct { char *id, *name, *exec; } actions[MAX_DESKTOP_ACTIONS];
+    int action_count = 0;
+    char *actions_list = NULL;
+    enum { SECTION_NONE, SECTION_ENTRY, SECTION_ACTION, SECTION_OTHER } section = SECTION_NONE;
+
+    FILE *f = path ? fopen(path, "r") : NULL;
+    if (f) {
+        char *line = NULL;
+        size_t len = 0;
+        while (getline(&line, &len, f) != -1) {
+            char *trimmed = line;
+            while (isspace((unsigned char)*trimmed)) trimmed++;
+            trimmed[strcspn(trimmed, "\r\n")] = 0;
+
+            if (trimmed[0] == '[') {
+                if (strcmp(trimmed, "[Desktop Entry]") == 0) {
+                    section = SECTION_ENTRY;
+                } else if (strncmp(trimmed, "[Desktop Action ", 16) == 0 && action_count < MAX_DESKTOP_ACTIONS) {
+                    section = SECTION_ACTION;
+                    actions[action_count].id = strndup(trimmed + 16, strcspn(trimmed + 16, "]"));
+                    actions[action_count].name = NULL;
+                    actions[action_count].exec = NULL;
+                    action_count++;
+                } else {
+                    section = SECTION_OTHER;
+                }
+                continue;
+            }
+
+            if (section == SECTION_ENTRY) {
+                take_field(&actions_list, trimmed, "Actions=");
+            } else if (section == SECTION_ACTION) {
+                take_field(&actions[action_count - 1].name, trimmed, "Name=");
+                take_field(&actions[action_count - 1].exec, trimmed, "Exec=");
             }
-            if (action_name && action_exec) break;
         }
-        if (action_name && action_exec) {
-            char entry[1024];
-            snprintf(entry, sizeof(entry), "%s|%s;", action_name, action_exec);
-            if (strlen(final_output) + strlen(entry) < output_size) strcat(final_output, entry);
+        free(line);
+        fclose(f);
+    }
+
+    if (actions_list) {
+        char *saveptr = NULL;
+        for (char *action_id = strtok_r(actions_list, ";", &saveptr); action_id; action_id = strtok_r(NULL, ";", &saveptr)) {
+            for (int i = 0; i < action_count; ++i) {
+                if (strcmp(actions[i].id, action_id) != 0 || !actions[i].name) continue;
+                out_printf("ACTION");
+                out_field("APPID", app_id);
+                out_field("ID", actions[i].id);
+                out_field("NAME", actions[i].name);
+                out_field("EXEC", actions[i].exec);
+                out_end_line();
+                break;
+            }
         }
-        free(action_name); free(action_exec);
-        action_id = strtok(NULL, ";");
     }
-    free(actions_list_str); free(actions_copy); free(line); fclose(f);
-    if (strlen(final_output) > 0) final_output[strlen(final_output) - 1] = '\0';
-    return final_output;
+    for (int i = 0; i < action_count; ++i) {
+        free(actions[i].id);
+        free(actions[i].name);
+        free(actions[i].exec);
+    }
+    free(actions_list);
+
+    out_printf("ACTIONS_DONE");
+    out_field("APPID", app_id);
+    out_field("PATH", path);
+    out_end_line();
 }
 
-void format_state_string(uint32_t state, char* buffer, size_t buffer_len) {
-    buffer[0] = '\0';
-    if (state & ZWLR_FOREIGN_TOPLEVEL_HANDLE_V1_STATE_MAXIMIZED) strncat(buffer, "Maximized ", buffer_len - strlen(buffer) - 1);
-    if (state & ZWLR_FOREIGN_TOPLEVEL_HANDLE_V1_STATE_MINIMIZED) strncat(buffer, "Minimized ", buffer_len - strlen(buffer) - 1);
-    if (state & ZWLR_FOREIGN_TOPLEVEL_HANDLE_V1_STATE_ACTIVATED) strncat(buffer, "Active ", buffer_len - strlen(buffer) - 1);
-    if (state & ZWLR_FOREIGN_TOPLEVEL_HANDLE_V1_STATE_FULLSCREEN) strncat(buffer, "Fullscreen ", buffer_len - strlen(buffer) - 1);
-    if (buffer[0] == '\0') strncat(buffer, "Normal", buffer_len - strlen(buffer) - 1);
-    else {
-        size_t len = strlen(buffer);
-        if (len > 0 && buffer[len - 1] == ' ') buffer[len - 1] = '\0';
+void free_desktop_app(struct desktop_app *app) {
+    free(app->app_id);
+    free(app->name);
+    free(app->generic_name);
+    free(app->icon);
+    free(app->bin);
+    free(app->path);
+    free(app);
+}
+
+void free_desktop_apps(struct wl_list *apps) {
+    struct desktop_app *app, *tmp;
+    wl_list_for_each_safe(app, tmp, apps, link) {
+        wl_list_remove(&app->link);
+        free_desktop_app(app);
     }
 }
 
-// --- Scans directories, prints and caches all found desktop files ---
-void query_desktop_files(struct client_state *state) {
-    struct wl_list processed_app_ids;
-    wl_list_init(&processed_app_ids);
+// --- Prints one entry as a DB line ---
+void print_desktop_app(const struct desktop_app *app) {
+    out_printf("DB");
+    out_field("APPID", app->app_id);
+    out_field("NAME", app->name);
+    out_field("GENERIC_NAME", app->generic_name);
+    out_field("ICON", app->icon);
+    out_field("BIN", app->bin);
+    if (app->dbus_activatable) out_printf(" DBUS=1");
+    out_end_line();
+}
 
-    const char *home_dir = getenv("HOME");
-    char home_desktop_path_buffer[1024];
-    if (home_dir) {
-        snprintf(home_desktop_path_buffer, sizeof(home_desktop_path_buffer), "%s/.local/share/applications", home_dir);
+// --- Moves a parsed entry into the in-memory database; priority entries are
+// --- printed at once, the bulk scan is written out whole by write_db_snapshot ---
+void emit_desktop_app(struct client_state *state, struct desktop_app *app) {
+    wl_list_insert(&state->desktop_apps, &app->link);
+    str_table_insert(&state->apps_by_id, app->app_id, app);
+    if (app->name[0] != '\0') str_table_insert(&state->apps_by_name, app->name, app);
+    if (state->query.quiet || state->query.bulk) return;
+    print_desktop_app(app);
+}
+
+// --- Bulk DB Snapshot ---
+static void json_write_string(FILE *f, const char *value) {
+    fputc('"', f);
+    for (const unsigned char *c = (const unsigned char *)(value ? value : ""); *c; ++c) {
+        if (*c == '"' || *c == '\\') fprintf(f, "\\%c", *c);
+        else if (*c < 0x20) fprintf(f, "\\u%04x", *c);
+        else fputc(*c, f);
     }
+    fputc('"', f);
+}
 
-    const char *app_dirs[] = {
-        home_dir ? home_desktop_path_buffer : NULL,
-        "/usr/share/applications",
-        "/var/lib/flatpak/exports/share/applications",
-        NULL
-    };
+// --- Writes every entry as one JSON document to $XDG_RUNTIME_DIR/tixbar/db-<pid>.json,
+// --- so the bar loads the DB in one read instead of one line per app. Rows are
+// --- [appid, name, generic_name, icon, bin, dbus] in the order of "fields" ---
+static bool write_db_snapshot(struct client_state *state, char *path, size_t path_len) {
+    const char *runtime_dir = getenv("XDG_RUNTIME_DIR");
+    char dir[1024];
+    if (runtime_dir && runtime_dir[0]) snprintf(dir, sizeof(dir), "%s/tixbar", runtime_dir);
+    else snprintf(dir, sizeof(dir), "/tmp/tixbar-%u/tixbar", (unsigned)getuid());
+    if (mkdir(dir, 0700) != 0 && errno != EEXIST) return false;
 
-    for (int i = 0; app_dirs[i] != NULL; ++i) {
-        DIR *d = opendir(app_dirs[i]);
-        if (!d) continue;
+    char tmp_path[1100];
+    snprintf(path, path_len, "%s/db-%d.json", dir, (int)getpid());
+    snprintf(tmp_path, sizeof(tmp_path), "%s.tmp", path);
+    int fd = open(tmp_path, O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC, 0600);
+    if (fd < 0) return false;
+    FILE *f = fdopen(fd, "w");
+    if (!f) {
+        close(fd);
+        unlink(tmp_path);
+        return false;
+    }
 
+    fprintf(f, "{\"generation\":\"%016llx\",\"fields\":[\"appid\",\"name\",\"generic_name\",\"icon\",\"bin\",\"dbus\"],\"apps\":[",
+            (unsigned long long)state->query.generation);
+    bool first = true;
+    struct desktop_app *app;
+    wl_list_for_each(app, &state->desktop_apps, link) {
+        fputs(first ? "\n[" : ",\n[", f);
+        first = false;
+        json_write_string(f, app->app_id); fputc(',', f);
+        json_write_string(f, app->name); fputc(',', f);
+        json_write_string(f, app->generic_name); fputc(',', f);
+        json_write_string(f, app->icon); fputc(',', f);
+        json_write_string(f, app->bin);
+        fprintf(f, ",%d]", app->dbus_activatable ? 1 : 0);
+    }
+    fputs("]}\n", f);
+    // Renamed only once complete, so the bar never reads a half-written file
+    bool ok = !ferror(f);
+    if (fclose(f) != 0) ok = false;
+    if (ok && rename(tmp_path, path) == 0) return true;
+    unlink(tmp_path);
+    return false;
+}
+
+// --- Desktop Scan Workers ---
+static void signal_query_event(struct desktop_query *query) {
+    uint64_t one = 1;
+    if (write(query->event_fd, &one, sizeof(one)) < 0) {
+        // The counter only overflows if the main loop stopped reading; nothing to do
+    }
+}
+
+static void *scan_worker(void *data) {
+    struct desktop_query *query = data;
+    size_t i;
+    while (!atomic_load(&query->cancelled) && (i = atomic_fetch_add(&query->next_job, 1)) < query->job_count) {
+        struct desktop_app *app = parse_desktop_file(query->jobs[i].app_id, query->jobs[i].path);
+        if (!app) continue;
+        pthread_mutex_lock(&query->lock);
+        wl_list_insert(query->results.prev, &app->link);
+        pthread_mutex_unlock(&query->lock);
+        signal_query_event(query);
+    }
+    atomic_fetch_sub(&query->workers_running, 1);
+    signal_query_event(query);
+    return NULL;
+}
+
+static void end_desktop_query(struct desktop_query *query) {
+    for (int i = 0; i < query->worker_count; ++i) pthread_join(query->workers[i], NULL);
+    query->worker_count = 0;
+    free_desktop_apps(&query->results);
+    for (size_t i = 0; i < query->job_count; ++i) {
+        free(query->jobs[i].app_id);
+        free(query->jobs[i].path);
+    }
+    free(query->jobs);
+    query->jobs = NULL;
+    query->job_count = 0;
+    query->active = false;
+}
+
+// --- Starts a QUERY: priority app_ids are resolved and printed right away, the
+// --- bulk scan is then parsed by worker threads and drained by the main loop ---
+void begin_desktop_query(struct client_state *state, char **priority_ids, int priority_count, bool quiet) {
+    struct desktop_query *query = &state->query;
+    if (query->active) {
+        atomic_store(&query->cancelled, true);
+        end_desktop_query(query);
+    }
+    free_desktop_apps(&state->desktop_apps);
+    str_table_free(&state->apps_by_id);
+    str_table_free(&state->apps_by_name);
+    str_table_init(&state->apps_by_id, 512);
+    str_table_init(&state->apps_by_name, 512);
+    state->db_generation = 0;
+    query->quiet = quiet;
+    query->bulk = false;
+    query->started_us = monotonic_us();
+    query->generation = compute_db_generation();
+
+    // Directories are listed in precedence order, so the first app_id seen wins
+    struct str_table seen;
+    str_table_init(&seen, 512);
+
+    char path[2048];
+    for (int i = 0; i < priority_count; ++i) {
+        if (!str_table_insert(&seen, priority_ids[i], NULL)) continue;
+        if (!find_desktop_file(priority_ids[i], path, sizeof(path))) continue;
+        struct desktop_app *app = parse_desktop_file(priority_ids[i], path);
+        if (app) emit_desktop_app(state, app);
+    }
+    out_printf("PRIORITY_DONE");
+    out_end_line();
+    // Pinned and running apps should not wait behind the rest of the scan
+    out_flush();
+    query->bulk = true;
+
+    const char *dirs[4];
+    char home_buffer[1024];
+    get_app_dirs(dirs, home_buffer, sizeof(home_buffer));
+
+    size_t job_capacity = 256;
+    query->jobs = malloc(job_capacity * sizeof(struct scan_job));
+    query->job_count = 0;
+    const char *desktop_suffix = ".desktop";
+    size_t suffix_len = strlen(desktop_suffix);
+
+    for (int i = 0; dirs[i] != NULL; ++i) {
+        DIR *d = opendir(dirs[i]);
+        if (!d) continue;
         struct dirent *dir;
         while ((dir = readdir(d)) != NULL) {
             const char *name = dir->d_name;
-            const char *desktop_suffix = ".desktop";
             size_t name_len = strlen(name);
-            size_t suffix_len = strlen(desktop_suffix);
-
-            if (name_len > suffix_len && strcmp(name + name_len - suffix_len, desktop_suffix) == 0) {
-                char *app_id = strndup(name, name_len - suffix_len);
-
-                bool is_processed = false;
-                struct processed_app_id *p_app;
-                wl_list_for_each(p_app, &processed_app_ids, link) {
-                    if (strcmp(p_app->app_id, app_id) == 0) {
-                        is_processed = true;
-                        break;
-                    }
-                }
+            if (name_len <= suffix_len || strcmp(name + name_len - suffix_len, desktop_suffix) != 0) continue;
 
-                if (!is_processed) {
-                    struct processed_app_id *new_p_app = malloc(sizeof(struct processed_app_id));
-                    new_p_app->app_id = strdup(app_id);
-                    wl_list_insert(&processed_app_ids, &new_p_app->link);
-
-                    char *app_name = get_field_from_desktop_file(app_id, "Name");
-                    char *generic_name = get_field_from_desktop_file(app_id, "GenericName");
-                    char *icon_name = get_field_from_desktop_file(app_id, "Icon");
-                    char *bin_path = get_field_from_desktop_file(app_id, "Exec");
-                    char *actions_str = get_actions_from_desktop_file(app_id);
-
-                    printf("DB APPID=\"%s\" NAME=\"%s\" GENERIC_NAME=\"%s\" ICON=\"%s\" BIN=\"%s\" ACTIONS=\"%s\"\n",
-                           app_id,
-                           app_name ? app_name : "",
-                           generic_name ? generic_name : "",
-                           icon_name ? icon_name : "",
-                           bin_path ? bin_path : "",
-                           actions_str ? actions_str : "");
-                    fflush(stdout);
-
-                    // NEW: Store in our in-memory database
-                    struct desktop_app *new_db_app = calloc(1, sizeof(struct desktop_app));
-                    new_db_app->app_id = strdup(app_id);
-                    new_db_app->name = app_name ? strdup(app_name) : strdup("");
-                    new_db_app->generic_name = generic_name ? strdup(generic_name) : strdup("");
-                    new_db_app->icon = icon_name ? strdup(icon_name) : strdup("");
-                    new_db_app->bin = bin_path ? strdup(bin_path) : strdup("");
-                    new_db_app->actions = actions_str ? strdup(actions_str) : strdup("");
-                    wl_list_insert(&state->desktop_apps, &new_db_app->link);
-
-                    free(app_name);
-                    free(generic_name);
-                    free(icon_name);
-                    free(bin_path);
-                    free(actions_str);
-                }
+            char *app_id = strndup(name, name_len - suffix_len);
+            if (!str_table_insert(&seen, app_id, NULL)) {
                 free(app_id);
+                continue;
             }
+            if (query->job_count == job_capacity) {
+                job_capacity *= 2;
+                query->jobs = realloc(query->jobs, job_capacity * sizeof(struct scan_job));
+            }
+            snprintf(path, sizeof(path), "%s/%s", dirs[i], name);
+            query->jobs[query->job_count].app_id = app_id;
+            query->jobs[query->job_count].path = strdup(path);
+            query->job_count++;
         }
         closedir(d);
     }
+    str_table_free(&seen);
+
+    long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+    int worker_count = cpus < 1 ? 1 : (cpus > MAX_SCAN_WORKERS ? MAX_SCAN_WORKERS : (int)cpus);
+    if ((size_t)worker_count > query->job_count) worker_count = query->job_count > 0 ? (int)query->job_count : 1;
+
+    query->active = true;
+    atomic_store(&query->next_job, 0);
+    atomic_store(&query->cancelled, false);
+    atomic_store(&query->workers_running, worker_count);
+    query->worker_count = 0;
+    for (int i = 0; i < worker_count; ++i) {
+        if (pthread_create(&query->workers[query->worker_count], NULL, scan_worker, query) != 0) {
+            atomic_fetch_sub(&query->workers_running, 1);
+            continue;
+        }
+        query->worker_count++;
+    }
+    if (query->worker_count == 0) {
+        // No threads available: parse inline rather than never finishing
+        atomic_store(&query->workers_running, 1);
+        scan_worker(query);
+    }
+}
 
-    struct processed_app_id *p_app, *tmp;
-    wl_list_for_each_safe(p_app, tmp, &processed_app_ids, link) {
-        wl_list_remove(&p_app->link);
-        free(p_app->app_id);
-        free(p_app);
+// --- Collects entries handed back by the workers; returns true once the scan is complete ---
+bool drain_desktop_query(struct client_state *state) {
+    struct desktop_query *query = &state->query;
+    uint64_t count;
+    if (read(query->event_fd, &count, sizeof(count)) < 0) {
+        // EAGAIN: woken for a result already drained
+    }
+    if (!query->active) return false;
+
+    // Workers append their last result before decrementing, so checking first is race-free
+    bool finished = atomic_load(&query->workers_running) == 0;
+
+    struct wl_list ready;
+    wl_list_init(&ready);
+    pthread_mutex_lock(&query->lock);
+    wl_list_insert_list(&ready, &query->results);
+    wl_list_init(&query->results);
+    pthread_mutex_unlock(&query->lock);
+
+    struct desktop_app *app, *tmp;
+    wl_list_for_each_safe(app, tmp, &ready, link) {
+        wl_list_remove(&app->link);
+        emit_desktop_app(state, app);
+    }
+
+    if (finished) {
+        state->db_generation = query->generation;
+        stats.queries++;
+        stats.last_query_ms = (monotonic_us() - query->started_us) / 1000;
+        histogram_add(&stats.query_ms, stats.last_query_ms);
+        if (!query->quiet) {
+            char path[1024];
+            if (write_db_snapshot(state, path, sizeof(path))) {
+                out_printf("DB_SNAPSHOT");
+                out_field("PATH", path);
+                out_printf(" GEN=%016llx", (unsigned long long)query->generation);
+                out_end_line();
+            } else {
+                // No writable runtime directory: fall back to one line per entry
+                wl_list_for_each(app, &state->desktop_apps, link) print_desktop_app(app);
+            }
+        }
+        end_desktop_query(query);
     }
+    return finished;
 }
 
 // --- Wayland Listener Callbacks ---
+static bool str_equal(const char *a, const char *b) {
+    return strcmp(a ? a : "", b ? b : "") == 0;
+}
+
 static void toplevel_handle_title(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, const char *title) {
-    struct toplevel *toplevel = data; free(toplevel->title); toplevel->title = strdup(title);
+    struct toplevel *toplevel = data;
+    stats.events[EVENT_TITLE]++;
+    if (str_equal(toplevel->title, title)) return;
+    free(toplevel->title); toplevel->title = strdup(title);
+    toplevel->identity_changed = true; // Titles feed the app_id fallback
 }
 static void toplevel_handle_app_id(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, const char *app_id) {
-    struct toplevel *toplevel = data; free(toplevel->app_id); toplevel->app_id = strdup(app_id);
+    struct toplevel *toplevel = data;
+    stats.events[EVENT_APP_ID]++;
+    if (str_equal(toplevel->app_id, app_id)) return;
+    free(toplevel->app_id); toplevel->app_id = strdup(app_id);
+    toplevel->identity_changed = true;
 }
 static void toplevel_handle_state(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, struct wl_array *s) {
     struct toplevel *toplevel = data; toplevel->window_state = 0; uint32_t *entry;
-    wl_array_for_each(entry, s) { toplevel->window_state |= *entry; }
+    stats.events[EVENT_STATE]++;
+    wl_array_for_each(entry, s) { if (*entry < 32) toplevel->window_state |= 1u << *entry; }
 }
 
-static void toplevel_handle_done(void *data, struct zwlr_foreign_toplevel_handle_v1 *h) {
-    struct toplevel *toplevel = data;
-    struct client_state *state = toplevel->state;
-
-    // --- NEW MATCHING LOGIC ---
-    char *final_app_id = toplevel->app_id;
-    bool direct_match_found = false;
+// --- Comma-separated output ids, e.g. "0,2"; empty while the window is on none ---
+static void format_outputs_string(struct toplevel *toplevel, char *buffer, size_t len) {
+    size_t used = 0;
+    buffer[0] = '\0';
+    for (int i = 0; i < toplevel->output_count && used < len; i++) {
+        used += snprintf(buffer + used, len - used, i ? ",%u" : "%u", toplevel->outputs[i]);
+    }
+}
 
+// --- Maps a toplevel to a desktop entry app_id, falling back to its title ---
+static const char *resolve_app_id(struct client_state *state, struct toplevel *toplevel) {
     // Phase 1: Try for a direct match with the Wayland-provided app_id
-    if (toplevel->app_id) {
-        struct desktop_app *app;
-        wl_list_for_each(app, &state->desktop_apps, link) {
-            if (strcmp(app->app_id, toplevel->app_id) == 0) {
-                direct_match_found = true;
-                break;
-            }
-        }
+    if (toplevel->app_id && str_table_contains(&state->apps_by_id, toplevel->app_id)) {
+        stats.matched_app_id++;
+        return toplevel->app_id;
     }
-
     // Phase 2: If no direct match, fallback to matching by the window title
-    if (!direct_match_found && toplevel->title) {
-        struct desktop_app *app;
-        wl_list_for_each(app, &state->desktop_apps, link) {
-            if (app->name && strcmp(app->name, "") != 0 && strcmp(app->name, toplevel->title) == 0) {
-                final_app_id = app->app_id; // Success! Use the correct app_id from the .desktop file
-                break;
-            }
+    if (toplevel->title && toplevel->title[0] != '\0') {
+        struct desktop_app *app = str_table_get(&state->apps_by_name, toplevel->title);
+        if (app) {
+            stats.matched_title++;
+            return app->app_id; // Use the correct app_id from the .desktop file
         }
     }
-    // --- END OF NEW LOGIC ---
+    stats.matched_none++;
+    return toplevel->app_id;
+}
+
+// --- Emits an UPDATE carrying only the fields that changed since the last one.
+// --- force_resolve reruns app_id matching even if app_id and title are unchanged ---
+static void refresh_toplevel(struct client_state *state, struct toplevel *toplevel, bool force_resolve) {
+    const char *app_id = toplevel->last_app_id;
+    if (!toplevel->emitted || toplevel->identity_changed || force_resolve) {
+        app_id = resolve_app_id(state, toplevel);
+    }
+    toplevel->identity_changed = false;
 
-    char state_str[256];
-    format_state_string(toplevel->window_state, state_str, sizeof(state_str));
+    char outputs_str[OUTPUTS_STRING_SIZE];
+    format_outputs_string(toplevel, outputs_str, sizeof(outputs_str));
 
-    printf("UPDATE ID=%u APPID=\"%s\" STATE=\"%s\" TITLE=\"%s\"\n",
-           toplevel->id,
-           final_app_id ? final_app_id : "", // Use the potentially corrected app_id
-           state_str,
-           toplevel->title ? toplevel->title : "");
-    fflush(stdout);
+    uint32_t mask = 0;
+    if (!toplevel->emitted) mask = FIELD_ALL;
+    if (!str_equal(app_id, toplevel->last_app_id)) mask |= FIELD_APPID;
+    if (toplevel->window_state != toplevel->last_state) mask |= FIELD_STATE;
+    if (!str_equal(toplevel->title, toplevel->last_title)) mask |= FIELD_TITLE;
+    if (!str_equal(outputs_str, toplevel->last_outputs)) mask |= FIELD_OUTPUTS;
+    if (mask == 0) {
+        stats.updates_suppressed++;
+        return;
+    }
+
+    out_printf("UPDATE ID=%u MASK=%u", toplevel->id, mask);
+    if (mask & FIELD_APPID) {
+        char *copy = strdup(app_id ? app_id : ""); // app_id may alias last_app_id
+        free(toplevel->last_app_id);
+        toplevel->last_app_id = copy;
+        out_field("APPID", copy); // Use the potentially corrected app_id
+    }
+    if (mask & FIELD_STATE) {
+        char state_str[256];
+        format_state_string(toplevel->window_state, state_str, sizeof(state_str));
+        toplevel->last_state = toplevel->window_state;
+        out_field("STATE", state_str);
+    }
+    if (mask & FIELD_TITLE) {
+        free(toplevel->last_title);
+        toplevel->last_title = strdup(toplevel->title ? toplevel->title : "");
+        out_field("TITLE", toplevel->last_title);
+    }
+    if (mask & FIELD_OUTPUTS) {
+        free(toplevel->last_outputs);
+        toplevel->last_outputs = strdup(outputs_str);
+        out_field("OUTPUTS", outputs_str);
+    }
+    out_end_line();
+    toplevel->emitted = true;
+    stats.updates_emitted++;
+}
+
+static void toplevel_handle_done(void *data, struct zwlr_foreign_toplevel_handle_v1 *h) {
+    struct toplevel *toplevel = data;
+    stats.events[EVENT_DONE]++;
+    refresh_toplevel(toplevel->state, toplevel, false);
 }
 
 static void toplevel_handle_closed(void *data, struct zwlr_foreign_toplevel_handle_v1 *h) {
     struct toplevel *toplevel = data;
-    printf("CLOSED ID=%u\n", toplevel->id); fflush(stdout);
+    stats.events[EVENT_CLOSED]++;
+    out_printf("CLOSED ID=%u", toplevel->id);
+    out_end_line();
     wl_list_remove(&toplevel->link);
     zwlr_foreign_toplevel_handle_v1_destroy(toplevel->handle);
-    free(toplevel->title); free(toplevel->app_id); free(toplevel);
+    free(toplevel->title); free(toplevel->app_id);
+    free(toplevel->last_title); free(toplevel->last_app_id); free(toplevel->last_outputs);
+    free(toplevel);
+}
+
+static struct output *find_output(struct client_state *state, struct wl_output *wl_output) {
+    struct output *output;
+    wl_list_for_each(output, &state->outputs, link) {
+        if (output->wl_output == wl_output) return output;
+    }
+    return NULL;
+}
+
+static void toplevel_remove_output(struct toplevel *toplevel, uint32_t output_id) {
+    for (int i = 0; i < toplevel->output_count; i++) {
+        if (toplevel->outputs[i] != output_id) continue;
+        memmove(&toplevel->outputs[i], &toplevel->outputs[i + 1], (toplevel->output_count - i - 1) * sizeof(uint32_t));
+        toplevel->output_count--;
+        return;
+    }
+}
+
+// Membership changes are reported with the next `done`, as FIELD_OUTPUTS
+static void toplevel_handle_output_enter(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, struct wl_output *o) {
+    struct toplevel *toplevel = data;
+    stats.events[EVENT_OUTPUT_ENTER]++;
+    struct output *output = find_output(toplevel->state, o);
+    if (!output || toplevel->output_count == MAX_TOPLEVEL_OUTPUTS) return;
+    for (int i = 0; i < toplevel->output_count; i++) {
+        if (toplevel->outputs[i] == output->id) return;
+    }
+    toplevel->outputs[toplevel->output_count++] = output->id;
+}
+static void toplevel_handle_output_leave(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, struct wl_output *o) {
+    struct toplevel *toplevel = data;
+    stats.events[EVENT_OUTPUT_LEAVE]++;
+    struct output *output = find_output(toplevel->state, o);
+    if (output) toplevel_remove_output(toplevel, output->id);
 }
-static void toplevel_handle_output_enter(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, struct wl_output *o) {}
-static void toplevel_handle_output_leave(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, struct wl_output *o) {}
 static void toplevel_handle_parent(void *data, struct zwlr_foreign_toplevel_handle_v1 *h, struct zwlr_foreign_toplevel_handle_v1 *p) {}
 
 static const struct zwlr_foreign_toplevel_handle_v1_listener toplevel_handle_listener = {
@@ -336,6 +1038,7 @@ static const struct zwlr_foreign_toplevel_handle_v1_listener toplevel_handle_lis
 static void toplevel_manager_handle_toplevel(void *data, struct zwlr_foreign_toplevel_manager_v1 *m, struct zwlr_foreign_toplevel_handle_v1 *handle) {
     struct client_state *state = data;
     struct toplevel *toplevel = calloc(1, sizeof(struct toplevel));
+    stats.events[EVENT_NEW]++;
     toplevel->id = next_toplevel_id++;
     toplevel->handle = handle;
     toplevel->state = state;
@@ -345,16 +1048,82 @@ static void toplevel_manager_handle_toplevel(void *data, struct zwlr_foreign_top
 
     zwlr_foreign_toplevel_handle_v1_add_listener(handle, &toplevel_handle_listener, toplevel);
 
-    printf("NEW ID=%u\n", toplevel->id);
-    fflush(stdout);
+    out_printf("NEW ID=%u", toplevel->id);
+    out_end_line();
 }
 
-static void toplevel_manager_handle_finished(void *data, struct zwlr_foreign_toplevel_manager_v1 *m) {}
+static void toplevel_manager_handle_finished(void *data, struct zwlr_foreign_toplevel_manager_v1 *m) {
+    // The compositor will send no more toplevels; exit so the bar can respawn us
+    struct client_state *state = data;
+    state->finished = true;
+}
 
 static const struct zwlr_foreign_toplevel_manager_v1_listener toplevel_manager_listener = {
     .toplevel = toplevel_manager_handle_toplevel, .finished = toplevel_manager_handle_finished,
 };
 
+// --- Outputs ---
+static void emit_output(struct output *output, const char *event) {
+    char position[32];
+    out_printf("%s ID=%u", event, output->id);
+    out_field("NAME", output->name);
+    out_field("MAKE", output->make);
+    out_field("MODEL", output->model);
+    snprintf(position, sizeof(position), "%d", output->x);
+    out_field("X", position);
+    snprintf(position, sizeof(position), "%d", output->y);
+    out_field("Y", position);
+    out_end_line();
+}
+
+static void output_handle_geometry(void *data, struct wl_output *o, int32_t x, int32_t y, int32_t physical_width,
+                                   int32_t physical_height, int32_t subpixel, const char *make, const char *model, int32_t transform) {
+    struct output *output = data;
+    output->x = x; output->y = y;
+    free(output->make); output->make = strdup(make ? make : "");
+    free(output->model); output->model = strdup(model ? model : "");
+    // Version 1 has no `done`, so the first geometry is all we get
+    if (output->version < 2 && !output->announced) {
+        output->announced = true;
+        emit_output(output, "OUTPUT_ADDED");
+    }
+}
+static void output_handle_mode(void *data, struct wl_output *o, uint32_t flags, int32_t width, int32_t height, int32_t refresh) {}
+static void output_handle_scale(void *data, struct wl_output *o, int32_t factor) {}
+static void output_handle_name(void *data, struct wl_output *o, const char *name) {
+    struct output *output = data;
+    free(output->name); output->name = strdup(name ? name : "");
+}
+static void output_handle_description(void *data, struct wl_output *o, const char *description) {}
+static void output_handle_done(void *data, struct wl_output *o) {
+    struct output *output = data;
+    emit_output(output, output->announced ? "OUTPUT_CHANGED" : "OUTPUT_ADDED");
+    output->announced = true;
+}
+
+static const struct wl_output_listener output_listener = {
+    .geometry = output_handle_geometry, .mode = output_handle_mode, .done = output_handle_done,
+    .scale = output_handle_scale, .name = output_handle_name, .description = output_handle_description,
+};
+
+static void add_output(struct client_state *state, struct wl_registry *registry, uint32_t name, uint32_t version) {
+    struct output *output = calloc(1, sizeof(struct output));
+    output->id = next_output_id++;
+    output->global_name = name;
+    output->version = version < 4 ? version : 4; // 4 adds the connector name
+    output->wl_output = wl_registry_bind(registry, name, &wl_output_interface, output->version);
+    wl_list_insert(state->outputs.prev, &output->link);
+    wl_output_add_listener(output->wl_output, &output_listener, output);
+}
+
+static void destroy_output(struct output *output) {
+    wl_list_remove(&output->link);
+    if (output->version >= 3) wl_output_release(output->wl_output);
+    else wl_output_destroy(output->wl_output);
+    free(output->name); free(output->make); free(output->model);
+    free(output);
+}
+
 static void registry_handle_global(void *data, struct wl_registry *registry, uint32_t name, const char *interface, uint32_t version) {
     struct client_state *state = data;
     if (strcmp(interface, zwlr_foreign_toplevel_manager_v1_interface.name) == 0) {
@@ -362,9 +1131,29 @@ static void registry_handle_global(void *data, struct wl_registry *registry, uin
         zwlr_foreign_toplevel_manager_v1_add_listener(state->toplevel_manager, &toplevel_manager_listener, state);
     } else if (strcmp(interface, wl_seat_interface.name) == 0) {
         state->wl_seat = wl_registry_bind(registry, name, &wl_seat_interface, 1);
+    } else if (strcmp(interface, wl_output_interface.name) == 0) {
+        add_output(state, registry, name, version);
+    }
+}
+static void registry_handle_global_remove(void *data, struct wl_registry *registry, uint32_t name) {
+    struct client_state *state = data;
+    struct output *output, *tmp;
+    wl_list_for_each_safe(output, tmp, &state->outputs, link) {
+        if (output->global_name != name) continue;
+        if (output->announced) {
+            out_printf("OUTPUT_REMOVED ID=%u", output->id);
+            out_end_line();
+        }
+        // The compositor need not send output_leave for an output that is gone
+        struct toplevel *t;
+        wl_list_for_each(t, &state->toplevels, link) {
+            toplevel_remove_output(t, output->id);
+            if (t->emitted) refresh_toplevel(state, t, false);
+        }
+        destroy_output(output);
+        return;
     }
 }
-static void registry_handle_global_remove(void *data, struct wl_registry *registry, uint32_t name) {}
 
 static const struct wl_registry_listener registry_listener = {
     .global = registry_handle_global, .global_remove = registry_handle_global_remove,
@@ -376,9 +1165,60 @@ void handle_command(struct client_state *state, char *command) {
     if (!cmd) return;
 
     if (strcmp(cmd, "QUERY") == 0) {
-        query_desktop_files(state); // Pass state to the function
-        printf("QUERY_DONE\n");
-        fflush(stdout);
+        // "QUIET" rebuilds our own list without output (the bar's DB is current);
+        // any other arguments are app_ids to resolve before the bulk scan
+        char *priority_ids[256];
+        int priority_count = 0;
+        bool quiet = false;
+        char *arg;
+        while (priority_count < 256 && (arg = strtok(NULL, " \n")) != NULL) {
+            if (strcmp(arg, "QUIET") == 0) quiet = true;
+            else priority_ids[priority_count++] = arg;
+        }
+        begin_desktop_query(state, priority_ids, priority_count, quiet);
+        return;
+    }
+
+    if (strcmp(cmd, "ACTIONS") == 0) {
+        // Prefer the file the DB entry came from; before a QUERY, resolve it like a priority id
+        char *app_id = strtok(NULL, " \n");
+        if (!app_id) return;
+        struct desktop_app *app = str_table_get(&state->apps_by_id, app_id);
+        char path[1024];
+        if (app) emit_desktop_actions(app_id, app->path);
+        else emit_desktop_actions(app_id, find_desktop_file(app_id, path, sizeof(path)) ? path : NULL);
+        return;
+    }
+
+    if (strcmp(cmd, "SNAPSHOT") == 0) {
+        // Every toplevel with all fields as one frame, written out in a single flush.
+        // GEN is the generation of the desktop DB on disk right now, so the bar can
+        // skip a full QUERY when its own copy is still current.
+        out_printf("SNAPSHOT_BEGIN GEN=%016llx COUNT=%d", (unsigned long long)compute_db_generation(), wl_list_length(&state->toplevels));
+        out_end_line();
+        struct output *output;
+        wl_list_for_each(output, &state->outputs, link) {
+            if (output->announced) emit_output(output, "OUTPUT_ADDED");
+        }
+        // Fields are the last ones emitted; anything newer follows as an UPDATE delta
+        struct toplevel *t;
+        wl_list_for_each(t, &state->toplevels, link) {
+            char state_str[256] = "";
+            if (t->emitted) format_state_string(t->last_state, state_str, sizeof(state_str));
+            out_printf("WINDOW ID=%u", t->id);
+            out_field("APPID", t->last_app_id);
+            out_field("STATE", state_str);
+            out_field("TITLE", t->last_title);
+            out_field("OUTPUTS", t->last_outputs);
+            out_end_line();
+        }
+        out_printf("SNAPSHOT_END");
+        out_end_line();
+        return;
+    }
+
+    if (strcmp(cmd, "STATS") == 0) {
+        emit_stats(state);
         return;
     }
 
@@ -390,35 +1230,100 @@ void handle_command(struct client_state *state, char *command) {
         return;
     }
     
-    char *id_str = strtok(NULL, " \n");
-    if (!id_str) return;
-    int id = atoi(id_str);
-    
-    struct toplevel *target = NULL, *t;
-    wl_list_for_each(t, &state->toplevels, link) {
-        if (t->id == id) { 
-            target = t; 
-            break; 
+    // Window commands take one or more ids, e.g. "CLOSE 3 7 9"
+    char *id_str;
+    while ((id_str = strtok(NULL, " \n")) != NULL) {
+        uint32_t id = (uint32_t)strtoul(id_str, NULL, 10);
+        struct toplevel *target = NULL, *t;
+        wl_list_for_each(t, &state->toplevels, link) {
+            if (t->id == id) {
+                target = t;
+                break;
+            }
         }
+        if (!target) continue;
+        stats.command_targets++;
+
+        if (strcmp(cmd, "ACTIVATE") == 0) {
+            if (state->wl_seat) {
+                zwlr_foreign_toplevel_handle_v1_activate(target->handle, state->wl_seat);
+            }
+        }
+        else if (strcmp(cmd, "MINIMIZE") == 0) zwlr_foreign_toplevel_handle_v1_set_minimized(target->handle);
+        else if (strcmp(cmd, "UNMINIMIZE") == 0) zwlr_foreign_toplevel_handle_v1_unset_minimized(target->handle);
+        else if (strcmp(cmd, "CLOSE") == 0) zwlr_foreign_toplevel_handle_v1_close(target->handle);
     }
+}
 
-    if (!target) return;
+// --- Reads every complete command line available on in_fd; returns false on EOF ---
+// The bar sends each coalesced batch as one message, so a batch is one read and
+// its requests reach the compositor in a single flush.
+static bool read_commands(struct client_state *state, struct out_buffer *in) {
+    char chunk[BUS_MESSAGE_MAX];
+    ssize_t n = read(in_fd, chunk, sizeof(chunk));
+    if (n == 0) return false;
+    if (n < 0) return errno == EINTR || errno == EAGAIN;
 
-    if (strcmp(cmd, "ACTIVATE") == 0) {
-        if (state->wl_seat) {
-            zwlr_foreign_toplevel_handle_v1_activate(target->handle, state->wl_seat);
-        }
+    if (in->len + (size_t)n + 1 > in->capacity) {
+        in->capacity = (in->len + (size_t)n + 1) * 2;
+        in->data = realloc(in->data, in->capacity);
     }
-    else if (strcmp(cmd, "MINIMIZE") == 0) zwlr_foreign_toplevel_handle_v1_set_minimized(target->handle);
-    else if (strcmp(cmd, "UNMINIMIZE") == 0) zwlr_foreign_toplevel_handle_v1_unset_minimized(target->handle);
-    else if (strcmp(cmd, "CLOSE") == 0) zwlr_foreign_toplevel_handle_v1_close(target->handle);
+    memcpy(in->data + in->len, chunk, (size_t)n);
+    in->len += (size_t)n;
+
+    size_t start = 0;
+    for (size_t i = 0; i < in->len; ++i) {
+        if (in->data[i] != '\n') continue;
+        in->data[i] = '\0';
+        stats.commands_in++;
+        handle_command(state, in->data + start);
+        start = i + 1;
+    }
+    memmove(in->data, in->data + start, in->len - start);
+    in->len -= start;
+    stats.command_batches++;
+    wl_display_flush(state->wl_display);
+    return true;
+}
+
+// --- Event Bus ---
+static bool connect_event_bus(const char *path) {
+    struct sockaddr_un addr = { .sun_family = AF_UNIX };
+    if (strlen(path) >= sizeof(addr.sun_path)) {
+        fprintf(stderr, "Event bus path too long: %s\n", path);
+        return false;
+    }
+    strcpy(addr.sun_path, path);
+    int fd = socket(AF_UNIX, SOCK_SEQPACKET | SOCK_CLOEXEC, 0);
+    if (fd < 0 || connect(fd, (struct sockaddr *)&addr, sizeof(addr)) != 0) {
+        fprintf(stderr, "Failed to connect to event bus %s: %s\n", path, strerror(errno));
+        if (fd >= 0) close(fd);
+        return false;
+    }
+    in_fd = out_fd = fd;
+    out_is_message_socket = true;
+    out_printf("HELLO ROLE=daemon");
+    out_end_line();
+    out_flush();
+    return true;
 }
 
 // --- Main ---
 int main(int argc, char **argv) {
     struct client_state state = { 0 };
+    stats.started_us = monotonic_us();
     wl_list_init(&state.toplevels);
+    wl_list_init(&state.outputs);
     wl_list_init(&state.desktop_apps); // Initialize the new list
+    wl_list_init(&state.query.results);
+    pthread_mutex_init(&state.query.lock, NULL);
+    state.query.event_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    if (state.query.event_fd < 0) {
+        perror("eventfd");
+        return 1;
+    }
+    const char *bus_path = getenv("TIXBAR_SOCKET");
+    if (bus_path && *bus_path && !connect_event_bus(bus_path)) return 1;
     state.wl_display = wl_display_connect(NULL);
     if (!state.wl_display) {
         fprintf(stderr, "Failed to connect to Wayland display.\n");
@@ -431,57 +1336,94 @@ int main(int argc, char **argv) {
     wl_display_roundtrip(state.wl_display);
     wl_display_roundtrip(state.wl_display);
 
-    printf("DAEMON_READY\n");
-    fflush(stdout);
+    out_printf("DAEMON_READY");
+    out_end_line();
 
-    struct pollfd fds[2];
+    struct pollfd fds[3];
     fds[0].fd = wl_display_get_fd(state.wl_display);
     fds[0].events = POLLIN;
-    fds[1].fd = fileno(stdin);
+    fds[1].fd = in_fd;
     fds[1].events = POLLIN;
+    fds[2].fd = state.query.event_fd; // Scan workers signal parsed entries here
+    fds[2].events = POLLIN;
 
+    struct out_buffer command_buffer = { 0 };
+    int exit_code = 0;
     while (1) {
         while (wl_display_prepare_read(state.wl_display) != 0) {
             wl_display_dispatch_pending(state.wl_display);
         }
         wl_display_flush(state.wl_display);
-        int ret = poll(fds, 2, -1);
+        // Everything printed during the last dispatch, command or scan chunk goes out in one write
+        out_flush();
+        int ret = poll(fds, 3, -1);
         if (ret < 0) {
             wl_display_cancel_read(state.wl_display);
             break;
         }
         if (fds[0].revents & POLLIN) {
-            wl_display_read_events(state.wl_display);
-            wl_display_dispatch_pending(state.wl_display);
+            uint64_t dispatch_started = monotonic_us();
+            if (wl_display_read_events(state.wl_display) < 0 || wl_display_dispatch_pending(state.wl_display) < 0) {
+                fprintf(stderr, "Lost connection to the Wayland compositor.\n");
+                exit_code = 1;
+                break;
+            }
+            histogram_add(&stats.dispatch_us, monotonic_us() - dispatch_started);
         } else {
             wl_display_cancel_read(state.wl_display);
-        }
-        if (fds[1].revents & POLLIN) {
-            char *line = NULL;
-            size_t len = 0;
-            if (getline(&line, &len, stdin) != -1) {
-                handle_command(&state, line);
-            }
-            free(line);
-            if (feof(stdin)) {
+            if (fds[0].revents & (POLLHUP | POLLERR)) {
+                fprintf(stderr, "Wayland compositor hung up.\n");
+                exit_code = 1;
                 break;
             }
         }
+        if (state.finished) {
+            fprintf(stderr, "Toplevel manager finished.\n");
+            exit_code = 1;
+            break;
+        }
+        if (fds[1].revents & (POLLIN | POLLHUP)) {
+            uint64_t commands_started = monotonic_us();
+            if (!read_commands(&state, &command_buffer)) break;
+            histogram_add(&stats.command_us, monotonic_us() - commands_started);
+        }
+        if ((fds[2].revents & POLLIN) && drain_desktop_query(&state)) {
+            out_printf("QUERY_DONE GEN=%016llx", (unsigned long long)state.db_generation);
+            out_end_line();
+            // Windows that arrived before their desktop entries may match now
+            struct toplevel *t;
+            wl_list_for_each(t, &state.toplevels, link) {
+                if (t->emitted) refresh_toplevel(&state, t, true);
+            }
+        }
     }
 
-    // Clean up the cached desktop_apps list
-    struct desktop_app *app, *tmp;
-    wl_list_for_each_safe(app, tmp, &state.desktop_apps, link) {
-        wl_list_remove(&app->link);
-        free(app->app_id);
-        free(app->name);
-        free(app->generic_name);
-        free(app->icon);
-        free(app->bin);
-        free(app->actions);
-        free(app);
+    // Stop any running scan and clean up the cached desktop_apps list
+    if (state.query.active) {
+        atomic_store(&state.query.cancelled, true);
+        end_desktop_query(&state.query);
     }
-    
+    free_desktop_apps(&state.desktop_apps);
+    struct output *output, *tmp_output;
+    wl_list_for_each_safe(output, tmp_output, &state.outputs, link) destroy_output(output);
+    str_table_free(&state.apps_by_id);
+    str_table_free(&state.apps_by_name);
+    close(state.query.event_fd);
+    out_flush();
+    free(out.data);
+    free(command_buffer.data);
+    if (out_is_message_socket) close(out_fd);
+
+    fprintf(stderr, "toplevel_monitor: %llu lines, %llu bytes in %llu writes (%.1f writes per 1000 lines), %llu commands\n",
+            (unsigned long long)stats.lines_out, (unsigned long long)stats.bytes_out,
+            (unsigned long long)stats.write_calls,
+            stats.lines_out ? 1000.0 * stats.write_calls / stats.lines_out : 0.0,
+            (unsigned long long)stats.commands_in);
+    fprintf(stderr, "toplevel_monitor: %llu command batches acting on %llu windows\n",
+            (unsigned long long)stats.command_batches, (unsigned long long)stats.command_targets);
+    fprintf(stderr, "toplevel_monitor: %llu updates emitted, %llu suppressed as no-ops\n",
+            (unsigned long long)stats.updates_emitted, (unsigned long long)stats.updates_suppressed);
+
     wl_display_disconnect(state.wl_display);
-    return 0;
+    return exit_code;
 }
\ No newline at end of file
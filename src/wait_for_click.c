@@ -1,11 +1,23 @@
 #include <libinput.h>
 #include <libudev.h>
+#include <errno.h>
 #include <fcntl.h>
 #include <poll.h>
+#include <stdbool.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/un.h>
 #include <unistd.h>
 
+// Clicks are reported to the bar's event bus, and only while armed. The bar arms
+// the listener when a popup opens and disarms it when the popup closes, so an
+// idle bar is never woken. Without a bar we wait and reconnect.
+#define SOCKET_NAME "tixbar.sock"
+#define RECONNECT_INTERVAL_MS 1000
+#define CONTROL_LINE_MAX 256
+
 static int open_restricted(const char *path, int flags, void *user_data) {
     return open(path, flags);
 }
@@ -19,7 +31,100 @@ static const struct libinput_interface interface = {
     .close_restricted = close_restricted,
 };
 
-int main(void) {
+// --- Event Bus Connection ---
+
+struct bus_state {
+    const char *path;
+    int fd;
+    char line[CONTROL_LINE_MAX];
+    size_t line_len;
+    bool armed;
+};
+
+static void default_socket_path(char *buffer, size_t len) {
+    const char *runtime_dir = getenv("XDG_RUNTIME_DIR");
+    if (runtime_dir && *runtime_dir) snprintf(buffer, len, "%s/%s", runtime_dir, SOCKET_NAME);
+    else snprintf(buffer, len, "/tmp/tixbar-%u/%s", (unsigned)getuid(), SOCKET_NAME);
+}
+
+static bool bus_send(struct bus_state *bus, const char *message) {
+    return send(bus->fd, message, strlen(message), MSG_NOSIGNAL) >= 0;
+}
+
+static bool bus_connect(struct bus_state *bus) {
+    struct sockaddr_un addr = { .sun_family = AF_UNIX };
+    if (strlen(bus->path) >= sizeof(addr.sun_path)) return false;
+    strcpy(addr.sun_path, bus->path);
+    int fd = socket(AF_UNIX, SOCK_SEQPACKET | SOCK_CLOEXEC | SOCK_NONBLOCK, 0);
+    if (fd < 0) return false;
+    if (connect(fd, (struct sockaddr *)&addr, sizeof(addr)) != 0) {
+        close(fd);
+        return false;
+    }
+    bus->fd = fd;
+    bus->line_len = 0;
+    if (!bus_send(bus, "HELLO ROLE=click\n")) {
+        close(fd);
+        bus->fd = -1;
+        return false;
+    }
+    fprintf(stderr, "Connected to event bus %s\n", bus->path);
+    return true;
+}
+
+static void set_armed(struct libinput *li, struct bus_state *bus, bool armed) {
+    if (armed == bus->armed) return;
+    if (armed) {
+        if (libinput_resume(li) != 0) {
+            fprintf(stderr, "Failed to resume libinput\n");
+            return;
+        }
+    } else {
+        libinput_suspend(li);
+    }
+    bus->armed = armed;
+}
+
+static void bus_disconnect(struct libinput *li, struct bus_state *bus) {
+    close(bus->fd);
+    bus->fd = -1;
+    set_armed(li, bus, false);
+    fprintf(stderr, "Lost event bus, reconnecting\n");
+}
+
+static void handle_bus_line(struct libinput *li, struct bus_state *bus, const char *line) {
+    if (strcmp(line, "ARM") == 0) set_armed(li, bus, true);
+    else if (strcmp(line, "DISARM") == 0) set_armed(li, bus, false);
+    else if (strcmp(line, "WELCOME") == 0) return;
+    else if (line[0]) fprintf(stderr, "Unknown bus message: %s\n", line);
+}
+
+// --- Reads every pending message; returns false once the bar hangs up ---
+static bool read_bus(struct libinput *li, struct bus_state *bus) {
+    char buf[CONTROL_LINE_MAX * 4];
+    while (1) {
+        ssize_t n = recv(bus->fd, buf, sizeof(buf), 0);
+        if (n == 0) return false;
+        if (n < 0) return errno == EAGAIN || errno == EINTR;
+        for (ssize_t i = 0; i < n; i++) {
+            if (buf[i] == '\n') {
+                bus->line[bus->line_len] = '\0';
+                handle_bus_line(li, bus, bus->line);
+                bus->line_len = 0;
+            } else if (bus->line_len < CONTROL_LINE_MAX - 1) {
+                bus->line[bus->line_len++] = buf[i];
+            }
+        }
+    }
+}
+
+int main(int argc, char **argv) {
+    char socket_path[sizeof(((struct sockaddr_un *)0)->sun_path)];
+    const char *env_path = getenv("TIXBAR_SOCKET");
+    if (argc > 1) snprintf(socket_path, sizeof(socket_path), "%s", argv[1]);
+    else if (env_path && *env_path) snprintf(socket_path, sizeof(socket_path), "%s", env_path);
+    else default_socket_path(socket_path, sizeof(socket_path));
+
     struct udev *udev = udev_new();
     if (!udev) {
         fprintf(stderr, "Failed to create udev context\n");
@@ -40,32 +145,43 @@ int main(void) {
         return 1;
     }
 
-    struct pollfd fds[] = {{
-        .fd = libinput_get_fd(li),
-        .events = POLLIN,
-    }};
+    // Start disarmed; the bar arms us once a popup is open
+    struct bus_state bus = { .path = socket_path, .fd = -1, .armed = true };
+    set_armed(li, &bus, false);
+
+    struct pollfd fds[] = {
+        { .fd = libinput_get_fd(li), .events = POLLIN },
+        { .fd = -1, .events = POLLIN },
+    };
 
     while (1) {
-        int ret = poll(fds, 1, -1);
+        if (bus.fd < 0) bus_connect(&bus);
+        fds[1].fd = bus.fd;
+        int ret = poll(fds, 2, bus.fd < 0 ? RECONNECT_INTERVAL_MS : -1);
         if (ret <= 0) {
-            // Poll error or interrupted
+            // Poll error, interrupted or reconnect timeout
             continue;
         }
 
+        if (bus.fd >= 0 && fds[1].revents & (POLLIN | POLLHUP | POLLERR)) {
+            if (!read_bus(li, &bus)) bus_disconnect(li, &bus);
+        }
+
         libinput_dispatch(li);
 
         struct libinput_event *event;
         while ((event = libinput_get_event(li)) != NULL) {
             enum libinput_event_type type = libinput_event_get_type(event);
 
-            if (type == LIBINPUT_EVENT_POINTER_BUTTON) {
+            if (bus.armed && type == LIBINPUT_EVENT_POINTER_BUTTON) {
                 struct libinput_event_pointer *ev = libinput_event_get_pointer_event(event);
                 uint32_t button = libinput_event_pointer_get_button(ev);
                 uint32_t state = libinput_event_pointer_get_button_state(ev);
 
                 if (state == LIBINPUT_BUTTON_STATE_PRESSED) {
-                    printf("Detected click: button %u\n", button);
-                    fflush(stdout);  // Make sure output is sent immediately
+                    char message[64];
+                    snprintf(message, sizeof(message), "CLICK BUTTON=%u\n", button);
+                    if (!bus_send(&bus, message)) bus_disconnect(li, &bus);
                 }
             }
 
@@ -74,6 +190,7 @@ int main(void) {
     }
 
     // Cleanup never reached, but good practice
+    if (bus.fd >= 0) close(bus.fd);
     libinput_unref(li);
     udev_unref(udev);
 
@@ -0,0 +1,148 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+import json
+import os
+import sys
+import threading
+
+import metrics
+
+STATE_VERSION = 1
+# Changes within this window are written together
+WRITE_DELAY_MS = 500
+# Where older versions kept the pinned list: relative to wherever the bar was started
+LEGACY_PINNED_APPS_FILE = "pinned_apps.json"
+
+def default_state_path():
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return os.path.join(state_home, "tixbar", "state.json")
+
+class StateStore:
+    """
+    Persistent UI state (pinned apps and their order, usage counters) kept as
+    one JSON document. Loading is a single read; changes are batched for
+    WRITE_DELAY_MS, serialized on the main loop and written by a background
+    thread through a temp file, fsync and rename, so a crash leaves either
+    the old or the new file, never a torn one.
+    """
+    def __init__(self, path=None):
+        self.path = path or default_state_path()
+        self.data = {"version": STATE_VERSION}
+        self._save_source_id = None
+        # _lock only guards the pending slot, so the main loop never waits on a disk write
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending_bytes = None
+        self._wakeup = threading.Event()
+        self._writer = None
+        self.stats = {"changes": 0, "writes": 0, "write_errors": 0}
+        metrics.register("state", self.format_stats)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                self.data = json.loads(f.read())
+        except FileNotFoundError:
+            self._migrate_legacy()
+        except (OSError, ValueError) as e:
+            # Keep the unreadable file for inspection instead of overwriting it
+            print(f"Could not read {self.path} ({e}); starting with empty state", file=sys.stderr)
+            try:
+                os.replace(self.path, self.path + ".corrupt")
+            except OSError:
+                pass
+        if not isinstance(self.data, dict):
+            self.data = {}
+        self.data["version"] = STATE_VERSION
+
+    def _migrate_legacy(self):
+        try:
+            with open(LEGACY_PINNED_APPS_FILE, "r") as f:
+                pinned = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(pinned, list):
+            print(f"Migrating {LEGACY_PINNED_APPS_FILE} to {self.path}", file=sys.stderr)
+            self.data["pinned"] = [app_id for app_id in pinned if isinstance(app_id, str)]
+            self.changed()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def setdefault(self, key, default):
+        """Returns the stored value, storing default (unsaved until the next change) if missing."""
+        return self.data.setdefault(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.changed()
+
+    def record_launch(self, app_id, timestamp):
+        usage = self.data.setdefault("usage", {}).setdefault(app_id, {"launches": 0, "last_launch": 0})
+        usage["launches"] += 1
+        usage["last_launch"] = int(timestamp)
+        self.changed()
+
+    def changed(self):
+        """Schedules a write; call after mutating a value returned by get()."""
+        self.stats["changes"] += 1
+        if not self._save_source_id:
+            self._save_source_id = GLib.timeout_add(WRITE_DELAY_MS, self._save)
+
+    def _save(self):
+        self._save_source_id = None
+        # Serializing here gives the writer a consistent snapshot without sharing self.data
+        payload = json.dumps(self.data, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._pending_bytes = payload
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run_writer, name="state-writer", daemon=True)
+            self._writer.start()
+        self._wakeup.set()
+        return False
+
+    def _run_writer(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self._write_pending()
+
+    def _write_pending(self):
+        # Only the newest snapshot matters; older ones are simply replaced
+        with self._write_lock:
+            with self._lock:
+                payload, self._pending_bytes = self._pending_bytes, None
+            if payload is None:
+                return
+            try:
+                self._write_atomically(payload)
+                self.stats["writes"] += 1
+            except OSError as e:
+                self.stats["write_errors"] += 1
+                print(f"Error saving state to {self.path}: {e}", file=sys.stderr)
+
+    def _write_atomically(self, payload):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def flush(self):
+        """Writes any pending change synchronously; used at exit."""
+        if self._save_source_id:
+            GLib.source_remove(self._save_source_id)
+            self._save()
+        self._write_pending()
+
+    def format_stats(self):
+        return f"{self.stats['changes']} changes in {self.stats['writes']} writes, {self.stats['write_errors']} errors"
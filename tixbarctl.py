@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Sends one request to a running bar over its event bus and prints the reply.
+
+    tixbarctl.py CMD toggle-menu
+    tixbarctl.py STATS
+    tixbarctl.py WATCHDOG    (with TIXBAR_WATCHDOG_MS set for the bar)
+    tixbarctl.py PROFILE start|stop
+    tixbarctl.py TRACEMALLOC start|snapshot|stop
+    tixbarctl.py OBJECTS
+    tixbarctl.py SOAK [cycles]
+    tixbarctl.py WAKEUPS [seconds]
+"""
+import os
+import socket
+import sys
+
+# Must match event_bus.default_socket_path; kept free of gi so it starts instantly.
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/tixbar-{os.getuid()}"
+    return os.path.join(runtime_dir, "tixbar.sock")
+
+def request(line, path=None, timeout=5.0):
+    """Returns (ok, body) for a single request line."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or os.environ.get("TIXBAR_SOCKET") or default_socket_path())
+        sock.send(b"HELLO ROLE=client\n")
+        if sock.recv(4096).strip() != b"WELCOME":
+            raise ConnectionError("bar refused the connection")
+        sock.send((line + "\n").encode("utf-8"))
+        status, _, body = sock.recv(256 * 1024).decode("utf-8", "replace").partition("\n")
+        return status == "OK", status[4:] if status.startswith("ERR ") else body.rstrip("\n")
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    try:
+        ok, body = request(" ".join(argv[1:]))
+    except OSError as e:
+        print(f"tixbarctl: {e}", file=sys.stderr)
+        return 1
+    if body:
+        print(body, file=sys.stdout if ok else sys.stderr)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,166 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib, GObject
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+# Opt-in: TIXBAR_WATCHDOG_MS=<threshold> enables the watchdog with that stall threshold
+ENV_THRESHOLD = "TIXBAR_WATCHDOG_MS"
+HEARTBEAT_MS = 50
+STALL_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000)
+# Stacks of the most recent stalls kept for the report
+KEPT_STALLS = 8
+
+def callback_name(callback):
+    return getattr(callback, "__qualname__", None) or repr(callback)
+
+class Watchdog:
+    """
+    Detects main loop stalls. A GLib heartbeat stamps the time every
+    HEARTBEAT_MS; a thread notices when the stamp is older than the
+    threshold and captures the main thread's Python stack while it is still
+    stuck. Signal handlers and GLib source callbacks are wrapped so each stall
+    is attributed to the callback that was running.
+    """
+    def __init__(self, threshold_ms):
+        self.threshold_ms = threshold_ms
+        self._main_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._reported_beat = None
+        self._current = None  # Name of the wrapped callback running on the main loop
+        self._stopped = threading.Event()
+        self._thread = None
+        self._heartbeat_id = None
+        self._originals = []
+        self.stalls = metrics.Histogram(STALL_BUCKETS_MS)
+        # callback name -> Histogram of its runs above the threshold
+        self.slow_callbacks = {}
+        self.recent_stalls = collections.deque(maxlen=KEPT_STALLS)
+        metrics.register("watchdog", self.format_stats)
+
+    @classmethod
+    def from_environment(cls):
+        """A Watchdog if ENV_THRESHOLD is set to a positive number, else None."""
+        try:
+            threshold_ms = int(os.environ.get(ENV_THRESHOLD, "0"))
+        except ValueError:
+            print(f"Ignoring {ENV_THRESHOLD}: not a number of milliseconds", file=sys.stderr)
+            return None
+        return cls(threshold_ms) if threshold_ms > 0 else None
+
+    def start(self):
+        """Call from the main thread before the bar's widgets connect their handlers."""
+        self._last_beat = time.monotonic()
+        self._heartbeat_id = GLib.timeout_add(HEARTBEAT_MS, self._on_heartbeat)
+        self._install_wrappers()
+        self._thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_id:
+            GLib.source_remove(self._heartbeat_id)
+            self._heartbeat_id = None
+        for owner, name, original in self._originals:
+            setattr(owner, name, original)
+        self._originals = []
+
+    # === WRAPPING ======================================================
+
+    def wrap(self, name, callback):
+        """Returns callback instrumented to record runs above the threshold under name."""
+        def wrapped(*args):
+            previous, self._current = self._current, name
+            started = time.monotonic()
+            try:
+                return callback(*args)
+            finally:
+                self._current = previous
+                elapsed_ms = (time.monotonic() - started) * 1000.0
+                if elapsed_ms >= self.threshold_ms:
+                    histogram = self.slow_callbacks.get(name)
+                    if histogram is None:
+                        histogram = self.slow_callbacks[name] = metrics.Histogram(STALL_BUCKETS_MS)
+                    histogram.add(elapsed_ms)
+        return wrapped
+
+    def _install_wrappers(self):
+        watchdog = self
+
+        def patch(owner, name, replacement):
+            self._originals.append((owner, name, getattr(owner, name)))
+            setattr(owner, name, replacement)
+
+        def source_adder(original):
+            def add_source(*args, **kwargs):
+                # The first callable argument is the callback; user data follows it
+                args = list(args)
+                for i, arg in enumerate(args):
+                    if callable(arg):
+                        args[i] = watchdog.wrap(f"{original.__name__} {callback_name(arg)}", arg)
+                        break
+                return original(*args, **kwargs)
+            return add_source
+
+        for name in ("idle_add", "timeout_add", "timeout_add_seconds", "io_add_watch"):
+            patch(GLib, name, source_adder(getattr(GLib, name)))
+
+        def connector(original):
+            def connect(obj, signal, handler, *args):
+                name = f"{type(obj).__name__}::{signal} {callback_name(handler)}"
+                return original(obj, signal, watchdog.wrap(name, handler), *args)
+            return connect
+
+        for name in ("connect", "connect_after"):
+            patch(GObject.Object, name, connector(getattr(GObject.Object, name)))
+
+    # === DETECTION =====================================================
+
+    def _on_heartbeat(self):
+        now = time.monotonic()
+        stalled_ms = (now - self._last_beat) * 1000.0 - HEARTBEAT_MS
+        self._last_beat = now
+        if stalled_ms >= self.threshold_ms:
+            self.stalls.add(stalled_ms)
+            if self.recent_stalls and self.recent_stalls[-1]["duration_ms"] is None:
+                self.recent_stalls[-1]["duration_ms"] = stalled_ms
+        return True
+
+    def _run(self):
+        interval = min(self.threshold_ms, HEARTBEAT_MS * 2) / 2000.0
+        while not self._stopped.wait(interval):
+            last_beat = self._last_beat
+            lag_ms = (time.monotonic() - last_beat) * 1000.0
+            if lag_ms < self.threshold_ms + HEARTBEAT_MS or last_beat == self._reported_beat:
+                continue
+            # Report each stall once, while the main thread is still inside it
+            self._reported_beat = last_beat
+            frame = sys._current_frames().get(self._main_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            callback = self._current or "unknown (not a wrapped callback)"
+            self.recent_stalls.append({"callback": callback, "stack": stack, "at": time.time(), "duration_ms": None})
+            print(f"Main loop stalled for {lag_ms:.0f} ms in {callback}:\n{stack}", file=sys.stderr)
+
+    # === REPORTING =====================================================
+
+    def format_stats(self):
+        worst = max(self.slow_callbacks.items(), key=lambda item: item[1].maximum, default=None)
+        worst_text = f"; slowest {worst[0]} at {worst[1].maximum:.0f} ms" if worst else ""
+        return f"stalls over {self.threshold_ms} ms: {self.stalls.format(' ms')}{worst_text}"
+
+    def report(self, args=""):
+        """Full report for the WATCHDOG bus request: histograms and the recent stall stacks."""
+        lines = [self.format_stats(), "", "Slow callbacks:"]
+        by_total = sorted(self.slow_callbacks.items(), key=lambda item: item[1].total, reverse=True)
+        lines += [f"  {name}: {histogram.format(' ms')}" for name, histogram in by_total] or ["  none"]
+        for stall in reversed(self.recent_stalls):
+            duration = f"{stall['duration_ms']:.0f} ms" if stall["duration_ms"] is not None else "ongoing"
+            when = time.strftime("%H:%M:%S", time.localtime(stall["at"]))
+            lines += ["", f"Stall at {when} ({duration}) in {stall['callback']}:", stall["stack"].rstrip()]
+        return "\n".join(lines)
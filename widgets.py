@@ -10,6 +10,10 @@ from fabric.widgets.revealer import Revealer
 from fabric.widgets.scrolledwindow import ScrolledWindow
 from fabric.widgets.stack import Stack
 
+import scheduler
+
+BLINK_INTERVAL_MS = 500
+
 
 # ===================================================================
 # === FAKE ENTRY (UTILITY WIDGET) ===================================
@@ -18,6 +22,7 @@ from fabric.widgets.stack import Stack
 class FakeEntry(Gtk.Overlay):
     def __init__(self, placeholder="", on_text_changed=None):
         super().__init__(name="fake-entry")
+        self._blink_timer = None
         self.text_buffer = ""
         self.placeholder = placeholder
         self.on_text_changed = on_text_changed
@@ -34,11 +39,21 @@ class FakeEntry(Gtk.Overlay):
         self.show_all()
 
     def _setup_blinker(self):
-        def _toggle_cursor():
-            if not self.get_window(): return GLib.SOURCE_REMOVE
-            self.cursor.set_opacity(0.0 if self.cursor.get_opacity() == 1.0 else 1.0)
-            return GLib.SOURCE_CONTINUE
-        GLib.timeout_add(500, _toggle_cursor)
+        # Blink only while on screen; destroying a mapped entry unmaps it first
+        self.connect("map", self._start_blinking)
+        self.connect("unmap", self._stop_blinking)
+
+    def _start_blinking(self, widget):
+        if self._blink_timer is None:
+            self._blink_timer = scheduler.every(BLINK_INTERVAL_MS, self._toggle_cursor)
+
+    def _stop_blinking(self, widget):
+        if self._blink_timer:
+            self._blink_timer.cancel()
+            self._blink_timer = None
+
+    def _toggle_cursor(self):
+        self.cursor.set_opacity(0.0 if self.cursor.get_opacity() == 1.0 else 1.0)
 
     def _update_label(self):
         if self.text_buffer == "":